@@ -1,20 +1,63 @@
 import openai
+import asyncio
 import json
 import os
-from typing import List, Dict
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import List, Dict, Iterator, AsyncIterator
+from async_engine import AsyncEngine
+from client_pool import ClientPool
+from response_cache import ResponseCache
+from context_budget import trim_history, count_tokens, estimate_tokens
+from failover import FailoverPolicy
+from rate_limit import ProviderRateLimiter, RetryPolicy
+from metrics import MetricsExporter, RequestMetrics
+from tracing import Tracer
+from config import DATA_DIR
+
+# 采样温度
+TEMPERATURE = 0.7
 
 class APIManager:
     def __init__(self, config_manager):
         self.config_manager = config_manager
         self.clients = {}  # 存储不同AI的客户端
         self.current_ai_id = None
+        # 所有请求共享的后台事件循环
+        self.engine = AsyncEngine(config_manager.get("max_concurrent_requests", 4))
+        # 按(base_url, api_key)复用的客户端连接池，配置重载时保持不变
+        self.pool = ClientPool(config_manager.get("http_pool"))
+        # 可选的响应缓存（默认关闭）
+        self.cache = ResponseCache(os.path.join(DATA_DIR, "cache"), config_manager.get("response_cache"))
+        # 备用AI、对冲请求和熔断
+        self.failover = FailoverPolicy(config_manager)
+        # 单个AI内的重试和限流
+        self.retry = RetryPolicy(config_manager.get("retry"))
+        self.limiter = ProviderRateLimiter()
+        # 拒绝stream_options参数的AI，流式请求不再要求返回usage（输出token数改为估算）
+        self._no_stream_usage = set()
+        # 每次请求的耗时、首token时间、token数和错误统计，可按配置导出
+        self.metrics = RequestMetrics(config_manager.get("metrics"))
+        self.metrics_exporter = MetricsExporter(self.metrics, DATA_DIR)
+        # 可选的分阶段性能追踪（默认关闭）
+        self.tracer = Tracer(config_manager.get("tracing"))
         self.update_config(config_manager)
         
     def update_config(self, config_manager):
         """更新API配置"""
         self.config_manager = config_manager
-        # 重新加载所有AI配置
+        # 连接池参数变化时才重建HTTP传输层
+        old_http_client = self.pool.configure(config_manager.get("http_pool"))
+        if old_http_client is not None:
+            self.engine.submit(old_http_client.aclose(), bounded=False)
+        self.cache.configure(config_manager.get("response_cache"))
+        self.failover.configure(config_manager)
+        self.retry.configure(config_manager.get("retry"))
+        self.metrics.configure(config_manager.get("metrics"))
+        self.metrics_exporter.configure(self.metrics.settings)
+        self.tracer.configure(config_manager.get("tracing"))
+        # 重新加载所有AI配置（客户端从连接池中获取，已建立的连接会被复用）
         self.clients = {}
+        self._no_stream_usage.clear()
         default_ai_id, default_ai_config = config_manager.get_default_ai()
         if default_ai_id and default_ai_config:
             self.current_ai_id = default_ai_id
@@ -26,10 +69,7 @@ class APIManager:
         base_url = ai_config.get("base_url", "https://api.openai.com/v1")
         
         if api_key:
-            self.clients[ai_id] = openai.OpenAI(
-                api_key=api_key,
-                base_url=base_url
-            )
+            self.clients[ai_id] = self.pool.get(base_url, api_key)
         elif ai_id in self.clients:
             del self.clients[ai_id]
             
@@ -58,8 +98,10 @@ class APIManager:
             return ai_config.get("name", "未知AI")
         return "未选择AI"
         
-    def get_response(self, messages: List[Dict[str, str]], max_tokens: int = 1000) -> str:
-        """获取AI响应"""
+    def _primary_ai_id(self, ai_id=None):
+        """确定本次请求的主AI（未指定时使用当前AI）"""
+        if ai_id:
+            return ai_id
         if not self.current_ai_id or self.current_ai_id not in self.clients:
             # 尝试使用默认AI
             default_ai_id, default_ai_config = self.config_manager.get_default_ai()
@@ -69,39 +111,250 @@ class APIManager:
                     self._create_client(default_ai_id, default_ai_config)
             else:
                 raise Exception("未配置AI或API密钥未设置")
-                
-        if self.current_ai_id not in self.clients:
+        return self.current_ai_id
+        
+    def _get_client(self, ai_id):
+        """获取指定AI的客户端和配置"""
+        ai_config = self.config_manager.get_ai(ai_id)
+        if not ai_config:
+            raise Exception("无法获取AI配置")
+            
+        if ai_id not in self.clients:
+            self._create_client(ai_id, ai_config)
+        if ai_id not in self.clients:
             raise Exception("AI客户端未正确初始化")
             
+        return self.clients[ai_id], ai_config
+        
+    def _apply_context_budget(self, messages, max_tokens, ai_config):
+        """按AI配置的上下文预算裁剪要发送的历史"""
+        return trim_history(
+            messages,
+            max_context_tokens=int(ai_config.get("max_context_tokens") or 0),
+            reserve_tokens=max_tokens,
+            max_messages=int(ai_config.get("max_history_messages") or 0)
+        )
+        
+    async def _cache_lookup(self, client, model, messages, max_tokens):
+        """查询响应缓存，返回(缓存键, 缓存内容)；未启用缓存时缓存键为None"""
+        if not self.cache.enabled:
+            return None, None
+        cache_key = self.cache.make_key(model, str(client.base_url), messages,
+                                        max_tokens=max_tokens, temperature=TEMPERATURE)
+        return cache_key, await asyncio.to_thread(self.cache.get, cache_key)
+        
+    async def aget_response(self, messages: List[Dict[str, str]], max_tokens: int = 1000, ai_id: str = None) -> str:
+        """获取AI响应（协程版本），主AI失败或过慢时按配置切换到备用AI"""
+        primary = self._primary_ai_id(ai_id)
+        return await self.failover.run(
+            primary, lambda target: self._complete_once(target, messages, max_tokens), kind="complete"
+        )
+        
+    async def _complete_once(self, ai_id, messages, max_tokens) -> str:
+        """向指定AI发送一次非流式请求"""
+        client, ai_config = self._get_client(ai_id)
+        model = ai_config.get("model", "gpt-3.5-turbo")
+        messages = self._apply_context_budget(messages, max_tokens, ai_config)
+        cache_key, cached = await self._cache_lookup(client, model, messages, max_tokens)
+        if cached is not None:
+            self.metrics.record_cache_hit(ai_id, ai_config)
+            return cached
+        
+        record = self.metrics.start(ai_id, ai_config, "complete")
+        trace_start = self.tracer.now()
         try:
-            # 获取当前AI配置
-            ai_config = self.config_manager.get_ai(self.current_ai_id)
-            if not ai_config:
-                raise Exception("无法获取AI配置")
-                
-            model = ai_config.get("model", "gpt-3.5-turbo")
-            client = self.clients[self.current_ai_id]
-            
-            response = client.chat.completions.create(
+            record.throttled = await self.limiter.acquire(ai_id, ai_config, count_tokens(messages) + max_tokens)
+            request_start = self._trace_rate_limit(trace_start)
+            response = await self.retry.call(ai_id, lambda: client.chat.completions.create(
                 model=model,
                 messages=messages,
                 max_tokens=max_tokens,
-                temperature=0.7
-            )
+                temperature=TEMPERATURE
+            ), record)
+            self.tracer.add("send_request", request_start, cat="net", retries=record.retries)
+            
+            text = response.choices[0].message.content.strip()
+            record.finish(*self._usage(response, messages, text))
+            if cache_key:
+                await asyncio.to_thread(self.cache.put, cache_key, text)
+            return text
+            
+        except BaseException as e:
+            record.fail(e)
+            if not isinstance(e, Exception):
+                raise
+            if isinstance(e, openai.APIError):
+                raise Exception(f"API调用错误: {str(e)}") from e
+            raise Exception(f"请求失败: {str(e)}") from e
+        finally:
+            self.tracer.add("complete_response", trace_start, cat="net", ai=ai_config.get("name", ""), model=model)
+            
+    def _trace_rate_limit(self, trace_start):
+        """记录在限流器中等待的时间（超过1ms时），返回发送请求的开始时间"""
+        request_start = self.tracer.now()
+        if request_start - trace_start > 0.001:
+            self.tracer.add("rate_limit_wait", trace_start, request_start, cat="net")
+        return request_start
+        
+    @staticmethod
+    def _usage(response, messages, text):
+        """返回(输入token数, 输出token数)：优先使用服务端返回的usage，否则估算"""
+        usage = getattr(response, "usage", None)
+        if usage is not None and usage.completion_tokens is not None:
+            return usage.prompt_tokens or 0, usage.completion_tokens
+        return count_tokens(messages), estimate_tokens(text)
             
-            return response.choices[0].message.content.strip()
+    async def astream_response(self, messages: List[Dict[str, str]], max_tokens: int = 1000,
+                               ai_id: str = None, use_backups: bool = True) -> AsyncIterator[str]:
+        """以流式方式获取AI响应（异步生成器版本），逐段返回生成的文本"""
+        primary = self._primary_ai_id(ai_id)
+        # 故障转移和对冲只作用于首段文本到达之前
+        first, stream = await self.failover.run(
+            primary, lambda target: self._open_stream(target, messages, max_tokens),
+            kind="stream", discard=self._discard_stream, use_backups=use_backups
+        )
+        try:
+            if first:
+                yield first
+            async for delta in stream:
+                yield delta
+        finally:
+            await stream.aclose()
+            
+    async def _open_stream(self, ai_id, messages, max_tokens):
+        """向指定AI发起流式请求，等到首段文本后返回(首段文本, 剩余的流)"""
+        stream = self._stream_once(ai_id, messages, max_tokens)
+        try:
+            first = await stream.__anext__()
+        except StopAsyncIteration:
+            first = ""
+        except BaseException:
+            await stream.aclose()
+            raise
+        return first, stream
+        
+    async def _discard_stream(self, opened):
+        """关闭对冲落败的流"""
+        await opened[1].aclose()
+        
+    async def _stream_once(self, ai_id, messages, max_tokens) -> AsyncIterator[str]:
+        """向指定AI发送一次流式请求"""
+        client, ai_config = self._get_client(ai_id)
+        model = ai_config.get("model", "gpt-3.5-turbo")
+        messages = self._apply_context_budget(messages, max_tokens, ai_config)
+        cache_key, cached = await self._cache_lookup(client, model, messages, max_tokens)
+        if cached is not None:
+            self.metrics.record_cache_hit(ai_id, ai_config)
+            yield cached
+            return
+        
+        record = self.metrics.start(ai_id, ai_config, "stream")
+        trace_start = self.tracer.now()
+        first_at = None
+        parts = []
+        try:
+            record.throttled = await self.limiter.acquire(ai_id, ai_config, count_tokens(messages) + max_tokens)
+            request_start = self._trace_rate_limit(trace_start)
+            # 只在建立流之前重试，已输出的内容不会重复；要求服务端在最后一段返回usage
+            def create(options):
+                return client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=TEMPERATURE,
+                    stream=True,
+                    **options
+                )
+            options = {} if ai_id in self._no_stream_usage else {"stream_options": {"include_usage": True}}
+            try:
+                stream = await self.retry.call(ai_id, lambda: create(options), record)
+            except (openai.BadRequestError, openai.UnprocessableEntityError):
+                if not options:
+                    raise
+                # 部分兼容服务端不支持stream_options：不带该参数重试一次，成功后记住
+                stream = await self.retry.call(ai_id, lambda: create({}), record)
+                self._no_stream_usage.add(ai_id)
+            # 建立连接、发送请求并收到响应头（包括重试）
+            headers_at = self.tracer.now()
+            self.tracer.add("send_request", request_start, headers_at, cat="net", retries=record.retries)
             
-        except openai.APIError as e:
-            raise Exception(f"API调用错误: {str(e)}")
-        except Exception as e:
-            raise Exception(f"请求失败: {str(e)}")
+            # 部分服务端在最后一段中返回usage
+            usage_chunk = None
+            try:
+                async for chunk in stream:
+                    if getattr(chunk, "usage", None) is not None:
+                        usage_chunk = chunk
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        if first_at is None:
+                            first_at = self.tracer.now()
+                            self.tracer.add("first_token", headers_at, first_at, cat="net")
+                        record.first_token()
+                        parts.append(delta)
+                        yield delta
+            finally:
+                # 提前结束或被取消时立即释放连接
+                await stream.close()
+                
+            text = "".join(parts).strip()
+            record.finish(*self._usage(usage_chunk, messages, text))
+            # 只缓存完整生成的响应
+            if cache_key:
+                await asyncio.to_thread(self.cache.put, cache_key, text)
+                
+        except BaseException as e:
+            # 被停止或对冲落败时（GeneratorExit、CancelledError）记为取消，不包装异常
+            record.fail(e)
+            if not isinstance(e, Exception):
+                raise
+            if isinstance(e, openai.APIError):
+                raise Exception(f"API调用错误: {str(e)}") from e
+            raise Exception(f"请求失败: {str(e)}") from e
+        finally:
+            if first_at is not None:
+                self.tracer.add("stream", first_at, cat="net", chunks=len(parts))
+            self.tracer.add("stream_response", trace_start, cat="net", ai=ai_config.get("name", ""), model=model)
             
+    def get_response(self, messages: List[Dict[str, str]], max_tokens: int = 1000, ai_id: str = None) -> str:
+        """获取AI响应（在后台事件循环中执行并同步等待结果）"""
+        return self.engine.run(self.aget_response(messages, max_tokens, ai_id))
+        
+    def stream_response(self, messages: List[Dict[str, str]], max_tokens: int = 1000,
+                        ai_id: str = None) -> Iterator[str]:
+        """以流式方式获取AI响应，逐段返回生成的文本"""
+        return self.engine.iterate(self.astream_response(messages, max_tokens, ai_id))
+        
+    def submit(self, coro, bounded=True):
+        """把协程提交到后台事件循环，返回concurrent.futures.Future（bounded为False时不受最大并发数限制）"""
+        return self.engine.submit(coro, bounded)
+        
     def refresh_ai_list(self):
         """刷新AI列表"""
-        # 清除所有客户端
+        # 清除AI到客户端的映射（连接池中的客户端和连接保留）
         self.clients = {}
+        self._no_stream_usage.clear()
         # 重新创建当前AI的客户端
         if self.current_ai_id:
             ai_config = self.config_manager.get_ai(self.current_ai_id)
             if ai_config:
-                self._create_client(self.current_ai_id, ai_config)
\ No newline at end of file
+                self._create_client(self.current_ai_id, ai_config)
+                
+    async def _aclose_clients(self):
+        """关闭所有客户端的连接"""
+        self.clients = {}
+        await self.pool.aclose()
+        
+    def close(self):
+        """关闭客户端并停止后台事件循环"""
+        self.metrics_exporter.stop()
+        # 先取消进行中的请求，关闭连接时不需要等待它们
+        self.engine.cancel_pending(timeout=2)
+        try:
+            self.engine.run(self._aclose_clients(), timeout=5, bounded=False)
+        except FutureTimeoutError:
+            print("关闭AI客户端连接超时")
+        except (OSError, RuntimeError) as e:
+            print(f"关闭AI客户端连接时出错: {e}")
+        self.engine.shutdown()
\ No newline at end of file
@@ -0,0 +1,110 @@
+import asyncio
+import inspect
+import queue
+import threading
+from concurrent.futures import CancelledError as FutureCancelledError, Future, TimeoutError as FutureTimeoutError
+from typing import AsyncIterator, Awaitable, Iterator
+
+class AsyncEngine:
+    """在后台线程中运行单个asyncio事件循环，供所有网络请求共享"""
+    
+    def __init__(self, max_concurrency: int = 4):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.loop = asyncio.new_event_loop()
+        self._semaphore = None
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, name="AsyncEngine", daemon=True)
+        self._thread.start()
+        self._started.wait()
+        
+    def _run_loop(self):
+        """事件循环线程入口"""
+        asyncio.set_event_loop(self.loop)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._started.set()
+        self.loop.run_forever()
+        
+    def in_loop_thread(self) -> bool:
+        """判断当前是否运行在事件循环线程中"""
+        return threading.current_thread() is self._thread
+        
+    async def _bounded(self, coro: Awaitable):
+        """限制同时运行的请求数量"""
+        try:
+            async with self._semaphore:
+                return await coro
+        finally:
+            # 在获得执行名额前就被取消时关闭协程，避免"never awaited"警告
+            if inspect.iscoroutine(coro) and inspect.getcoroutinestate(coro) == inspect.CORO_CREATED:
+                coro.close()
+            
+    def submit(self, coro: Awaitable, bounded: bool = True) -> Future:
+        """从任意线程提交协程，返回可取消的Future；bounded为False时不占用并发名额（用于内部清理等）"""
+        if not bounded:
+            return asyncio.run_coroutine_threadsafe(coro, self.loop)
+        return asyncio.run_coroutine_threadsafe(self._bounded(coro), self.loop)
+        
+    def run(self, coro: Awaitable, timeout: float = None, bounded: bool = True):
+        """从非事件循环线程同步等待协程结果"""
+        if self.in_loop_thread():
+            raise RuntimeError("不能在事件循环线程中同步等待")
+        return self.submit(coro, bounded).result(timeout)
+        
+    def iterate(self, agen: AsyncIterator) -> Iterator:
+        """把异步生成器桥接为同步迭代器"""
+        if self.in_loop_thread():
+            raise RuntimeError("不能在事件循环线程中同步迭代")
+        items = queue.Queue()
+        done = object()
+        
+        async def pump():
+            async for item in agen:
+                items.put((True, item))
+                
+        def on_done(f: Future):
+            # 无论后台任务如何结束（包括开始前或运行中被cancel_pending等取消）都放入结束标记，迭代方不会一直等待
+            if f.cancelled():
+                items.put((False, FutureCancelledError("后台任务已被取消")))
+            elif f.exception() is not None:
+                items.put((False, f.exception()))
+            else:
+                items.put((False, done))
+                
+        future = self.submit(pump())
+        future.add_done_callback(on_done)
+        try:
+            while True:
+                ok, item = items.get()
+                if ok:
+                    yield item
+                elif item is done:
+                    return
+                else:
+                    raise item
+        finally:
+            # 调用方提前停止迭代时取消后台任务
+            future.cancel()
+            
+    async def _cancel_pending(self):
+        """取消所有尚未完成的任务"""
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        
+    def cancel_pending(self, timeout: float = 5):
+        """从其他线程取消所有未完成的任务并等待它们结束"""
+        if not self.loop.is_running():
+            return
+        try:
+            self.run(self._cancel_pending(), timeout, bounded=False)
+        except FutureTimeoutError:
+            print(f"等待后台任务取消超时（{timeout}秒）")
+            
+    def shutdown(self, timeout: float = 5):
+        """取消未完成的任务，停止事件循环并等待线程退出"""
+        if not self.loop.is_running():
+            return
+        self.cancel_pending(timeout)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
\ No newline at end of file
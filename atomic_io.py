@@ -0,0 +1,104 @@
+import json
+import os
+import tempfile
+from datetime import datetime
+from typing import Any, Optional, Union
+
+def fsync_directory(path: str):
+    """fsync目录，使其中的新建、重命名操作落盘（Windows不支持，直接跳过）"""
+    if os.name == "nt":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def atomic_write(path: str, data: Union[str, bytes], fsync: bool = True):
+    """原子写入文件：先写同目录下的临时文件（可选fsync），再重命名覆盖目标文件。
+    任何时刻目标文件要么是旧内容，要么是完整的新内容。"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data.encode('utf-8') if isinstance(data, str) else data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    if fsync:
+        fsync_directory(directory)
+
+def atomic_write_json(path: str, obj: Any, fsync: bool = True, **dump_kwargs):
+    """把对象序列化为JSON后原子写入"""
+    dump_kwargs.setdefault("ensure_ascii", False)
+    atomic_write(path, json.dumps(obj, **dump_kwargs), fsync=fsync)
+
+class FsyncBatch:
+    """批量fsync：追加写入的文件先登记，批次结束时每个文件只fsync一次"""
+    
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._paths = set()
+        
+    def add(self, path: str):
+        if self.enabled:
+            self._paths.add(path)
+            
+    def commit(self):
+        paths, self._paths = self._paths, set()
+        for path in paths:
+            try:
+                fd = os.open(path, os.O_RDONLY if os.name != "nt" else os.O_RDWR)
+            except OSError:
+                # 文件可能已被删除
+                continue
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+                
+    def __enter__(self):
+        return self
+        
+    def __exit__(self, exc_type, exc, tb):
+        self.commit()
+
+def append_text(path: str, text: str, batch: Optional[FsyncBatch] = None):
+    """追加写入文本；传入batch时由批次统一fsync，否则立即fsync"""
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(text)
+        if batch is None:
+            f.flush()
+            os.fsync(f.fileno())
+    if batch is not None:
+        batch.add(path)
+
+def quarantine(path: str) -> Optional[str]:
+    """把损坏的文件改名移到一旁（保留以便手动恢复），返回新路径"""
+    target = f"{path}.corrupt-{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    try:
+        os.replace(path, target)
+    except OSError as e:
+        print(f"隔离损坏文件 {path} 时出错: {e}")
+        return None
+    print(f"文件已损坏，已移动到: {target}")
+    return target
+
+def load_json(path: str, default: Any = None, quarantine_corrupt: bool = True) -> Any:
+    """读取JSON文件；文件不存在时返回default，内容损坏时隔离该文件并返回default"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except ValueError:
+        if quarantine_corrupt:
+            quarantine(path)
+        return default
\ No newline at end of file
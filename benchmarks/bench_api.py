@@ -0,0 +1,230 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Dict, List
+
+from common import print_table, summarize, temp_data_dir, write_results
+from stub_server import StubServer, add_stub_arguments, stub_settings
+
+from api_manager import APIManager
+from client_pool import DEFAULT_POOL_SETTINGS
+from config import ConfigManager
+from conversation_history import ConversationHistory
+
+SCENARIOS = ("single", "stream", "concurrent", "quick")
+
+def write_config(data_dir: str, base_url: str, source: str = None, model: str = "stub-model",
+                 concurrency: int = 1) -> Dict:
+    """在临时数据目录中写入config.json，把默认AI的base_url指向模拟服务端，并保证并发上限不低于concurrency"""
+    config = {}
+    if source:
+        with open(source, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    ais = config.setdefault("ais", {})
+    ai_id = config.get("default_ai")
+    if ai_id not in ais:
+        ai_id = "bench"
+        config["default_ai"] = ai_id
+        ais[ai_id] = {"name": "基准测试"}
+    ais[ai_id].update(base_url=base_url, model=ais[ai_id].get("model") or model)
+    ais[ai_id]["api_key"] = ais[ai_id].get("api_key") or "stub"
+    # 避免响应缓存和备用AI影响测量结果
+    config.pop("response_cache", None)
+    config.pop("failover", None)
+    # 请求并发数和HTTP连接数的上限都不能低于测试的并发数，否则实际测到的是较小的并发
+    config["max_concurrent_requests"] = max(int(config.get("max_concurrent_requests") or 4), concurrency)
+    http_pool = config.setdefault("http_pool", {})
+    http_pool["max_connections"] = max(int(http_pool.get("max_connections") or DEFAULT_POOL_SETTINGS["max_connections"]),
+                                       concurrency)
+    with open(os.path.join(data_dir, "config.json"), 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    return config
+
+def prompt(i: int) -> List[Dict[str, str]]:
+    return [{"role": "user", "content": f"benchmark request {i}: say something"}]
+
+class Recorder:
+    """收集一个场景的延迟、首token时间和错误"""
+    
+    def __init__(self):
+        self.latencies = []
+        self.ttfts = []
+        self.tokens = 0
+        self.errors: Dict[str, int] = {}
+        self.wall = 0.0
+        
+    def error(self, e: Exception):
+        # APIManager把底层异常包装为Exception，用消息开头区分错误类型
+        name = type(e).__name__ if type(e) is not Exception else str(e).split(":")[0]
+        self.errors[name] = self.errors.get(name, 0) + 1
+        
+    def result(self) -> Dict:
+        done = len(self.latencies)
+        return {
+            "requests": done + sum(self.errors.values()),
+            "errors": self.errors,
+            "latency_ms": summarize(self.latencies),
+            "ttft_ms": summarize(self.ttfts),
+            "wall_seconds": round(self.wall, 3),
+            "requests_per_sec": round(done / self.wall, 3) if self.wall else 0.0,
+            "tokens_per_sec": round(self.tokens / self.wall, 3) if self.wall else 0.0
+        }
+
+async def timed_stream(api_manager, messages, max_tokens, recorder: Recorder):
+    """流式请求一次，记录首token时间和总耗时"""
+    start = time.perf_counter()
+    try:
+        first = None
+        async for _ in api_manager.astream_response(messages, max_tokens):
+            if first is None:
+                first = time.perf_counter() - start
+            recorder.tokens += 1
+        recorder.latencies.append(time.perf_counter() - start)
+        if first is not None:
+            recorder.ttfts.append(first)
+    except Exception as e:
+        recorder.error(e)
+
+def run_single(api_manager, history_manager, args) -> Recorder:
+    """逐个发送非流式请求（APIManager.get_response）"""
+    recorder = Recorder()
+    start = time.perf_counter()
+    for i in range(args.requests):
+        t = time.perf_counter()
+        try:
+            response = api_manager.get_response(prompt(i), args.max_tokens)
+            recorder.latencies.append(time.perf_counter() - t)
+            recorder.tokens += len(response.split())
+        except Exception as e:
+            recorder.error(e)
+    recorder.wall = time.perf_counter() - start
+    return recorder
+
+def run_stream(api_manager, history_manager, args) -> Recorder:
+    """逐个发送流式请求（APIManager.astream_response）"""
+    recorder = Recorder()
+    start = time.perf_counter()
+    for i in range(args.requests):
+        api_manager.engine.run(timed_stream(api_manager, prompt(i), args.max_tokens, recorder))
+    recorder.wall = time.perf_counter() - start
+    return recorder
+
+def run_concurrent(api_manager, history_manager, args) -> Recorder:
+    """以指定并发数同时发送流式请求"""
+    recorder = Recorder()
+    
+    async def run_all():
+        semaphore = asyncio.Semaphore(args.concurrency)
+        
+        async def one(i):
+            async with semaphore:
+                await timed_stream(api_manager, prompt(i), args.max_tokens, recorder)
+                
+        await asyncio.gather(*(one(i) for i in range(args.requests)))
+        
+    start = time.perf_counter()
+    # 外层任务不占用并发名额，并发数只由上面的semaphore控制
+    api_manager.engine.run(run_all(), bounded=False)
+    recorder.wall = time.perf_counter() - start
+    return recorder
+
+def run_quick(api_manager, history_manager, args) -> Recorder:
+    """模拟快速提问：新建会话、流式获取回答，结束后保存聊天记录"""
+    recorder = Recorder()
+    
+    async def quick(i):
+        # 同一秒内创建的会话ID相同，加上序号区分
+        history_manager.create_new_session()
+        history_manager.current_session_id += f"_{i}"
+        messages = prompt(i)
+        parts = []
+        t = time.perf_counter()
+        try:
+            async for delta in api_manager.astream_response(messages):
+                if not parts:
+                    recorder.ttfts.append(time.perf_counter() - t)
+                parts.append(delta)
+            recorder.tokens += len(parts)
+            messages.append({"role": "assistant", "content": "".join(parts).strip()})
+            await asyncio.to_thread(history_manager.save_current_history, messages)
+            recorder.latencies.append(time.perf_counter() - t)
+        except Exception as e:
+            recorder.error(e)
+            
+    start = time.perf_counter()
+    for i in range(args.requests):
+        api_manager.engine.run(quick(i))
+    recorder.wall = time.perf_counter() - start
+    return recorder
+
+RUNNERS = {"single": run_single, "stream": run_stream, "concurrent": run_concurrent, "quick": run_quick}
+
+def main():
+    parser = argparse.ArgumentParser(description="APIManager端到端延迟基准测试（默认使用本地模拟服务端）")
+    parser.add_argument("-n", "--requests", type=int, default=50, help="每个场景的请求数（默认50）")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="并发场景的并发数（默认8）")
+    parser.add_argument("--max-tokens", type=int, default=1000)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"要运行的场景（默认 {','.join(SCENARIOS)}）")
+    parser.add_argument("--warmup", type=int, default=2, help="每个场景前的预热请求数（不计入结果）")
+    parser.add_argument("--config", help="以已有的config.json为基础（保留重试、连接池等设置）")
+    parser.add_argument("--base-url", help="使用外部服务端而不启动内置模拟服务端")
+    parser.add_argument("--json", default=None, help="把结果以JSON写入文件（- 表示标准输出）")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in scenarios if s not in RUNNERS]
+    if unknown:
+        parser.error(f"未知的场景: {', '.join(unknown)}")
+        
+    server = None if args.base_url else StubServer(**stub_settings(args)).start()
+    base_url = args.base_url or server.base_url
+    results = {}
+    try:
+        with temp_data_dir() as data_dir:
+            config = write_config(data_dir, base_url, args.config, concurrency=args.concurrency)
+            config_manager = ConfigManager()
+            api_manager = APIManager(config_manager)
+            history_manager = ConversationHistory()
+            try:
+                for name in scenarios:
+                    for i in range(args.warmup):
+                        try:
+                            api_manager.get_response(prompt(-1 - i), args.max_tokens)
+                        except Exception:
+                            pass
+                    before = server.stats() if server else None
+                    recorder = RUNNERS[name](api_manager, history_manager, args)
+                    results[name] = recorder.result()
+                    if server:
+                        after = server.stats()
+                        results[name]["server"] = {key: after[key] - before[key] for key in after}
+                    print(f"{name}: {results[name]['requests']} 个请求，用时 {recorder.wall:.2f} 秒", file=sys.stderr)
+                history_manager.flush()
+            finally:
+                api_manager.close()
+    finally:
+        if server:
+            server.stop()
+            
+    print_table("延迟 (ms)", {name: r["latency_ms"] for name, r in results.items()})
+    print_table("首token时间 (ms)", {name: r["ttft_ms"] for name, r in results.items()})
+    print_table("吞吐量", {name: r for name, r in results.items()},
+                columns=("requests", "requests_per_sec", "tokens_per_sec", "wall_seconds"))
+    for name, r in results.items():
+        if r["errors"]:
+            print(f"{name} 错误: {r['errors']}", file=sys.stderr)
+            
+    if args.json:
+        params = {key: value for key, value in vars(args).items() if key not in ("json",)}
+        params["base_url"] = base_url
+        # 记录实际生效的并发上限，便于核对并发场景的结果
+        params["max_concurrent_requests"] = config["max_concurrent_requests"]
+        params["http_max_connections"] = config["http_pool"]["max_connections"]
+        write_results(args.json, "api", params, results)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,258 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+from common import print_table, summarize, temp_data_dir, write_results
+
+import conversation_history
+from config import ConfigManager
+from conversation_history import ConversationHistory
+from history_sqlite import SQLiteConversationHistory
+
+# 预设的合成数据规模，scale_key为--scale缩放的维度
+WORKLOADS = {
+    "many": {"sessions": 10000, "messages": 6, "answer_chars": 800, "scale_key": "sessions"},
+    "long": {"sessions": 20, "messages": 2000, "answer_chars": 800, "scale_key": "messages"},
+    "large": {"sessions": 20, "messages": 4, "answer_chars": 2_000_000, "scale_key": "answer_chars"}
+}
+
+_WORDS = ("the model returns a streaming answer with code blocks lists and tables for the user "
+          "def return import class 配置 会话 历史 记录 回答 问题 模型 你好 谢谢 请问 如何").split()
+
+class SyntheticText:
+    """按固定种子生成可复现的消息内容"""
+    
+    def __init__(self, seed: int):
+        self.random = random.Random(seed)
+        
+    def text(self, chars: int) -> str:
+        words = []
+        length = 0
+        while length < chars:
+            word = self.random.choice(_WORDS)
+            words.append(word)
+            length += len(word) + 1
+        return " ".join(words)[:chars]
+        
+    def messages(self, count: int, answer_chars: int) -> List[Dict[str, str]]:
+        messages = []
+        for i in range(count):
+            if i % 2 == 0:
+                messages.append({"role": "user", "content": self.text(self.random.randint(20, 200))})
+            else:
+                messages.append({"role": "assistant", "content": self.text(answer_chars)})
+        return messages
+
+def generate_tree(history_dir: str, sessions: int, messages: int, answer_chars: int, seed: int) -> Dict:
+    """直接按会话文件格式生成合成的聊天记录目录，返回会话ID列表和占用空间"""
+    os.makedirs(history_dir, exist_ok=True)
+    text = SyntheticText(seed)
+    base = datetime(2024, 1, 1)
+    session_ids = []
+    total_bytes = 0
+    for i in range(sessions):
+        timestamp = base + timedelta(minutes=i)
+        session_id = f"{timestamp.strftime('%Y%m%d_%H%M%S')}_{i:05d}"
+        iso = timestamp.isoformat()
+        lines = [json.dumps({"type": "header", "version": conversation_history.FORMAT_VERSION,
+                             "session_id": session_id, "timestamp": iso}, ensure_ascii=False)]
+        for message in text.messages(messages, answer_chars):
+            lines.append(json.dumps({"type": "message", "timestamp": iso, "message": message}, ensure_ascii=False))
+        content = ("\n".join(lines) + "\n").encode('utf-8')
+        with open(os.path.join(history_dir, session_id + conversation_history.SESSION_EXT), 'wb') as f:
+            f.write(content)
+        session_ids.append(session_id)
+        total_bytes += len(content)
+    return {"session_ids": session_ids, "bytes": total_bytes}
+
+def measure(func: Callable, repeat: int, setup: Callable = None) -> List[float]:
+    """重复执行func并返回每次的耗时（秒），setup的耗时不计入"""
+    durations = []
+    for i in range(repeat):
+        if setup:
+            arg = setup()
+            start = time.perf_counter()
+            func(arg)
+        else:
+            start = time.perf_counter()
+            func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+class StorageBench:
+    """在一个合成的聊天记录目录上测量ConversationHistory（或SQLite存储）的各个操作"""
+    
+    def __init__(self, data_dir: str, backend: str, args):
+        self.data_dir = data_dir
+        self.backend = backend
+        self.args = args
+        self.instances = []
+        
+    def open_history(self):
+        """新建存储实例（相当于重新启动程序，进程内缓存为空；操作系统的文件缓存不受影响）"""
+        if self.backend == "sqlite":
+            history_manager = SQLiteConversationHistory(os.path.join(self.data_dir, "history.db"))
+        else:
+            history_manager = ConversationHistory()
+        self.instances.append(history_manager)
+        return history_manager
+        
+    def prepare(self, spec: Dict) -> Dict:
+        """生成合成数据；SQLite存储先把生成的文件导入数据库"""
+        start = time.perf_counter()
+        target = os.path.join(self.data_dir, "seed" if self.backend == "sqlite" else "history")
+        tree = generate_tree(target, spec["sessions"], spec["messages"], spec["answer_chars"], self.args.seed)
+        if self.backend == "sqlite":
+            history_manager = self.open_history()
+            history_manager.import_json_history(target)
+            history_manager.flush()
+        tree["setup_seconds"] = round(time.perf_counter() - start, 3)
+        return tree
+        
+    def run(self, spec: Dict) -> Dict:
+        tree = self.prepare(spec)
+        session_ids = tree["session_ids"]
+        sample = random.Random(self.args.seed).sample(session_ids, min(self.args.repeat, len(session_ids)))
+        repeat = len(sample)
+        samples = iter(sample * 4)
+        results = {}
+        
+        if self.backend == "json":
+            manifest_file = os.path.join(self.data_dir, "history_manifest.json")
+            
+            def without_manifest():
+                # 删除会话清单，测量首次启动（或清单丢失）时重建清单的耗时；
+                # 先让上一个实例写完重建的清单，避免它在删除后又写回
+                if self.instances:
+                    self.instances[-1].flush()
+                history_manager = self.open_history()
+                if os.path.exists(manifest_file):
+                    os.remove(manifest_file)
+                history_manager._manifest = None
+                return history_manager
+                
+            results["get_all_sessions_rebuild"] = measure(lambda h: h.get_all_sessions(), repeat, without_manifest)
+            # 等待后台线程写入重建的清单
+            self.instances[-1].flush()
+        results["get_all_sessions_cold"] = measure(lambda h: h.get_all_sessions(), repeat, self.open_history)
+        warm = self.open_history()
+        warm.get_all_sessions()
+        results["get_all_sessions_warm"] = measure(warm.get_all_sessions, repeat)
+        
+        results["load_session_cold"] = measure(lambda h: h.load_session(next(samples)), repeat, self.open_history)
+        history_manager = self.open_history()
+        for session_id in sample:
+            history_manager.load_session(session_id)
+        results["load_session_cached"] = measure(lambda: history_manager.load_session(sample[-1]), repeat)
+        
+        def with_current_session():
+            h = self.open_history()
+            h.current_session_id = next(samples)
+            return h
+            
+        results["get_current_history_cold"] = measure(lambda h: h.get_current_history(), repeat, with_current_session)
+        
+        # 在已有会话末尾追加一轮问答：分别测量保存调用本身和写入磁盘的耗时
+        text = SyntheticText(self.args.seed + 1)
+        history_manager = self.open_history()
+        saves, flushes = [], []
+        for session_id in sample:
+            history_manager.current_session_id = session_id
+            messages = history_manager.get_current_history()
+            messages += text.messages(2, spec["answer_chars"])
+            start = time.perf_counter()
+            history_manager.save_current_history(messages)
+            saves.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            history_manager.flush()
+            flushes.append(time.perf_counter() - start)
+        results["save_current_history"] = saves
+        results["save_current_history_flush"] = flushes
+        
+        history_manager = self.open_history()
+        results["clear_all_history"] = measure(history_manager.clear_all_history, 1)
+        
+        summary = {name: summarize(durations) for name, durations in results.items()}
+        summary["dataset"] = {key: spec[key] for key in ("sessions", "messages", "answer_chars")}
+        summary["dataset"].update(bytes=tree["bytes"], setup_seconds=tree["setup_seconds"])
+        return summary
+        
+    def close(self):
+        for history_manager in self.instances:
+            try:
+                history_manager.flush()
+                if hasattr(history_manager, "close"):
+                    history_manager.close()
+            except Exception:
+                pass
+        self.instances = []
+
+def bench_config(ais: int, repeat: int) -> Dict:
+    """测量ConfigManager.save_config（原子写入并fsync）"""
+    config_manager = ConfigManager()
+    for i in range(ais):
+        config_manager.config["ais"][f"bench-{i}"] = {
+            "name": f"AI {i}", "api_key": "sk-" + "x" * 48,
+            "base_url": "https://api.example.com/v1", "model": "model-name"
+        }
+    return {"save_config": summarize(measure(config_manager.save_config, repeat)),
+            "dataset": {"ais": len(config_manager.get_ais())}}
+
+def scaled(name: str, scale: float, args) -> Dict:
+    spec = dict(WORKLOADS[name])
+    key = spec.pop("scale_key")
+    spec[key] = max(1, int(spec[key] * scale))
+    for key in ("sessions", "messages", "answer_chars"):
+        if getattr(args, key) is not None:
+            spec[key] = getattr(args, key)
+    return spec
+
+def main():
+    parser = argparse.ArgumentParser(description="聊天记录和配置文件的磁盘读写基准测试（在临时数据目录中运行）")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS), help=f"要运行的数据集（默认 {','.join(WORKLOADS)}）")
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json", help="聊天记录存储方式")
+    parser.add_argument("--scale", type=float, default=1.0, help="按比例缩小或放大数据集（如0.1用于快速检查）")
+    parser.add_argument("--sessions", type=int, help="覆盖数据集的会话数")
+    parser.add_argument("--messages", type=int, help="覆盖每个会话的消息数")
+    parser.add_argument("--answer-chars", type=int, help="覆盖每个回答的字符数")
+    parser.add_argument("--repeat", type=int, default=10, help="每个操作的重复次数（默认10）")
+    parser.add_argument("--config-ais", type=int, default=20, help="配置文件中的AI数量（默认20）")
+    parser.add_argument("--seed", type=int, default=1234, help="随机数种子")
+    parser.add_argument("--keep", action="store_true", help="保留生成的临时数据目录")
+    parser.add_argument("--json", default=None, help="把结果以JSON写入文件（- 表示标准输出）")
+    args = parser.parse_args()
+    
+    names = [name.strip() for name in args.workloads.split(",") if name.strip()]
+    unknown = [name for name in names if name not in WORKLOADS]
+    if unknown:
+        parser.error(f"未知的数据集: {', '.join(unknown)}")
+        
+    results = {}
+    for name in names:
+        spec = scaled(name, args.scale, args)
+        print(f"{name}: 生成 {spec['sessions']} 个会话 × {spec['messages']} 条消息 "
+              f"（回答 {spec['answer_chars']} 字符）...", file=sys.stderr)
+        # 每个数据集使用独立的数据目录，互不影响
+        with temp_data_dir(keep=args.keep) as data_dir:
+            bench = StorageBench(data_dir, args.backend, args)
+            try:
+                results[name] = bench.run(spec)
+            finally:
+                bench.close()
+        print_table(f"{name} (ms)", {op: stats for op, stats in results[name].items() if op != "dataset"})
+        
+    with temp_data_dir() as data_dir:
+        results["config"] = bench_config(args.config_ais, args.repeat * 5)
+    print_table("config (ms)", {"save_config": results["config"]["save_config"]})
+    
+    if args.json:
+        params = {key: value for key, value in vars(args).items() if key not in ("json", "keep")}
+        write_results(args.json, "storage", params, results)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,96 @@
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List
+
+# 基准测试脚本位于benchmarks目录，需要能导入项目根目录下的模块
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+# 引用了DATA_DIR的模块，切换数据目录时需要一起修改
+_DATA_DIR_MODULES = ("config", "api_manager", "conversation_history", "history_sqlite")
+
+@contextmanager
+def temp_data_dir(keep: bool = False):
+    """在临时数据目录中运行基准测试，不读写用户的data目录"""
+    import importlib
+    modules = [importlib.import_module(name) for name in _DATA_DIR_MODULES]
+    saved = [module.DATA_DIR for module in modules]
+    data_dir = tempfile.mkdtemp(prefix="chatbox-bench-")
+    for module in modules:
+        module.DATA_DIR = data_dir
+    try:
+        yield data_dir
+    finally:
+        for module, value in zip(modules, saved):
+            module.DATA_DIR = value
+        if keep:
+            print(f"测试数据保留在: {data_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """已排序数据的百分位数（线性插值）"""
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100
+    low = int(k)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (k - low)
+
+def summarize(values: List[float], scale: float = 1000.0) -> Dict:
+    """统计一组耗时（秒），默认换算为毫秒"""
+    values = sorted(v * scale for v in values)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 3),
+        "min": round(values[0], 3),
+        "p50": round(percentile(values, 50), 3),
+        "p95": round(percentile(values, 95), 3),
+        "p99": round(percentile(values, 99), 3),
+        "max": round(values[-1], 3)
+    }
+
+def environment() -> Dict:
+    """记录运行环境，便于比较不同版本的结果"""
+    commit = None
+    try:
+        import subprocess
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True,
+                                text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        pass
+    return {
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform()
+    }
+
+def write_results(path: str, suite: str, params: Dict, results: Dict):
+    """输出JSON格式的结果（path为"-"时写到标准输出）"""
+    report = {"suite": suite, "environment": environment(), "params": params, "results": results}
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if path == "-":
+        print(text)
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+        print(f"结果已写入: {path}", file=sys.stderr)
+
+def print_table(title: str, rows: Dict[str, Dict], columns=("count", "mean", "p50", "p95", "p99", "max")):
+    """把统计结果打印为表格（写到标准错误，标准输出留给JSON）"""
+    print(f"\n{title}", file=sys.stderr)
+    widths = [max(11, len(c) + 2) for c in columns]
+    print(f"{'':<28}" + "".join(f"{c:>{w}}" for c, w in zip(columns, widths)), file=sys.stderr)
+    for name, stats in rows.items():
+        cells = "".join(f"{stats.get(c, ''):>{w}}" for c, w in zip(columns, widths))
+        print(f"{name:<28}{cells}", file=sys.stderr)
\ No newline at end of file
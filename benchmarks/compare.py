@@ -0,0 +1,48 @@
+import argparse
+import json
+import sys
+from typing import Dict, Iterator, Tuple
+
+def iter_stats(results: Dict, prefix: str = "") -> Iterator[Tuple[str, Dict]]:
+    """遍历结果中所有的耗时统计项（包含p50的字典）"""
+    for name, value in results.items():
+        if not isinstance(value, dict):
+            continue
+        if "p50" in value:
+            yield prefix + name, value
+        else:
+            yield from iter_stats(value, f"{prefix}{name}.")
+
+def main():
+    parser = argparse.ArgumentParser(description="比较两次基准测试的JSON结果，列出变慢超过阈值的项")
+    parser.add_argument("baseline", help="基准结果文件")
+    parser.add_argument("current", help="本次结果文件")
+    parser.add_argument("--metric", default="p50", help="比较的统计量（默认p50）")
+    parser.add_argument("--threshold", type=float, default=1.2, help="比值超过该值视为变慢（默认1.2）")
+    args = parser.parse_args()
+    
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.current, 'r', encoding='utf-8') as f:
+        current = json.load(f)
+    old = dict(iter_stats(baseline["results"]))
+    regressions = 0
+    print(f"{'':<48}{'baseline':>12}{'current':>12}{'ratio':>9}")
+    for name, stats in iter_stats(current["results"]):
+        if name not in old or args.metric not in stats:
+            continue
+        before, after = old[name][args.metric], stats[args.metric]
+        ratio = after / before if before else float("inf") if after else 1.0
+        flag = ""
+        if ratio > args.threshold:
+            flag = "  变慢"
+            regressions += 1
+        elif ratio < 1 / args.threshold:
+            flag = "  变快"
+        print(f"{name:<48}{before:>12.3f}{after:>12.3f}{ratio:>9.2f}{flag}")
+    print(f"\n{regressions} 项变慢超过 {args.threshold} 倍（{baseline['environment'].get('commit')} -> "
+          f"{current['environment'].get('commit')}）")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,252 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+# 模拟服务端的默认参数，可通过命令行或StubServer.configure修改
+DEFAULT_STUB_SETTINGS = {
+    "ttft": 0.2,              # 首个token前的延迟（秒）
+    "tokens_per_sec": 50.0,   # 生成速度（0表示不限速）
+    "completion_tokens": 64,  # 每个回答的token数
+    "error_rate": 0.0,        # 返回500错误的比例
+    "rate_limit_rate": 0.0,   # 返回429的比例
+    "retry_after": 1.0,       # 429响应中的Retry-After（秒）
+    "reject_stream_options": False,  # 以400拒绝带stream_options的请求（模拟不支持该参数的兼容服务端）
+    "model": "stub-model",
+    "seed": None              # 随机数种子（用于复现错误序列）
+}
+
+_WORDS = ("the quick brown fox jumps over a lazy dog while streaming tokens from a local stub "
+          "server so that latency can be measured without a remote endpoint").split()
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """实现 /v1/chat/completions（流式和非流式）与 /v1/models"""
+    
+    protocol_version = "HTTP/1.1"
+    # 关闭Nagle算法，否则小块的流式数据会被延迟发送，使测得的首token时间偏大
+    disable_nagle_algorithm = True
+    
+    def log_message(self, format, *args):
+        pass
+        
+    def _send_json(self, status: int, body: Dict, headers: Dict = None):
+        data = json.dumps(body).encode('utf-8')
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端已取消请求（超时、对冲落败等）
+            self.server.stub.count("disconnects")
+            self.close_connection = True
+        
+    def _write_chunk(self, data: bytes):
+        """按chunked编码写出一段数据，使流式响应后连接仍可复用"""
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+        
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            model = self.server.stub.settings["model"]
+            self._send_json(200, {"object": "list", "data": [{"id": model, "object": "model", "owned_by": "stub"}]})
+        else:
+            self._send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+            
+    def do_POST(self):
+        stub = self.server.stub
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "invalid JSON", "type": "invalid_request_error"}})
+            return
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+            return
+            
+        settings = stub.settings
+        if settings["reject_stream_options"] and "stream_options" in request:
+            self._send_json(400, {"error": {"message": "Unrecognized request argument supplied: stream_options",
+                                            "type": "invalid_request_error"}})
+            return
+        outcome = stub.next_outcome()
+        if outcome == "rate_limited":
+            self._send_json(429, {"error": {"message": "rate limited", "type": "rate_limit_error"}},
+                            {"Retry-After": str(settings["retry_after"])})
+            return
+        if outcome == "error":
+            self._send_json(500, {"error": {"message": "stub internal error", "type": "server_error"}})
+            return
+            
+        messages = request.get("messages") or []
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in messages)
+        count = max(1, min(int(settings["completion_tokens"]), int(request.get("max_tokens") or 1 << 30)))
+        tokens = [(" " if i else "") + _WORDS[i % len(_WORDS)] for i in range(count)]
+        interval = 1.0 / settings["tokens_per_sec"] if settings["tokens_per_sec"] > 0 else 0.0
+        created = int(time.time())
+        completion_id = f"chatcmpl-stub-{time.time_ns():x}"
+        model = request.get("model") or settings["model"]
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": count, "total_tokens": prompt_tokens + count}
+        
+        time.sleep(settings["ttft"])
+        if not request.get("stream"):
+            time.sleep(interval * (count - 1))
+            stub.count("tokens", count)
+            self._send_json(200, {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                             "finish_reason": "stop"}],
+                "usage": usage
+            })
+            return
+            
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i, token in enumerate(tokens):
+                if i:
+                    time.sleep(interval)
+                chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                         "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                stub.count("tokens")
+            final = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            self._write_chunk(f"data: {json.dumps(final)}\n\n".encode('utf-8'))
+            # 与OpenAI一致：只在请求了stream_options.include_usage时用单独一段（choices为空）返回usage
+            if (request.get("stream_options") or {}).get("include_usage"):
+                usage_chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                               "model": model, "choices": [], "usage": usage}
+                self._write_chunk(f"data: {json.dumps(usage_chunk)}\n\n".encode('utf-8'))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端停止了生成
+            stub.count("disconnects")
+            self.close_connection = True
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    # 默认的监听队列只有5，并发连接较多时新连接会被延迟约1秒，使并发场景的结果失真
+    request_queue_size = 256
+    daemon_threads = True
+
+class StubServer:
+    """本地的OpenAI兼容模拟服务端，可配置首token延迟、生成速度、错误率和429比例"""
+    
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, **settings):
+        self.settings = dict(DEFAULT_STUB_SETTINGS)
+        self._random = random.Random()
+        self.configure(**settings)
+        self._lock = threading.Lock()
+        self._counters = {"requests": 0, "tokens": 0, "errors": 0, "rate_limited": 0, "disconnects": 0}
+        self.httpd = _StubHTTPServer((host, port), _StubHandler)
+        self.httpd.stub = self
+        self._thread = None
+        
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+        
+    def configure(self, **settings):
+        """修改模拟参数（运行中也可修改）"""
+        unknown = set(settings) - set(DEFAULT_STUB_SETTINGS)
+        if unknown:
+            raise ValueError(f"未知的模拟参数: {', '.join(sorted(unknown))}")
+        self.settings.update(settings)
+        if "seed" in settings:
+            self._random.seed(settings["seed"])
+            
+    def count(self, name: str, amount: int = 1) -> int:
+        with self._lock:
+            self._counters[name] += amount
+            return self._counters[name]
+            
+    def next_outcome(self) -> str:
+        """决定本次请求的结果：ok、rate_limited 或 error"""
+        with self._lock:
+            self._counters["requests"] += 1
+            roll = self._random.random()
+            if roll < self.settings["rate_limit_rate"]:
+                self._counters["rate_limited"] += 1
+                return "rate_limited"
+            if roll < self.settings["rate_limit_rate"] + self.settings["error_rate"]:
+                self._counters["errors"] += 1
+                return "error"
+            return "ok"
+            
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._counters)
+            
+    def start(self) -> "StubServer":
+        """在后台线程中运行"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="StubServer", daemon=True)
+        self._thread.start()
+        return self
+        
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        
+    def __enter__(self):
+        return self.start()
+        
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+def add_stub_arguments(parser: argparse.ArgumentParser):
+    """添加模拟参数的命令行选项（stub_server和bench_api共用）"""
+    group = parser.add_argument_group("模拟服务端参数")
+    group.add_argument("--ttft", type=float, default=DEFAULT_STUB_SETTINGS["ttft"], help="首个token前的延迟（秒）")
+    group.add_argument("--tps", type=float, default=DEFAULT_STUB_SETTINGS["tokens_per_sec"], help="每秒生成的token数（0表示不限速）")
+    group.add_argument("--tokens", type=int, default=DEFAULT_STUB_SETTINGS["completion_tokens"], help="每个回答的token数")
+    group.add_argument("--error-rate", type=float, default=DEFAULT_STUB_SETTINGS["error_rate"], help="返回500错误的比例")
+    group.add_argument("--rate-limit-rate", type=float, default=DEFAULT_STUB_SETTINGS["rate_limit_rate"], help="返回429的比例")
+    group.add_argument("--retry-after", type=float, default=DEFAULT_STUB_SETTINGS["retry_after"], help="429响应的Retry-After（秒）")
+    group.add_argument("--reject-stream-options", action="store_true", help="以400拒绝带stream_options的请求")
+    group.add_argument("--seed", type=int, help="随机数种子")
+
+def stub_settings(args) -> Dict:
+    return {
+        "ttft": args.ttft,
+        "tokens_per_sec": args.tps,
+        "completion_tokens": args.tokens,
+        "error_rate": args.error_rate,
+        "rate_limit_rate": args.rate_limit_rate,
+        "retry_after": args.retry_after,
+        "reject_stream_options": args.reject_stream_options,
+        "seed": args.seed
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="本地OpenAI兼容模拟服务端（/v1/chat/completions）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    
+    server = StubServer(args.host, args.port, **stub_settings(args))
+    print(f"模拟服务端运行在 {server.base_url}（Ctrl+C 停止）")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(f"请求统计: {server.stats()}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,277 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from api_manager import APIManager
+from client_pool import DEFAULT_POOL_SETTINGS
+from config import ConfigManager
+from conversation_history import create_history_manager
+
+def resolve_ai(config_manager, name: Optional[str]) -> Optional[str]:
+    """按ID或名称查找AI，未指定时返回None（使用默认AI），找不到时抛出LookupError"""
+    if not name:
+        return None
+    ais = config_manager.get_ais()
+    if name in ais:
+        return name
+    for ai_id, ai_config in ais.items():
+        if ai_config.get("name") == name:
+            return ai_id
+    raise LookupError(f"找不到AI: {name}")
+
+def build_messages(prompt: str, system: str = None, history: List[Dict[str, str]] = None) -> List[Dict[str, str]]:
+    messages = [{"role": "system", "content": system}] if system else []
+    return messages + list(history or []) + [{"role": "user", "content": prompt}]
+
+def cmd_ask(args, config_manager, api_manager) -> int:
+    """单次提问：从参数或标准输入读取问题，把回答流式写到标准输出"""
+    prompt = " ".join(args.prompt) if args.prompt else sys.stdin.read()
+    prompt = prompt.strip()
+    if not prompt:
+        print("没有输入问题", file=sys.stderr)
+        return 2
+    ai_id = resolve_ai(config_manager, args.ai)
+    
+    # 继续已有会话或保存为新会话时才使用聊天记录
+    history_manager = None
+    history = []
+    if args.session or args.save:
+        history_manager = create_history_manager(config_manager)
+        if args.session:
+            history_manager.current_session_id = args.session
+            history = history_manager.load_session(args.session)
+        else:
+            history_manager.create_new_session()
+            
+    parts = []
+    tracer = api_manager.tracer
+    start = tracer.now()
+    for delta in api_manager.stream_response(build_messages(prompt, args.system, history), args.max_tokens, ai_id):
+        if not parts:
+            delta = delta.lstrip()
+        sys.stdout.write(delta)
+        sys.stdout.flush()
+        parts.append(delta)
+    sys.stdout.write("\n")
+    tracer.add("ask", start, chars=sum(len(part) for part in parts))
+    
+    if history_manager is not None:
+        history.extend([
+            {"role": "user", "content": prompt},
+            {"role": "assistant", "content": "".join(parts).rstrip()}
+        ])
+        history_manager.save_current_history(history)
+        history_manager.flush()
+        print(f"已保存到会话 {history_manager.current_session_id}", file=sys.stderr)
+    return 0
+
+def load_jobs(path: str) -> List[Dict]:
+    """读取JSONL任务文件，每行包含prompt或messages，可选id、ai、system、max_tokens"""
+    jobs = []
+    stream = sys.stdin if path == "-" else open(path, 'r', encoding='utf-8')
+    with stream:
+        for line_no, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                job = json.loads(line)
+            except ValueError as e:
+                raise SystemExit(f"任务文件第 {line_no} 行不是有效的JSON: {e}")
+            if isinstance(job, str):
+                job = {"prompt": job}
+            if not job.get("prompt") and not job.get("messages"):
+                raise SystemExit(f"任务文件第 {line_no} 行缺少prompt或messages")
+            job["id"] = str(job.get("id", line_no))
+            jobs.append(job)
+    return jobs
+
+def load_finished(path: str, retry_errors: bool) -> Set[str]:
+    """读取已有的结果文件，返回已完成的任务ID（用于中断后继续）"""
+    finished = set()
+    if not os.path.exists(path):
+        return finished
+    # 中断时最后一行可能在多字节字符中间截断
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 中断时写了一半的行
+                continue
+            if retry_errors and record.get("error"):
+                continue
+            finished.add(str(record.get("id")))
+    return finished
+
+async def run_batch(api_manager, config_manager, jobs: List[Dict], out_file, args, default_ai: str = None,
+                    history_manager=None) -> Dict:
+    """以指定并发数执行任务，每完成一个就写入一行结果"""
+    semaphore = asyncio.Semaphore(args.concurrency)
+    stats = {"done": 0, "errors": 0}
+    start = time.monotonic()
+    
+    async def run_one(job):
+        with api_manager.tracer.track(f"任务 {job['id']}"):
+            await run_job(job)
+            
+    async def run_job(job):
+        wait_start = api_manager.tracer.now()
+        async with semaphore:
+            api_manager.tracer.add("wait_slot", wait_start)
+            messages = job.get("messages") or build_messages(job["prompt"], job.get("system") or args.system)
+            job_start = time.monotonic()
+            ai_id, ai_name = default_ai, None
+            response, error = None, None
+            try:
+                # 任务指定的AI不存在时只记为该任务失败，其他任务继续
+                ai_id = resolve_ai(config_manager, job.get("ai")) or default_ai
+                ai_name = (config_manager.get_ai(ai_id) or {}).get("name") if ai_id else api_manager.get_current_ai_name()
+                response = await api_manager.aget_response(messages, job.get("max_tokens", args.max_tokens), ai_id)
+            except Exception as e:
+                error = str(e)
+            record = {
+                "id": job["id"],
+                "response": response,
+                "error": error,
+                "latency": round(time.monotonic() - job_start, 3),
+                "ai": ai_name or job.get("ai"),
+                "finished_at": datetime.now().isoformat()
+            }
+            # 在事件循环线程中写入，整行写完才会切换到其他任务
+            with api_manager.tracer.span("write_result", cat="io"):
+                out_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out_file.flush()
+            
+            stats["done"] += 1
+            if error:
+                stats["errors"] += 1
+            elif history_manager is not None:
+                session_id = f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{job['id']}"
+                with api_manager.tracer.span("save_session", cat="io"):
+                    await asyncio.to_thread(history_manager.save_session, session_id,
+                                            messages + [{"role": "assistant", "content": response}])
+            if not args.quiet:
+                print(f"\r已完成 {stats['done']}/{len(jobs)}，失败 {stats['errors']}", end="", file=sys.stderr)
+                
+    await asyncio.gather(*(run_one(job) for job in jobs))
+    stats["elapsed"] = time.monotonic() - start
+    return stats
+
+def cmd_batch(args, config_manager, api_manager) -> int:
+    """批量执行JSONL任务文件，结果逐行写入输出文件，重新运行时跳过已完成的任务"""
+    jobs = load_jobs(args.input)
+    # 默认AI在提交任务前解析，找不到时直接报错退出
+    default_ai = resolve_ai(config_manager, args.ai)
+    if not args.concurrency:
+        args.concurrency = config_manager.get("max_concurrent_requests", 4)
+    if args.concurrency < 1:
+        raise SystemExit("并发数必须大于0")
+    # 批量任务不占用界面请求的并发名额，但共享的HTTP连接池也限制了同时进行的请求数，按需放宽（不写入配置文件）
+    http_pool = dict(config_manager.get("http_pool") or {})
+    if args.concurrency > http_pool.get("max_connections", DEFAULT_POOL_SETTINGS["max_connections"]):
+        http_pool["max_connections"] = args.concurrency
+        config_manager.config["http_pool"] = http_pool
+        api_manager.update_config(config_manager)
+    output = args.output or (os.path.splitext(args.input)[0] + ".results.jsonl" if args.input != "-" else None)
+    if not output:
+        raise SystemExit("从标准输入读取任务时必须指定 --output")
+        
+    finished = load_finished(output, args.retry_errors) if args.resume else set()
+    pending = [job for job in jobs if job["id"] not in finished]
+    print(f"共 {len(jobs)} 个任务，已完成 {len(jobs) - len(pending)} 个，待执行 {len(pending)} 个", file=sys.stderr)
+    if not pending:
+        return 0
+        
+    history_manager = create_history_manager(config_manager) if args.save else None
+    mode = 'a' if args.resume else 'w'
+    with open(output, mode, encoding='utf-8') as out_file:
+        # 上次中断时可能留下不完整的最后一行
+        if mode == 'a' and out_file.tell() > 0:
+            with open(output, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    out_file.write("\n")
+        future = api_manager.submit(run_batch(api_manager, config_manager, pending, out_file, args, default_ai,
+                                              history_manager), bounded=False)
+        try:
+            stats = future.result()
+        except KeyboardInterrupt:
+            future.cancel()
+            print(f"\n已中断，已完成的结果保存在 {output}，重新运行相同命令即可继续", file=sys.stderr)
+            return 130
+        finally:
+            if history_manager is not None:
+                history_manager.flush()
+                
+    if args.metrics:
+        api_manager.metrics_exporter.write_file(args.metrics, "prometheus" if args.metrics.endswith(".prom") else "json")
+        print(f"请求统计已写入: {args.metrics}", file=sys.stderr)
+    rate = stats["done"] / stats["elapsed"] if stats["elapsed"] else 0
+    print(f"\n完成 {stats['done']} 个任务，失败 {stats['errors']} 个，用时 {stats['elapsed']:.1f} 秒"
+          f"（{rate:.2f} 个/秒），结果: {output}", file=sys.stderr)
+    return 1 if stats["errors"] else 0
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="AI聊天助手命令行（无界面）")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    ask = subparsers.add_parser("ask", help="单次提问，回答流式输出到标准输出")
+    ask.add_argument("prompt", nargs="*", help="问题（省略时从标准输入读取）")
+    ask.add_argument("--session", help="继续指定的会话并保存")
+    ask.add_argument("--save", action="store_true", help="把问答保存为新会话")
+    
+    batch = subparsers.add_parser("batch", help="批量执行JSONL任务文件")
+    batch.add_argument("input", help="任务文件（每行一个JSON，包含prompt或messages；- 表示标准输入）")
+    batch.add_argument("-o", "--output", help="结果文件（默认为 <任务文件>.results.jsonl）")
+    batch.add_argument("-c", "--concurrency", type=int, help="并发请求数（默认为配置中的max_concurrent_requests）")
+    batch.add_argument("--no-resume", dest="resume", action="store_false", help="覆盖结果文件，不跳过已完成的任务")
+    batch.add_argument("--retry-errors", action="store_true", help="继续时重新执行失败的任务")
+    batch.add_argument("--save", action="store_true", help="把每个成功的任务保存为会话")
+    batch.add_argument("-q", "--quiet", action="store_true", help="不显示进度")
+    batch.add_argument("--metrics", help="结束后把请求统计写入文件（.prom为Prometheus格式，其余为JSON）")
+    
+    for sub in (ask, batch):
+        sub.add_argument("--trace", help="记录性能追踪并在结束时写入Chrome trace文件（可在chrome://tracing或Perfetto中打开）")
+        sub.add_argument("--ai", help="使用的AI（ID或名称，默认为当前AI）")
+        sub.add_argument("--system", help="系统提示词")
+        sub.add_argument("--max-tokens", type=int, default=1000, help="最大生成token数（默认1000）")
+    return parser
+
+def main(argv: List[str] = None) -> int:
+    args = build_parser().parse_args(argv)
+    config_manager = ConfigManager()
+    api_manager = APIManager(config_manager)
+    if args.trace:
+        api_manager.tracer.configure(dict(config_manager.get("tracing") or {}, enabled=True))
+    try:
+        if args.command == "ask":
+            return cmd_ask(args, config_manager, api_manager)
+        return cmd_batch(args, config_manager, api_manager)
+    except KeyboardInterrupt:
+        print("\n已中断", file=sys.stderr)
+        return 130
+    except LookupError as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 2
+    except SystemExit:
+        raise
+    except Exception as e:
+        print(f"错误: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if args.trace:
+            count = api_manager.tracer.dump(args.trace)
+            print(f"性能追踪已写入: {args.trace}（{count} 个事件）", file=sys.stderr)
+        api_manager.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,89 @@
+import time
+import threading
+import httpx
+import openai
+from typing import Dict, Tuple
+
+# 连接池默认参数，可通过配置文件中的"http_pool"项覆盖
+DEFAULT_POOL_SETTINGS = {
+    "max_connections": 20,            # 最大并发连接数
+    "max_keepalive_connections": 10,  # 最多保留的空闲长连接数
+    "keepalive_expiry": 120,          # 空闲长连接保留时间（秒）
+    "client_idle_timeout": 900        # 客户端多久未使用后被回收（秒）
+}
+
+class ClientPool:
+    """按(base_url, api_key)复用AsyncOpenAI客户端，所有客户端共享同一个保持连接的HTTP传输层"""
+    
+    def __init__(self, settings: Dict = None):
+        self.settings = dict(DEFAULT_POOL_SETTINGS)
+        self.settings.update(settings or {})
+        self._lock = threading.Lock()
+        self._clients: Dict[Tuple[str, str], list] = {}  # (base_url, api_key) -> [客户端, 最后使用时间]
+        self._http_client = self._create_http_client()
+        self._last_sweep = time.monotonic()
+        
+    def _create_http_client(self) -> httpx.AsyncClient:
+        """创建共享的HTTP客户端"""
+        limits = httpx.Limits(
+            max_connections=self.settings["max_connections"],
+            max_keepalive_connections=self.settings["max_keepalive_connections"],
+            keepalive_expiry=self.settings["keepalive_expiry"]
+        )
+        return httpx.AsyncClient(limits=limits)
+        
+    def get(self, base_url: str, api_key: str) -> openai.AsyncOpenAI:
+        """获取（必要时创建）指定端点的客户端"""
+        key = (base_url.rstrip("/"), api_key)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._clients.get(key)
+            if entry is None:
+                client = openai.AsyncOpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    http_client=self._http_client,
+                    # 重试由APIManager的RetryPolicy统一处理
+                    max_retries=0
+                )
+                entry = [client, now]
+                self._clients[key] = entry
+            entry[1] = now
+            return entry[0]
+            
+    def _evict_idle(self, now: float):
+        """回收长时间未使用的客户端（调用方需持有锁）"""
+        idle_timeout = self.settings["client_idle_timeout"]
+        # 每隔一段时间才扫描一次，避免每次请求都遍历
+        if now - self._last_sweep < min(idle_timeout, 60):
+            return
+        self._last_sweep = now
+        for key in [k for k, (_, used) in self._clients.items() if now - used > idle_timeout]:
+            # 客户端共享HTTP传输层，这里只丢弃引用，不关闭连接
+            del self._clients[key]
+            
+    def configure(self, settings: Dict = None):
+        """更新连接池参数，参数未变化时保留现有连接，返回需要关闭的旧HTTP客户端"""
+        new_settings = dict(DEFAULT_POOL_SETTINGS)
+        new_settings.update(settings or {})
+        with self._lock:
+            if new_settings == self.settings:
+                return None
+            old_http_client = self._http_client
+            self.settings = new_settings
+            self._http_client = self._create_http_client()
+            self._clients = {}
+            return old_http_client
+            
+    def stats(self) -> Dict:
+        """返回连接池状态"""
+        with self._lock:
+            return {"clients": len(self._clients), **self.settings}
+            
+    async def aclose(self):
+        """关闭共享的HTTP客户端"""
+        with self._lock:
+            self._clients = {}
+            http_client = self._http_client
+        await http_client.aclose()
\ No newline at end of file
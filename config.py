@@ -1,8 +1,8 @@
-import json
 import os
 import sys
 import uuid
 from datetime import datetime
+from atomic_io import atomic_write_json, load_json
 
 # Determine the base path for data files, works for script and frozen exe
 if getattr(sys, 'frozen', False):
@@ -26,8 +26,11 @@ class ConfigManager:
         if not os.path.exists(DATA_DIR):
             os.makedirs(DATA_DIR)
             
+        # 读取现有配置；文件损坏时隔离该文件并重新创建默认配置
+        existing = load_json(self.config_file)
+        
         # 如果配置文件不存在，创建默认配置
-        if not os.path.exists(self.config_file):
+        if not isinstance(existing, dict):
             # 创建默认AI配置
             default_ai_id = str(uuid.uuid4())
             self.config = {
@@ -44,9 +47,7 @@ class ConfigManager:
             }
             self.save_config()
         else:
-            # 读取现有配置
-            with open(self.config_file, 'r', encoding='utf-8') as f:
-                self.config = json.load(f)
+            self.config = existing
                 
             # 确保配置结构正确
             if "ais" not in self.config:
@@ -68,9 +69,8 @@ class ConfigManager:
                 self.save_config()
                 
     def save_config(self):
-        """保存配置文件"""
-        with open(self.config_file, 'w', encoding='utf-8') as f:
-            json.dump(self.config, f, ensure_ascii=False, indent=2)
+        """保存配置文件（原子写入，写入中途崩溃不会损坏原文件）"""
+        atomic_write_json(self.config_file, self.config, indent=2)
             
     def get(self, key, default=None):
         """获取配置项"""
@@ -95,8 +95,8 @@ class ConfigManager:
         """获取指定AI配置"""
         return self.config.get("ais", {}).get(ai_id)
         
-    def add_ai(self, name, api_key, base_url, model):
-        """添加新的AI配置"""
+    def add_ai(self, name, api_key, base_url, model, **options):
+        """添加新的AI配置（options为可选项，如max_context_tokens）"""
         ai_id = str(uuid.uuid4())
         if "ais" not in self.config:
             self.config["ais"] = {}
@@ -105,7 +105,8 @@ class ConfigManager:
             "name": name,
             "api_key": api_key,
             "base_url": base_url,
-            "model": model
+            "model": model,
+            **options
         }
         
         # 如果还没有默认AI，设置这个为默认
@@ -115,17 +116,20 @@ class ConfigManager:
         self.save_config()
         return ai_id
         
-    def update_ai(self, ai_id, name, api_key, base_url, model):
-        """更新AI配置"""
+    def update_ai(self, ai_id, name, api_key, base_url, model, **options):
+        """更新AI配置（保留未修改的可选项）"""
         if "ais" not in self.config:
             self.config["ais"] = {}
             
-        self.config["ais"][ai_id] = {
+        ai_config = self.config["ais"].get(ai_id, {})
+        ai_config.update({
             "name": name,
             "api_key": api_key,
             "base_url": base_url,
-            "model": model
-        }
+            "model": model,
+            **options
+        })
+        self.config["ais"][ai_id] = ai_config
         self.save_config()
         
     def delete_ai(self, ai_id):
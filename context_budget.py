@@ -0,0 +1,62 @@
+import re
+from functools import lru_cache
+from typing import List, Dict
+
+# 中日韩字符（以及全角符号）大致按每字一个token估算
+_CJK_RE = re.compile(r"[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+# 每条消息的格式开销（角色、分隔符等）
+MESSAGE_OVERHEAD = 4
+
+@lru_cache(maxsize=8192)
+def estimate_tokens(text: str) -> int:
+    """快速估算文本的token数（结果按文本缓存，同一条消息不会重复计算）"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    other = len(text) - cjk
+    # 其余字符按约4个字符一个token估算
+    return cjk + (other + 3) // 4
+
+def message_tokens(message: Dict[str, str]) -> int:
+    """估算单条消息占用的token数"""
+    return estimate_tokens(message.get("content") or "") + MESSAGE_OVERHEAD
+
+def count_tokens(messages: List[Dict[str, str]]) -> int:
+    """估算消息列表占用的token总数"""
+    return sum(message_tokens(m) for m in messages)
+
+def trim_history(messages: List[Dict[str, str]], max_context_tokens: int = 0,
+                 reserve_tokens: int = 0, max_messages: int = 0) -> List[Dict[str, str]]:
+    """按上下文预算裁剪历史，保留开头的系统消息和尽可能多的最近消息"""
+    # max_context_tokens为上下文窗口大小，其中reserve_tokens留给回复；
+    # max_messages限制保留的非系统消息条数，两者为0时表示不限制。
+    # 最新的一条消息总会被保留。
+    if not messages or (not max_context_tokens and not max_messages):
+        return messages
+        
+    # 开头的系统消息始终保留
+    head = 0
+    while head < len(messages) and messages[head].get("role") == "system":
+        head += 1
+    system_messages = messages[:head]
+    conversation = messages[head:]
+    if not conversation:
+        return messages
+        
+    budget = None
+    if max_context_tokens:
+        budget = max(max_context_tokens - reserve_tokens, 0) - count_tokens(system_messages)
+        
+    kept = 0
+    used = 0
+    for message in reversed(conversation):
+        if max_messages and kept >= max_messages:
+            break
+        cost = message_tokens(message)
+        if budget is not None and kept and used + cost > budget:
+            break
+        used += cost
+        kept += 1
+        
+    return system_messages + conversation[len(conversation) - kept:]
\ No newline at end of file
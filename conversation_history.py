@@ -1,15 +1,80 @@
+import atexit
 import json
 import os
-from datetime import datetime
-from typing import List, Dict
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional
 from config import DATA_DIR # 导入绝对路径
+from atomic_io import FsyncBatch, append_text, atomic_write, load_json, quarantine
+from session_archive import DEFAULT_ARCHIVE_SETTINGS, SessionArchive
+
+# 会话文件格式：
+#   <session_id>.jsonl  追加写入格式，第一行为文件头，之后每行一条记录
+#       {"type": "header", "version": 1, "session_id": ..., "timestamp": ...}
+#       {"type": "message", "timestamp": ..., "message": {"role": ..., "content": ...}}
+#       {"type": "summary", "timestamp": ..., "text": ..., "covered": ...}
+#       {"type": "meta", "timestamp": ...}
+#   <session_id>.json   旧格式 {session_id, timestamp, messages}，只读，写入时迁移为新格式
+SESSION_EXT = ".jsonl"
+LEGACY_EXT = ".json"
+FORMAT_VERSION = 1
+# 会话清单：保存每个会话的标题、时间戳、消息数和文件的mtime/大小，列出会话时只需读这一个文件
+MANIFEST_VERSION = 1
 
 class ConversationHistory:
+    # 内存中最多缓存的会话数（未写入磁盘的会话不会被淘汰）
+    MAX_CACHED_SESSIONS = 8
+    # 后台写入前等待的时间，用于合并短时间内的多次保存（秒）
+    FLUSH_DELAY = 0.5
+    # 后台写入时会话清单最多每隔多久写入一次（秒），显式调用flush()和退出时立即写入
+    MANIFEST_INTERVAL = 30
+    # 文件中多余记录（摘要更新、时间戳等）超过该数量时整理文件
+    COMPACT_THRESHOLD = 50
+    # 写入后是否fsync：整体重写的文件逐个fsync后再替换，追加写入的文件在每轮写入结束时批量fsync
+    FSYNC = True
+    # 启动后多久进行第一次归档和清理检查（秒）
+    FIRST_SWEEP_DELAY = 60
+    
     def __init__(self):
         self.history_dir = os.path.join(DATA_DIR, "history") # 使用绝对路径
         self.current_session_id = None
+        # 内存中的会话数据（以此为准）：session_id -> {"session_id", "timestamp", "messages", "summary"}
+        self._sessions = OrderedDict()
+        # 已修改但尚未写入磁盘的会话
+        self._dirty = set()
+        # 已有消息被修改或删除、需要整体重写的会话
+        self._rewrite = set()
+        # 磁盘上会话文件的状态：session_id -> {"messages", "records", "summary", "timestamp"}
+        self._persisted = {}
+        self._lock = threading.RLock()
+        self._dirty_event = threading.Condition(self._lock)
+        # 保证同一时间只有一个线程在写文件
+        self._flush_lock = threading.Lock()
+        # 会话清单放在历史目录之外，避免写清单本身改变目录的mtime
+        self.manifest_file = os.path.join(DATA_DIR, "history_manifest.json")
+        self._manifest = None
+        self._manifest_dirty = False
+        self._manifest_written = 0.0
+        # 清单延后写入期间存在的标记文件：异常退出后清单可能落后于会话文件，下次启动时逐个检查文件
+        self.manifest_marker = os.path.join(DATA_DIR, "history_manifest.stale")
+        self._manifest_stale = False
+        # 可选的搜索索引，保存或删除会话时同步更新
+        self.search_index = None
+        # 可选的性能追踪，记录后台写入磁盘的耗时
+        self.tracer = None
+        # 冷会话归档，读取时按需只解压一个会话；归档与清理由后台线程按配置执行
+        self.archive = SessionArchive(os.path.join(self.history_dir, "archive"))
+        self.archive_settings = dict(DEFAULT_ARCHIVE_SETTINGS)
+        self._sweeper = None
         self.ensure_history_dir()
         
+        # 后台写入线程（启动时先把旧格式文件迁移为新格式），进程退出时保证写入
+        self._writer = threading.Thread(target=self._writer_loop, name="HistoryWriter", daemon=True)
+        self._writer.start()
+        atexit.register(self.flush)
+        
     def ensure_history_dir(self):
         """确保历史记录目录存在"""
         if not os.path.exists(self.history_dir):
@@ -20,83 +85,675 @@ class ConversationHistory:
         self.current_session_id = datetime.now().strftime("%Y%m%d_%H%M%S")
         return self.current_session_id
         
+    def _session_file(self, session_id: str) -> str:
+        return os.path.join(self.history_dir, f"{session_id}{SESSION_EXT}")
+        
+    def _legacy_file(self, session_id: str) -> str:
+        return os.path.join(self.history_dir, f"{session_id}{LEGACY_EXT}")
+        
+    @staticmethod
+    def _is_session_file(filename: str) -> bool:
+        return filename.endswith(SESSION_EXT) or filename.endswith(LEGACY_EXT)
+        
+    @staticmethod
+    def _parse_session_file(path: str) -> Dict:
+        """解析会话文件（兼容新旧两种格式），返回会话数据和文件状态；文件内容不是会话时抛出ValueError"""
+        with open(path, 'r', encoding='utf-8') as f:
+            if path.endswith(LEGACY_EXT):
+                data = json.load(f)
+                if not isinstance(data, dict):
+                    raise ValueError(f"会话文件格式不正确: {path}")
+                messages = data.setdefault("messages", [])
+                if not isinstance(messages, list) or not all(isinstance(m, dict) for m in messages):
+                    raise ValueError(f"会话文件中的消息格式不正确: {path}")
+                return {"data": data, "state": None}
+            lines = f.read().split("\n")
+            
+        data = {"session_id": None, "timestamp": None, "messages": []}
+        records = 0
+        # 最后一行不完整（写入时崩溃）或有无法解析的记录时，下次写入整体重写
+        damaged = lines[-1] != ""
+        for line in lines:
+            if not line.strip():
+                continue
+            records += 1
+            try:
+                record = json.loads(line)
+            except ValueError:
+                damaged = True
+                continue
+            # 格式不正确的记录与无法解析的行一样跳过
+            if not isinstance(record, dict) or (record.get("type") == "message"
+                                                and not isinstance(record.get("message"), dict)):
+                damaged = True
+                continue
+            kind = record.get("type")
+            if kind == "message":
+                data["messages"].append(record["message"])
+            elif kind == "summary":
+                data["summary"] = {"text": record.get("text", ""), "covered": record.get("covered", 0)}
+            elif kind == "header":
+                data["session_id"] = record.get("session_id")
+            data["timestamp"] = record.get("timestamp") or data["timestamp"]
+            
+        if not data["session_id"]:
+            data["session_id"] = os.path.basename(path)[:-len(SESSION_EXT)]
+        state = {
+            "messages": len(data["messages"]),
+            "records": records,
+            "summary": data.get("summary"),
+            "timestamp": data["timestamp"],
+            "damaged": damaged
+        }
+        return {"data": data, "state": state}
+        
+    def _read_session_file(self, session_id: str) -> Optional[Dict]:
+        """从磁盘读取会话数据（调用方需持有锁），新格式优先，其次旧格式"""
+        for path in (self._session_file(session_id), self._legacy_file(session_id)):
+            if os.path.exists(path):
+                try:
+                    parsed = self._parse_session_file(path)
+                except ValueError:
+                    # 文件已损坏：隔离后当作不存在，不影响其他会话
+                    quarantine(path)
+                    continue
+                state = parsed["state"]
+                if state is None or state["damaged"]:
+                    # 旧格式或损坏的文件需要整体重写
+                    self._rewrite.add(session_id)
+                else:
+                    self._persisted[session_id] = state
+                return parsed["data"]
+                
+        # 没有会话文件时从归档中解压，之后保存时写回普通会话文件
+        try:
+            data = self.archive.get(session_id)
+        except Exception as e:
+            print(f"读取归档会话 {session_id} 时出错: {e}")
+            return None
+        if data is not None:
+            self._rewrite.add(session_id)
+        return data
+        
+    @staticmethod
+    def _record_line(record: Dict) -> str:
+        return json.dumps(record, ensure_ascii=False) + "\n"
+        
+    def _write_session_file(self, session_id: str, session_data: Dict) -> Dict:
+        """把会话整体原子地写成新格式，返回文件状态"""
+        timestamp = session_data.get("timestamp")
+        lines = [self._record_line({"type": "header", "version": FORMAT_VERSION,
+                                    "session_id": session_id, "timestamp": timestamp})]
+        for message in session_data.get("messages", []):
+            lines.append(self._record_line({"type": "message", "timestamp": timestamp, "message": message}))
+        summary = session_data.get("summary")
+        if summary:
+            lines.append(self._record_line({"type": "summary", "timestamp": timestamp, **summary}))
+            
+        atomic_write(self._session_file(session_id), "".join(lines), fsync=self.FSYNC)
+        
+        # 新格式写入成功后删除旧格式文件
+        legacy_file = self._legacy_file(session_id)
+        if os.path.exists(legacy_file):
+            os.remove(legacy_file)
+        return {
+            "messages": len(session_data.get("messages", [])),
+            "records": len(lines),
+            "summary": summary,
+            "timestamp": timestamp,
+            "damaged": False
+        }
+        
+    def _append_session_file(self, session_id: str, session_data: Dict, state: Dict, batch: FsyncBatch) -> Dict:
+        """只把新增的消息、变化的摘要和时间戳追加到会话文件末尾，返回新的文件状态"""
+        timestamp = session_data.get("timestamp")
+        messages = session_data.get("messages", [])
+        summary = session_data.get("summary")
+        lines = []
+        for message in messages[state["messages"]:]:
+            lines.append(self._record_line({"type": "message", "timestamp": timestamp, "message": message}))
+        if summary and summary != state["summary"]:
+            lines.append(self._record_line({"type": "summary", "timestamp": timestamp, **summary}))
+        if not lines and timestamp != state["timestamp"]:
+            lines.append(self._record_line({"type": "meta", "timestamp": timestamp}))
+            
+        if lines:
+            append_text(self._session_file(session_id), "".join(lines), batch)
+        return dict(state, messages=len(messages), records=state["records"] + len(lines),
+                    summary=summary, timestamp=timestamp)
+        
+    def _store_session(self, session_id: str, session_data: Dict, state: Optional[Dict], batch: FsyncBatch) -> Dict:
+        """写入一个会话：能追加时追加，否则整体重写；多余记录过多时顺便整理文件"""
+        if state is None:
+            return self._write_session_file(session_id, session_data)
+        live_records = 1 + len(session_data.get("messages", [])) + (1 if session_data.get("summary") else 0)
+        if state["records"] - live_records > self.COMPACT_THRESHOLD:
+            return self._write_session_file(session_id, session_data)
+        return self._append_session_file(session_id, session_data, state, batch)
+        
+    def _get_session(self, session_id: str) -> Optional[Dict]:
+        """获取会话数据：优先使用内存缓存，首次访问时从磁盘加载（调用方需持有锁）"""
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._read_session_file(session_id)
+            if session is None:
+                return None
+            self._sessions[session_id] = session
+        self._sessions.move_to_end(session_id)
+        self._evict()
+        return session
+        
+    def _evict(self):
+        """淘汰最久未使用且已写入磁盘的会话（调用方需持有锁）"""
+        for session_id in list(self._sessions):
+            if len(self._sessions) <= self.MAX_CACHED_SESSIONS:
+                break
+            if session_id not in self._dirty and session_id != self.current_session_id:
+                del self._sessions[session_id]
+                self._persisted.pop(session_id, None)
+                
+    def _mark_dirty(self, session_id: str):
+        """标记会话需要写入磁盘并唤醒后台写入线程（调用方需持有锁）"""
+        self._dirty.add(session_id)
+        self._dirty_event.notify()
+        
     def get_current_history(self) -> List[Dict[str, str]]:
         """获取当前会话的历史记录"""
         if not self.current_session_id:
             self.create_new_session()
             
-        history_file = os.path.join(self.history_dir, f"{self.current_session_id}.json")
+        return self.load_session(self.current_session_id)
         
-        if os.path.exists(history_file):
-            with open(history_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return data.get("messages", [])
-        else:
-            return []
-            
     def save_current_history(self, messages: List[Dict[str, str]]):
         """保存当前会话的历史记录"""
         if not self.current_session_id:
             self.create_new_session()
             
-        history_file = os.path.join(self.history_dir, f"{self.current_session_id}.json")
+        self.save_session(self.current_session_id, messages)
         
-        # 创建会话数据
-        session_data = {
-            "session_id": self.current_session_id,
-            "timestamp": datetime.now().isoformat(),
-            "messages": messages
+    def save_session(self, session_id: str, messages: List[Dict[str, str]]):
+        """保存指定会话的历史记录（先更新内存，由后台线程写入磁盘）"""
+        with self._lock:
+            session = self._get_session(session_id) or {"session_id": session_id}
+            old_messages = session.get("messages", [])
+            if list(messages[:len(old_messages)]) != old_messages:
+                # 已有消息被修改或删除，无法追加写入
+                self._rewrite.add(session_id)
+            session["timestamp"] = datetime.now().isoformat()
+            session["messages"] = list(messages)
+            self._sessions[session_id] = session
+            self._mark_dirty(session_id)
+            
+        if self.search_index is not None:
+            self.search_index.update_session(session_id, messages, session["timestamp"])
+            
+    def get_summary(self, session_id: str) -> Optional[Dict]:
+        """获取指定会话的滚动摘要"""
+        with self._lock:
+            session = self._get_session(session_id)
+            return session.get("summary") if session else None
+            
+    def save_summary(self, session_id: str, text: str, covered: int):
+        """保存指定会话的滚动摘要（与会话消息一起写入会话文件）"""
+        with self._lock:
+            session = self._get_session(session_id)
+            if session is None:
+                return
+            session["summary"] = {"text": text, "covered": covered}
+            self._mark_dirty(session_id)
+            
+    def _writer_loop(self):
+        """后台写入线程：等待修改，稍作延迟以合并连续保存后写入磁盘"""
+        try:
+            self.migrate_legacy_sessions()
+        except Exception as e:
+            print(f"迁移聊天记录时出错: {e}")
+        while True:
+            with self._lock:
+                while not self._dirty:
+                    if not self._manifest_dirty:
+                        self._dirty_event.wait()
+                        continue
+                    # 只有清单待写入时等到写入间隔到期
+                    remaining = self._manifest_written + self.MANIFEST_INTERVAL - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._dirty_event.wait(remaining)
+            time.sleep(self.FLUSH_DELAY)
+            self.flush(manifest=False)
+            
+    def flush(self, manifest: bool = True):
+        """立即把所有未写入的会话写入磁盘；manifest为False时（后台写入）会话清单按MANIFEST_INTERVAL间隔写入"""
+        with self._flush_lock:
+            with self._lock:
+                pending = {}
+                for session_id in self._dirty:
+                    session = self._sessions[session_id]
+                    state = None if session_id in self._rewrite else self._persisted.get(session_id)
+                    pending[session_id] = (dict(session, messages=list(session.get("messages", []))), state)
+                self._rewrite.difference_update(self._dirty)
+                self._dirty.clear()
+                
+            start = time.perf_counter()
+            if pending:
+                self._mark_manifest_stale()
+            batch = FsyncBatch(self.FSYNC)
+            for session_id, (session_data, state) in pending.items():
+                try:
+                    state = self._store_session(session_id, session_data, state, batch)
+                except Exception as e:
+                    print(f"写入聊天记录时出错: {e}")
+                    with self._lock:
+                        if session_id in self._sessions:
+                            # 文件可能只写入了一部分，下次整体重写
+                            self._dirty.add(session_id)
+                            self._rewrite.add(session_id)
+                    continue
+                with self._lock:
+                    if session_id in self._sessions:
+                        self._persisted[session_id] = state
+                    self._update_manifest(session_id, session_data)
+                    
+            batch.commit()
+            if manifest or time.monotonic() - self._manifest_written >= self.MANIFEST_INTERVAL:
+                self._write_manifest()
+            if self.tracer is not None and pending:
+                self.tracer.add("history_flush", start, cat="io", sessions=len(pending))
+            
+            # 已写回普通会话文件的归档会话从归档中删除
+            unarchived = [session_id for session_id in pending if session_id in self.archive]
+            if unarchived:
+                self.archive.remove(unarchived)
+            
+    def migrate_legacy_sessions(self) -> int:
+        """把旧格式的会话文件转换为新格式，返回迁移的会话数"""
+        migrated = 0
+        with self._flush_lock:
+            for filename in os.listdir(self.history_dir):
+                if not filename.endswith(LEGACY_EXT):
+                    continue
+                session_id = filename[:-len(LEGACY_EXT)]
+                with self._lock:
+                    if session_id in self._sessions:
+                        # 已加载到内存的会话由下次写入负责迁移
+                        continue
+                try:
+                    data = self._parse_session_file(os.path.join(self.history_dir, filename))["data"]
+                    if os.path.exists(self._session_file(session_id)):
+                        # 新格式文件已存在时以新格式为准
+                        os.remove(self._legacy_file(session_id))
+                    else:
+                        self._write_session_file(session_id, data)
+                        with self._lock:
+                            self._update_manifest(session_id, data)
+                    migrated += 1
+                except ValueError:
+                    quarantine(os.path.join(self.history_dir, filename))
+                except Exception as e:
+                    print(f"迁移聊天记录 {filename} 时出错: {e}")
+            self._write_manifest()
+        return migrated
+        
+    def _load_manifest(self) -> Dict:
+        """读取会话清单（调用方需持有锁），文件不存在或损坏时返回空清单"""
+        if self._manifest is None:
+            try:
+                manifest = load_json(self.manifest_file)
+            except OSError:
+                manifest = None
+            if (not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION
+                    or not isinstance(manifest.get("sessions"), dict)):
+                manifest = {"version": MANIFEST_VERSION, "dir_mtime": None, "sessions": {}}
+            if os.path.exists(self.manifest_marker):
+                # 上次没有正常退出：追加写入不改变目录的mtime，需要按每个文件的mtime/大小检查清单
+                manifest["dir_mtime"] = None
+                self._manifest_stale = True
+            self._manifest = manifest
+        return self._manifest
+        
+    def _manifest_entry(self, filename: str, data: Dict, stat: os.stat_result) -> Dict:
+        info = self._session_info(data)
+        return {
+            "file": filename,
+            "title": info["title"],
+            "timestamp": info["timestamp"],
+            "messages": len(data.get("messages", [])),
+            "mtime": stat.st_mtime_ns,
+            "size": stat.st_size
         }
         
-        # 保存到文件
-        with open(history_file, 'w', encoding='utf-8') as f:
-            json.dump(session_data, f, ensure_ascii=False, indent=2)
+    def _update_manifest(self, session_id: str, session_data: Dict):
+        """会话写入磁盘后更新清单中的对应项（调用方需持有锁）"""
+        path = self._session_file(session_id)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        sessions = self._load_manifest()["sessions"]
+        sessions[session_id] = self._manifest_entry(os.path.basename(path), session_data, stat)
+        self._manifest_dirty = True
+        
+    def _remove_from_manifest(self, session_id: str = None):
+        """从清单中删除会话，不指定会话时清空清单（调用方需持有锁）"""
+        sessions = self._load_manifest()["sessions"]
+        if session_id is None:
+            sessions.clear()
+        else:
+            sessions.pop(session_id, None)
+        self._manifest_dirty = True
+        
+    def _mark_manifest_stale(self):
+        """写入会话文件前留下标记，表示磁盘上的清单可能落后（调用方需持有_flush_lock）"""
+        if self._manifest_stale:
+            return
+        try:
+            with open(self.manifest_marker, "w"):
+                pass
+            self._manifest_stale = True
+        except OSError as e:
+            print(f"写入会话清单标记时出错: {e}")
+            
+    def _write_manifest(self):
+        """清单有变化时原子地写入磁盘（清单可以重建，不需要fsync），写入后清除过期标记（调用方需持有_flush_lock）"""
+        with self._lock:
+            if not self._manifest_dirty:
+                return
+            content = json.dumps(self._manifest, ensure_ascii=False)
+            self._manifest_dirty = False
+        try:
+            atomic_write(self.manifest_file, content, fsync=False)
+        except OSError as e:
+            print(f"写入会话清单时出错: {e}")
+            return
+        self._manifest_written = time.monotonic()
+        if self._manifest_stale:
+            try:
+                os.remove(self.manifest_marker)
+            except OSError:
+                pass
+            self._manifest_stale = False
             
+    def _validate_manifest(self):
+        """目录的mtime变化时（有文件被添加、删除或替换）按文件mtime/大小修正清单，只重新解析变化的文件"""
+        try:
+            dir_mtime = os.stat(self.history_dir).st_mtime_ns
+        except OSError:
+            return
+        with self._lock:
+            if self._load_manifest()["dir_mtime"] == dir_mtime:
+                return
+                
+        # 与写入线程互斥，避免用旧内容覆盖刚写入的清单项
+        with self._flush_lock:
+            with self._lock:
+                known = dict(self._load_manifest()["sessions"])
+            files = {}
+            with os.scandir(self.history_dir) as entries:
+                for entry in entries:
+                    if not self._is_session_file(entry.name):
+                        continue
+                    session_id = os.path.splitext(entry.name)[0]
+                    # 新旧格式同时存在时以新格式为准
+                    if session_id in files and not entry.name.endswith(SESSION_EXT):
+                        continue
+                    files[session_id] = entry
+                    
+            sessions = {}
+            for session_id, entry in files.items():
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                old = known.get(session_id)
+                if (isinstance(old, dict) and old.get("file") == entry.name and old.get("mtime") == stat.st_mtime_ns
+                        and old.get("size") == stat.st_size):
+                    sessions[session_id] = old
+                    continue
+                try:
+                    data = self._parse_session_file(entry.path)["data"]
+                except ValueError:
+                    # 文件已损坏：隔离后不再出现在列表中
+                    quarantine(entry.path)
+                    continue
+                except OSError:
+                    # 文件可能正在被迁移或替换，下次再检查
+                    dir_mtime = None
+                    continue
+                sessions[session_id] = self._manifest_entry(entry.name, data, stat)
+                
+            with self._lock:
+                manifest = self._load_manifest()
+                manifest["sessions"] = sessions
+                manifest["dir_mtime"] = dir_mtime
+                self._manifest_dirty = True
+                self._dirty_event.notify()
+                            
     def get_all_sessions(self) -> List[Dict[str, str]]:
         """获取所有会话列表"""
-        sessions = []
-        
-        for filename in os.listdir(self.history_dir):
-            if filename.endswith(".json"):
-                file_path = os.path.join(self.history_dir, filename)
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    # 获取第一条消息作为会话标题
-                    first_message = ""
-                    if data.get("messages"):
-                        first_message = data["messages"][0].get("content", "")[:30] + "..."
-                    
-                    sessions.append({
-                        "session_id": data.get("session_id"),
-                        "title": first_message,
-                        "timestamp": data.get("timestamp")
-                    })
+        # 磁盘上的会话从清单读取，不再逐个解析会话文件
+        self._validate_manifest()
+        sessions = {
+            session_id: {"session_id": session_id, "title": entry["title"], "timestamp": entry["timestamp"]}
+            for session_id, entry in self.archive.entries().items()
+        }
+        with self._lock:
+            for session_id, entry in self._load_manifest()["sessions"].items():
+                sessions[session_id] = {"session_id": session_id, "title": entry["title"],
+                                        "timestamp": entry["timestamp"]}
+            
+            # 内存中的会话可能还未写入磁盘，以内存为准
+            for session_id, data in self._sessions.items():
+                if data.get("messages"):
+                    sessions[session_id] = self._session_info(data)
                     
         # 按时间倒序排列
-        sessions.sort(key=lambda x: x["timestamp"], reverse=True)
+        sessions = list(sessions.values())
+        sessions.sort(key=lambda x: x["timestamp"] or "", reverse=True)
         return sessions
         
+    def _session_info(self, data: Dict) -> Dict[str, str]:
+        """生成会话列表中的一项"""
+        # 获取第一条消息作为会话标题
+        first_message = ""
+        if data.get("messages"):
+            first_message = data["messages"][0].get("content", "")[:30] + "..."
+            
+        return {
+            "session_id": data.get("session_id"),
+            "title": first_message,
+            "timestamp": data.get("timestamp")
+        }
+        
+    def peek_session(self, session_id: str) -> Optional[List[Dict[str, str]]]:
+        """读取会话消息但不放入内存缓存（用于搜索索引），会话不存在时返回None"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                return list(session.get("messages", []))
+        for path in (self._session_file(session_id), self._legacy_file(session_id)):
+            if os.path.exists(path):
+                try:
+                    return self._parse_session_file(path)["data"]["messages"]
+                except (OSError, ValueError):
+                    return None
+        try:
+            data = self.archive.get(session_id)
+        except Exception:
+            return None
+        return data.get("messages", []) if data else None
+                
     def load_session(self, session_id: str) -> List[Dict[str, str]]:
         """加载指定会话的历史记录"""
-        history_file = os.path.join(self.history_dir, f"{session_id}.json")
-        
-        if os.path.exists(history_file):
-            with open(history_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return data.get("messages", [])
-        else:
-            return []
+        with self._lock:
+            session = self._get_session(session_id)
+            if session is None:
+                return []
+            return list(session.get("messages", []))
             
     def delete_session(self, session_id: str):
         """删除指定会话"""
-        history_file = os.path.join(self.history_dir, f"{session_id}.json")
+        self._delete_sessions([session_id])
         
-        if os.path.exists(history_file):
-            os.remove(history_file)
+    def _delete_sessions(self, session_ids: List[str], skip_loaded: bool = False) -> List[str]:
+        """批量删除会话（包括归档中的），skip_loaded为True时跳过已加载到内存的会话，返回删除的会话"""
+        # 等待正在进行的写入完成，避免删除后又被写回
+        with self._flush_lock:
+            with self._lock:
+                if skip_loaded:
+                    session_ids = [i for i in session_ids if i not in self._sessions and i != self.current_session_id]
+                for session_id in session_ids:
+                    self._sessions.pop(session_id, None)
+                    self._dirty.discard(session_id)
+                    self._rewrite.discard(session_id)
+                    self._persisted.pop(session_id, None)
+                    self._remove_from_manifest(session_id)
+                    
+            for session_id in session_ids:
+                for history_file in (self._session_file(session_id), self._legacy_file(session_id)):
+                    if os.path.exists(history_file):
+                        os.remove(history_file)
+            self.archive.remove(session_ids)
+            self._write_manifest()
             
+        if self.search_index is not None:
+            for session_id in session_ids:
+                self.search_index.remove_session(session_id)
+        return session_ids
+                
     def clear_all_history(self):
         """清除所有历史记录"""
-        for filename in os.listdir(self.history_dir):
-            if filename.endswith(".json"):
-                file_path = os.path.join(self.history_dir, filename)
-                os.remove(file_path)
\ No newline at end of file
+        with self._flush_lock:
+            with self._lock:
+                self._sessions.clear()
+                self._dirty.clear()
+                self._rewrite.clear()
+                self._persisted.clear()
+                self._remove_from_manifest()
+                
+            for filename in os.listdir(self.history_dir):
+                if self._is_session_file(filename):
+                    file_path = os.path.join(self.history_dir, filename)
+                    os.remove(file_path)
+            self.archive.clear()
+            self._write_manifest()
+            
+        if self.search_index is not None:
+            self.search_index.clear()
+                
+    def configure_archive(self, settings: Dict = None):
+        """设置归档与保留策略（配置项"archive"），启用时启动后台清理线程"""
+        self.archive_settings = dict(DEFAULT_ARCHIVE_SETTINGS)
+        self.archive_settings.update(settings or {})
+        if self.archive_settings["enabled"] and self._sweeper is None:
+            self._sweeper = threading.Thread(target=self._sweeper_loop, name="HistorySweeper", daemon=True)
+            self._sweeper.start()
+            
+    def _sweeper_loop(self):
+        """后台清理线程：定期归档冷会话并按保留策略删除旧会话"""
+        time.sleep(self.FIRST_SWEEP_DELAY)
+        while True:
+            if self.archive_settings["enabled"]:
+                try:
+                    self.sweep()
+                except Exception as e:
+                    print(f"整理聊天记录时出错: {e}")
+            time.sleep(max(60, self.archive_settings["sweep_interval"]))
+            
+    def sweep(self) -> Dict[str, int]:
+        """执行一次归档和清理，返回归档和删除的会话数"""
+        archived = self.archive_cold_sessions()
+        deleted = self.enforce_retention()
+        self.archive.compact()
+        return {"archived": archived, "deleted": deleted}
+        
+    def _days_ago(self, days: float) -> str:
+        return (datetime.now() - timedelta(days=days)).isoformat()
+        
+    def archive_cold_sessions(self) -> int:
+        """把超过设定天数未更新的会话压缩归档，返回归档的会话数"""
+        days = self.archive_settings["archive_after_days"]
+        if not days:
+            return 0
+        cutoff = self._days_ago(days)
+        self._validate_manifest()
+        with self._flush_lock:
+            with self._lock:
+                candidates = [
+                    (session_id, entry) for session_id, entry in self._load_manifest()["sessions"].items()
+                    if (entry.get("timestamp") or "") < cutoff
+                    and session_id not in self._sessions and session_id != self.current_session_id
+                ]
+                
+            batch = []
+            for session_id, entry in candidates:
+                path = os.path.join(self.history_dir, entry["file"])
+                try:
+                    batch.append((session_id, self._parse_session_file(path)["data"], entry))
+                except ValueError:
+                    quarantine(path)
+                except OSError:
+                    continue
+            if not batch:
+                return 0
+            self.archive.add(batch, self.archive_settings["codec"])
+            
+            archived = 0
+            with self._lock:
+                for session_id, _, entry in batch:
+                    if session_id in self._sessions:
+                        # 归档期间被加载的会话保留普通文件
+                        self.archive.remove([session_id])
+                        continue
+                    try:
+                        os.remove(os.path.join(self.history_dir, entry["file"]))
+                    except OSError:
+                        pass
+                    self._remove_from_manifest(session_id)
+                    archived += 1
+            self._write_manifest()
+        return archived
+        
+    def enforce_retention(self) -> int:
+        """按会话数、时间和占用空间的上限删除最旧的会话，返回删除的会话数"""
+        settings = self.archive_settings
+        max_sessions = settings["max_sessions"]
+        max_age_days = settings["max_age_days"]
+        max_bytes = settings["max_total_mb"] * 1024 * 1024
+        if not (max_sessions or max_age_days or max_bytes):
+            return 0
+            
+        self._validate_manifest()
+        sizes = {session_id: (entry.get("timestamp") or "", entry["length"])
+                 for session_id, entry in self.archive.entries().items()}
+        with self._lock:
+            for session_id, entry in self._load_manifest()["sessions"].items():
+                sizes[session_id] = (entry.get("timestamp") or "", entry["size"])
+            protected = set(self._sessions) | {self.current_session_id}
+            
+        # 从最旧的会话开始删除
+        remaining = len(sizes)
+        total_bytes = sum(size for _, size in sizes.values())
+        cutoff = self._days_ago(max_age_days) if max_age_days else ""
+        doomed = []
+        for session_id, (timestamp, size) in sorted(sizes.items(), key=lambda item: item[1][0]):
+            if session_id in protected:
+                continue
+            if not ((cutoff and timestamp < cutoff) or (max_sessions and remaining > max_sessions)
+                    or (max_bytes and total_bytes > max_bytes)):
+                break
+            doomed.append(session_id)
+            remaining -= 1
+            total_bytes -= size
+        if not doomed:
+            return 0
+        return len(self._delete_sessions(doomed, skip_loaded=True))
+
+def create_history_manager(config_manager):
+    """按配置创建聊天记录存储：配置"history_backend": "sqlite"时使用SQLite，否则使用JSON文件"""
+    if config_manager.get("history_backend") == "sqlite":
+        from history_sqlite import SQLiteConversationHistory
+        return SQLiteConversationHistory()
+    history_manager = ConversationHistory()
+    # 冷会话归档与保留策略（配置项"archive"）
+    history_manager.configure_archive(config_manager.get("archive"))
+    return history_manager
\ No newline at end of file
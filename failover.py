@@ -0,0 +1,179 @@
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional
+from rate_limit import RetryPolicy
+
+# 故障转移默认参数，可通过配置文件中的"failover"项覆盖
+DEFAULT_FAILOVER_SETTINGS = {
+    "failure_threshold": 3,     # 连续失败多少次后熔断
+    "reset_timeout": 30,        # 熔断后多久允许再次尝试（秒）
+    "hedge_delay": 2.0,         # 延迟样本不足时的对冲请求等待时间（秒）
+    "hedge_min_samples": 10,    # 使用p95作为对冲延迟所需的最少样本数
+    "hedge_min_delay": 0.2      # 对冲延迟下限（秒）
+}
+
+class CircuitBreaker:
+    """按AI记录连续失败次数，失败过多时暂时跳过该端点"""
+    
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures: Dict[str, int] = {}
+        self._opened_at: Dict[str, float] = {}
+        
+    def allow(self, ai_id: str) -> bool:
+        """判断是否允许向该AI发送请求（熔断超时后放行试探请求）"""
+        opened_at = self._opened_at.get(ai_id)
+        if opened_at is None:
+            return True
+        return time.monotonic() - opened_at >= self.reset_timeout
+        
+    def record_success(self, ai_id: str):
+        self._failures.pop(ai_id, None)
+        self._opened_at.pop(ai_id, None)
+        
+    def record_failure(self, ai_id: str):
+        failures = self._failures.get(ai_id, 0) + 1
+        self._failures[ai_id] = failures
+        if failures >= self.failure_threshold:
+            # 熔断（或试探失败后重新熔断）
+            self._opened_at[ai_id] = time.monotonic()
+            
+    def is_open(self, ai_id: str) -> bool:
+        return not self.allow(ai_id)
+
+class LatencyTracker:
+    """记录每个AI最近的响应延迟，用于计算对冲请求的等待时间"""
+    
+    def __init__(self, window: int = 100):
+        self._samples: Dict[str, deque] = {}
+        self.window = window
+        
+    def record(self, key: str, seconds: float):
+        self._samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+        
+    def percentile(self, key: str, pct: float, min_samples: int = 1) -> Optional[float]:
+        samples = self._samples.get(key)
+        if not samples or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+class FailoverPolicy:
+    """按备用列表依次或对冲地调用多个AI，取最先成功的结果"""
+    
+    def __init__(self, config_manager):
+        self.config_manager = config_manager
+        self.latency = LatencyTracker()
+        self.breaker = CircuitBreaker()
+        self.configure()
+        
+    @property
+    def settings(self) -> Dict:
+        settings = dict(DEFAULT_FAILOVER_SETTINGS)
+        settings.update(self.config_manager.get("failover") or {})
+        return settings
+        
+    def configure(self, config_manager=None):
+        """重新读取熔断参数"""
+        if config_manager is not None:
+            self.config_manager = config_manager
+        settings = self.settings
+        self.breaker.failure_threshold = settings["failure_threshold"]
+        self.breaker.reset_timeout = settings["reset_timeout"]
+        
+    def candidates(self, ai_id: str) -> List[str]:
+        """返回主AI及其备用AI列表，已熔断的端点排在最后"""
+        ai_config = self.config_manager.get_ai(ai_id) or {}
+        ais = self.config_manager.get_ais()
+        ordered = [ai_id]
+        for backup_id in ai_config.get("fallbacks", []):
+            if backup_id in ais and backup_id not in ordered:
+                ordered.append(backup_id)
+        healthy = [i for i in ordered if self.breaker.allow(i)]
+        # 全部熔断时仍然尝试，避免请求直接失败
+        return healthy + [i for i in ordered if i not in healthy]
+        
+    def hedge_delay(self, key: str) -> float:
+        """对冲延迟：优先使用该AI最近延迟的p95"""
+        settings = self.settings
+        p95 = self.latency.percentile(key, 95, settings["hedge_min_samples"])
+        if p95 is None:
+            return settings["hedge_delay"]
+        return max(p95, settings["hedge_min_delay"])
+        
+    async def run(self, ai_id: str, attempt: Callable[[str], Awaitable], kind: str = "complete",
+                  discard: Callable[[object], Awaitable] = None, use_backups: bool = True):
+        """执行请求：失败时切换到下一个备用AI，开启对冲时超过p95延迟就并发请求备用AI"""
+        candidates = self.candidates(ai_id) if use_backups else [ai_id]
+        hedge = bool((self.config_manager.get_ai(ai_id) or {}).get("hedge")) and len(candidates) > 1
+        pending: Dict[asyncio.Task, str] = {}
+        errors = []
+        next_index = 0
+        
+        def launch():
+            nonlocal next_index
+            target = candidates[next_index]
+            next_index += 1
+            pending[asyncio.ensure_future(self._timed(target, attempt, kind))] = target
+            
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if hedge and next_index < len(candidates):
+                    timeout = self.hedge_delay(f"{ai_id}:{kind}")
+                done, _ = await asyncio.wait(list(pending), timeout=timeout,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # 主请求过慢，发出对冲请求
+                    launch()
+                    continue
+                    
+                winner = None
+                for task in done:
+                    pending.pop(task)
+                    if task.exception() is None:
+                        if winner is None:
+                            winner = task.result()
+                        elif discard is not None:
+                            await discard(task.result())
+                    else:
+                        errors.append(task.exception())
+                        
+                if winner is not None:
+                    return winner
+                if not pending and next_index < len(candidates):
+                    # 当前请求全部失败，切换到下一个备用AI
+                    launch()
+        finally:
+            # 取消落败或未完成的请求，立即释放连接
+            for task in pending:
+                task.cancel()
+            for task in list(pending):
+                try:
+                    result = await task
+                    if discard is not None:
+                        await discard(result)
+                except BaseException:
+                    pass
+                    
+        raise errors[-1] if errors else Exception("没有可用的AI")
+        
+    async def _timed(self, ai_id: str, attempt: Callable[[str], Awaitable], kind: str):
+        """执行单次请求并记录延迟和健康状态"""
+        start = time.monotonic()
+        try:
+            result = await attempt(ai_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 只有网络、超时、限流和服务端错误计入熔断；请求本身的错误（400、鉴权、上下文过长等）换端点也无济于事
+            if RetryPolicy.is_transient(e):
+                self.breaker.record_failure(ai_id)
+            raise
+        self.breaker.record_success(ai_id)
+        self.latency.record(f"{ai_id}:{kind}", time.monotonic() - start)
+        return result
\ No newline at end of file
@@ -0,0 +1,243 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Dict, Optional
+from config import DATA_DIR # 导入绝对路径
+from conversation_history import ConversationHistory, LEGACY_EXT
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    title TEXT NOT NULL DEFAULT '',
+    message_count INTEGER NOT NULL DEFAULT 0,
+    summary_text TEXT,
+    summary_covered INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_timestamp ON sessions (timestamp);
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (session_id, seq)
+) WITHOUT ROWID;
+"""
+
+class SQLiteConversationHistory:
+    """基于sqlite3的聊天记录存储，方法名与ConversationHistory相同，可直接替换"""
+    
+    # 内存中缓存最近保存过的会话消息，用于判断能否只追加新消息
+    MAX_CACHED_SESSIONS = 8
+    
+    def __init__(self, db_path: str = None):
+        self.history_dir = os.path.join(DATA_DIR, "history") # 旧的JSON聊天记录目录
+        self.db_path = db_path or os.path.join(DATA_DIR, "history.db")
+        self.current_session_id = None
+        self._cache = OrderedDict()  # session_id -> 已保存的消息列表
+        self._lock = threading.RLock()
+        # 可选的搜索索引，保存或删除会话时同步更新
+        self.search_index = None
+        # 可选的性能追踪，记录写入数据库的耗时
+        self.tracer = None
+        
+        if not os.path.exists(os.path.dirname(self.db_path)):
+            os.makedirs(os.path.dirname(self.db_path))
+        is_new = not os.path.exists(self.db_path)
+        # 连接在UI线程和后台线程之间共享，由_lock保证串行访问
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        
+        # 首次创建数据库时在后台导入已有的JSON聊天记录
+        if is_new and os.path.isdir(self.history_dir):
+            threading.Thread(target=self._import_in_background, name="HistoryImport", daemon=True).start()
+            
+    def create_new_session(self):
+        """创建新的对话会话"""
+        self.current_session_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+        return self.current_session_id
+        
+    def get_current_history(self) -> List[Dict[str, str]]:
+        """获取当前会话的历史记录"""
+        if not self.current_session_id:
+            self.create_new_session()
+            
+        return self.load_session(self.current_session_id)
+        
+    def save_current_history(self, messages: List[Dict[str, str]]):
+        """保存当前会话的历史记录"""
+        if not self.current_session_id:
+            self.create_new_session()
+            
+        self.save_session(self.current_session_id, messages)
+        
+    def _remember(self, session_id: str, messages: List[Dict[str, str]]):
+        """记录会话已保存的消息（调用方需持有锁）"""
+        self._cache[session_id] = messages
+        self._cache.move_to_end(session_id)
+        while len(self._cache) > self.MAX_CACHED_SESSIONS:
+            self._cache.popitem(last=False)
+            
+    def _write_session(self, session_id: str, messages: List[Dict[str, str]], timestamp: str,
+                       summary: Optional[Dict] = None, replace: bool = False):
+        """在一个事务中写入会话：只追加新消息，已有消息变化时整体替换（调用方需持有锁）"""
+        old_messages = None if replace else self._cache.get(session_id)
+        if old_messages is None and not replace:
+            old_messages = self._select_messages(session_id)
+        if old_messages is None or list(messages[:len(old_messages)]) != old_messages:
+            start = 0
+        else:
+            start = len(old_messages)
+            
+        title = messages[0].get("content", "")[:30] + "..." if messages else ""
+        with self._conn:
+            if start == 0:
+                self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self._conn.executemany(
+                "INSERT INTO messages (session_id, seq, data) VALUES (?, ?, ?)",
+                [(session_id, seq, json.dumps(message, ensure_ascii=False))
+                 for seq, message in enumerate(messages[start:], start)]
+            )
+            self._conn.execute(
+                "INSERT INTO sessions (session_id, timestamp, title, message_count) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET timestamp = excluded.timestamp, "
+                "title = excluded.title, message_count = excluded.message_count",
+                (session_id, timestamp, title, len(messages))
+            )
+            if summary:
+                self._conn.execute(
+                    "UPDATE sessions SET summary_text = ?, summary_covered = ? WHERE session_id = ?",
+                    (summary.get("text", ""), summary.get("covered", 0), session_id)
+                )
+        self._remember(session_id, list(messages))
+        
+    def save_session(self, session_id: str, messages: List[Dict[str, str]]):
+        """保存指定会话的历史记录"""
+        timestamp = datetime.now().isoformat()
+        start = time.perf_counter()
+        with self._lock:
+            self._write_session(session_id, messages, timestamp)
+        if self.tracer is not None:
+            self.tracer.add("history_write", start, cat="io", messages=len(messages))
+        if self.search_index is not None:
+            self.search_index.update_session(session_id, messages, timestamp)
+            
+    def get_summary(self, session_id: str) -> Optional[Dict]:
+        """获取指定会话的滚动摘要"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT summary_text, summary_covered FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        if not row or row[0] is None:
+            return None
+        return {"text": row[0], "covered": row[1] or 0}
+        
+    def save_summary(self, session_id: str, text: str, covered: int):
+        """保存指定会话的滚动摘要"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE sessions SET summary_text = ?, summary_covered = ? WHERE session_id = ?",
+                (text, covered, session_id)
+            )
+            
+    def flush(self):
+        """每次保存都已提交事务，这里只做WAL检查点"""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+            
+    def get_all_sessions(self) -> List[Dict[str, str]]:
+        """获取所有会话列表（按时间倒序，直接使用时间戳索引）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT session_id, title, timestamp FROM sessions "
+                "WHERE message_count > 0 ORDER BY timestamp DESC"
+            ).fetchall()
+        return [{"session_id": row[0], "title": row[1], "timestamp": row[2]} for row in rows]
+        
+    def _select_messages(self, session_id: str) -> Optional[List[Dict[str, str]]]:
+        """从数据库读取会话消息，会话不存在时返回None（调用方需持有锁）"""
+        if not self._conn.execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)).fetchone():
+            return None
+        rows = self._conn.execute(
+            "SELECT data FROM messages WHERE session_id = ? ORDER BY seq", (session_id,)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+        
+    def peek_session(self, session_id: str) -> Optional[List[Dict[str, str]]]:
+        """读取会话消息但不放入内存缓存（用于搜索索引），会话不存在时返回None"""
+        with self._lock:
+            return self._select_messages(session_id)
+                
+    def load_session(self, session_id: str) -> List[Dict[str, str]]:
+        """加载指定会话的历史记录"""
+        with self._lock:
+            messages = self._cache.get(session_id)
+            if messages is None:
+                messages = self._select_messages(session_id)
+                if messages is None:
+                    return []
+                self._remember(session_id, messages)
+            return list(messages)
+            
+    def delete_session(self, session_id: str):
+        """删除指定会话"""
+        with self._lock, self._conn:
+            self._cache.pop(session_id, None)
+            self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        if self.search_index is not None:
+            self.search_index.remove_session(session_id)
+            
+    def clear_all_history(self):
+        """清除所有历史记录"""
+        with self._lock, self._conn:
+            self._cache.clear()
+            self._conn.execute("DELETE FROM messages")
+            self._conn.execute("DELETE FROM sessions")
+        if self.search_index is not None:
+            self.search_index.clear()
+            
+    def import_json_history(self, history_dir: str = None, overwrite: bool = False) -> int:
+        """导入JSON格式（新旧两种）的聊天记录，默认跳过已存在的会话，返回导入的会话数"""
+        history_dir = history_dir or self.history_dir
+        imported = 0
+        # 同一会话新旧格式文件同时存在时以新格式为准
+        for filename in sorted(os.listdir(history_dir), key=lambda name: name.endswith(LEGACY_EXT)):
+            if not ConversationHistory._is_session_file(filename):
+                continue
+            try:
+                data = ConversationHistory._parse_session_file(os.path.join(history_dir, filename))["data"]
+            except (OSError, ValueError) as e:
+                print(f"导入聊天记录 {filename} 时出错: {e}")
+                continue
+            session_id = data.get("session_id") or os.path.splitext(filename)[0]
+            with self._lock:
+                exists = self._conn.execute(
+                    "SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)
+                ).fetchone()
+                if exists and not overwrite:
+                    continue
+                timestamp = data.get("timestamp") or datetime.now().isoformat()
+                self._write_session(session_id, data.get("messages", []), timestamp,
+                                    summary=data.get("summary"), replace=True)
+            if self.search_index is not None:
+                self.search_index.update_session(session_id, data.get("messages", []), timestamp)
+            imported += 1
+        return imported
+        
+    def _import_in_background(self):
+        try:
+            imported = self.import_json_history()
+            print(f"已导入 {imported} 个JSON聊天记录")
+        except Exception as e:
+            print(f"导入JSON聊天记录时出错: {e}")
+            
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
\ No newline at end of file
@@ -1,9 +1,13 @@
 import tkinter as tk
-from tkinter import ttk, scrolledtext, messagebox
+from tkinter import ttk, scrolledtext, messagebox, filedialog
 import json
 import os
 from datetime import datetime
+import asyncio
+from collections import OrderedDict
+import sqlite3
 import threading
+import time
 import sys
 import os
 
@@ -18,11 +22,26 @@ except ImportError:
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from api_manager import APIManager
-from conversation_history import ConversationHistory
+from conversation_history import create_history_manager
 from config import ConfigManager
 from autostart import AutoStartManager
+from summarizer import SessionSummarizer
+from search_index import create_search_index
+from ui_dispatcher import UIDispatcher
 
 class ChatGUI:
+    # 界面更新的帧间隔（毫秒），可通过配置项"ui_frame_ms"在16~33之间调整
+    UI_FRAME_MS = 16
+    # 历史记录列表每批插入的条目数
+    HISTORY_BATCH_SIZE = 200
+    # 历史记录预览缓存的会话数
+    PREVIEW_CACHE_SIZE = 32
+    # 加载会话时放入聊天区域的最近消息数，向上滚动到顶部时每次再加载的消息数
+    DISPLAY_WINDOW = 100
+    DISPLAY_PAGE = 50
+    # 聊天区域最多保留的消息数（配置项"chat_scrollback"）
+    DEFAULT_SCROLLBACK = 500
+    
     def __init__(self, root):
         self.root = root
         self.root.geometry("400x500")
@@ -38,11 +57,41 @@ class ChatGUI:
         # 初始化组件
         self.config_manager = ConfigManager()
         self.api_manager = APIManager(self.config_manager)
-        self.history_manager = ConversationHistory()
+        # 配置"history_backend": "sqlite"时使用SQLite存储聊天记录
+        self.history_manager = create_history_manager(self.config_manager)
+        # 可选的分阶段性能追踪（配置项"tracing"），可在设置窗口中导出
+        self.tracer = self.api_manager.tracer
+        self.history_manager.tracer = self.tracer
+        # 全文搜索索引保存在磁盘上，启动时在后台同步有变化的会话，之后随会话保存增量更新
+        try:
+            self.search_index = create_search_index(self.history_manager)
+            threading.Thread(target=self.search_index.sync, name="SearchIndexSync", daemon=True).start()
+        except sqlite3.Error as e:
+            # 当前Python的SQLite未编译FTS5等情况下不提供搜索
+            print(f"无法打开搜索索引: {e}")
+            self.search_index = None
+        # 最近预览过的会话消息：(session_id, timestamp) -> messages
+        self.preview_cache = OrderedDict()
+        self.summarizer = SessionSummarizer(self.api_manager, self.history_manager, self.config_manager)
+        
+        # 当前会话已格式化的全部消息文本；聊天区域只显示从display_start开始的部分
+        self.display_entries = []
+        self.display_start = 0
+        self.loading_older = False
         
         # 创建界面
         self.create_widgets()
         
+        # 后台线程到Tk线程的回调队列
+        frame_ms = self.config_manager.get("ui_frame_ms") or self.UI_FRAME_MS
+        self.ui_dispatcher = UIDispatcher(self.root, min(33, max(16, int(frame_ms))))
+        self.ui_dispatcher.start()
+        
+        # 正在进行的生成请求；request_seq用于丢弃过期请求的界面更新
+        self.active_request = None
+        self.request_seq = 0
+        self.turn_lock = asyncio.Lock()
+        
         # 初始化拖动功能
         self.drag_data = {"x": 0, "y": 0}
         self.setup_drag_binding()
@@ -53,6 +102,10 @@ class ChatGUI:
         # 更新标题显示当前AI
         self.update_title()
         
+    def call_in_ui(self, func, *args):
+        """从任意线程安排在Tk线程中执行的回调"""
+        self.ui_dispatcher.post(func, *args)
+        
     def set_application_icon(self):
         """设置应用程序图标"""
         try:
@@ -145,7 +198,7 @@ class ChatGUI:
         
         # 关闭按钮
         close_btn = tk.Button(self.title_bar, text="×", bg="#e74c3c", fg="white", 
-                             font=("Arial", 12), bd=0, padx=10, command=self.root.destroy)
+                             font=("Arial", 12), bd=0, padx=10, command=self.on_main_window_close)
         close_btn.pack(side=tk.RIGHT, padx=5, pady=5)
         
         # 最小化按钮
@@ -182,6 +235,8 @@ class ChatGUI:
         self.chat_display = scrolledtext.ScrolledText(self.root, wrap=tk.WORD, state=tk.DISABLED,
                                                      bg="#ecf0f1", font=("Arial", 10))
         self.chat_display.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        # 滚动到顶部时加载更早的消息
+        self.chat_display.configure(yscrollcommand=self.on_chat_scroll)
         
         # 输入区域
         input_frame = tk.Frame(self.root, bg="#ffffff")
@@ -196,10 +251,18 @@ class ChatGUI:
                             font=("Arial", 10), command=self.send_message)
         send_btn.pack(side=tk.RIGHT, padx=(5, 0), ipadx=10, ipady=5)
         
+        # 停止按钮
+        self.stop_btn = tk.Button(input_frame, text="停止", bg="#e74c3c", fg="white",
+                                  font=("Arial", 10), state=tk.DISABLED, command=self.stop_generation)
+        self.stop_btn.pack(side=tk.RIGHT, padx=(5, 0), ipadx=10, ipady=5)
+        
         # 绑定回车键发送消息
         self.user_input.bind("<Return>", self.send_message_enter)
         self.user_input.bind("<Shift-Return>", self.new_line)
         
+        # Esc停止生成
+        self.root.bind("<Escape>", self.stop_generation)
+        
     def setup_drag_binding(self):
         """设置窗口拖动功能"""
         self.title_bar.bind("<Button-1>", self.start_drag)
@@ -241,15 +304,9 @@ class ChatGUI:
         
     def save_current_session_history(self):
         """保存当前会话历史"""
-        # 只有当有内容时才保存
-        history = self.history_manager.get_current_history()
-        if history:  # 只有当有历史记录时才保存
-            # 确保会话已创建
-            if not self.history_manager.current_session_id:
-                self.history_manager.create_new_session()
-            # 保存当前历史记录
-            self.history_manager.save_current_history(history)
+        # 会话内容以内存为准，这里把尚未写入的修改立即写入磁盘
         # 注意：如果没有历史记录，我们不创建空会话
+        self.history_manager.flush()
         
     def show_minimize_notification(self):
         """显示最小化通知"""
@@ -294,8 +351,9 @@ class ChatGUI:
                                 width=8, font=("Arial", 10))
             send_btn.pack(side=tk.RIGHT, padx=(5, 0))
             
-            # 绑定回车键发送消息
+            # 绑定回车键发送消息，Esc停止生成
             self.quick_input.bind("<Return>", lambda event: self.quick_send_message())
+            self.notification_window.bind("<Escape>", self.stop_generation)
             
             # 设置焦点到输入框
             self.quick_input.focus_set()
@@ -374,8 +432,9 @@ class ChatGUI:
             self.quick_input.insert(0, "正在处理...")
             self.quick_input.config(state=tk.DISABLED)
             
-            # 在新线程中处理AI响应
-            threading.Thread(target=self.process_quick_message, args=(message,), daemon=True).start()
+            # 在后台事件循环中处理AI响应（可通过Esc停止）
+            seq = self.begin_generation()
+            self.active_request = self.api_manager.submit(self.process_quick_message(message, seq))
             
         except Exception as e:
             self.quick_input.config(state=tk.NORMAL)
@@ -389,24 +448,44 @@ class ChatGUI:
             except:
                 pass
             
-    def process_quick_message(self, user_message):
+    async def process_quick_message(self, user_message, seq):
         """处理快速消息"""
+        parts = []
         try:
             # 创建简单的对话历史（只包含当前消息）
             history = [{"role": "user", "content": user_message}]
             
-            # 调用API获取响应
-            response = self.api_manager.get_response(history)
-            
-            # 不再在这里保存对话历史，而是在show_quick_response中保存
-            # history.append({"role": "assistant", "content": response})
-            # self.history_manager.save_current_history(history)
-            
-            # 恢复主窗口并显示结果
-            self.root.after(0, self.show_quick_response, user_message, response)
+            # 以流式方式调用API，收到首段文本时即恢复主窗口并显示
+            async for delta in self.api_manager.astream_response(history):
+                if not parts:
+                    delta = delta.lstrip()
+                    if not delta:
+                        continue
+                    self.call_for_request(seq, self.show_quick_response, user_message, delta)
+                else:
+                    self.append_for_request(seq, delta)
+                parts.append(delta)
+                
+            response = "".join(parts).rstrip()
+            if not parts:
+                self.call_for_request(seq, self.show_quick_response, user_message, response)
+                
+            # 生成结束后只保存一次对话历史
+            self.call_for_request(seq, self.save_quick_history, user_message, response)
             
+        except asyncio.CancelledError:
+            # 被停止时保留用户消息和已收到的部分内容
+            partial = "".join(parts).rstrip()
+            if partial:
+                self.call_for_request(seq, self.update_last_message, "AI", f"{partial}（已停止）")
+            else:
+                self.call_for_request(seq, self.show_quick_response, user_message, "（已停止）")
+            self.call_for_request(seq, self.save_quick_history, user_message, partial)
+            raise
         except Exception as e:
-            self.root.after(0, self.show_quick_error, str(e))
+            self.call_for_request(seq, self.show_quick_error, str(e))
+        finally:
+            self.call_for_request(seq, self.end_generation)
             
     def show_quick_response(self, user_message, ai_response):
         """显示快速响应结果"""
@@ -420,9 +499,7 @@ class ChatGUI:
         self.root.lift()
         
         # 创建新会话（清空当前显示）
-        self.chat_display.config(state=tk.NORMAL)
-        self.chat_display.delete(1.0, tk.END)
-        self.chat_display.config(state=tk.DISABLED)
+        self.clear_chat_display()
         
         # 创建新的聊天会话
         self.history_manager.create_new_session()
@@ -431,12 +508,12 @@ class ChatGUI:
         self.display_message("你", user_message)
         self.display_message("AI", ai_response)
         
-        # 保存新会话的历史记录
+    def save_quick_history(self, user_message, ai_response):
+        """保存快速聊天的会话历史（回答为空时只保存用户消息）"""
         try:
-            history = [
-                {"role": "user", "content": user_message},
-                {"role": "assistant", "content": ai_response}
-            ]
+            history = [{"role": "user", "content": user_message}]
+            if ai_response:
+                history.append({"role": "assistant", "content": ai_response})
             self.history_manager.save_current_history(history)
         except Exception as e:
             print(f"保存快速聊天记录时出错: {e}")
@@ -483,6 +560,13 @@ class ChatGUI:
             self.notification_window.destroy()
         except:
             pass
+        # 关闭网络连接和后台事件循环
+        self.api_manager.close()
+        # 把尚未写入的聊天记录写入磁盘
+        try:
+            self.history_manager.flush()
+        except Exception as e:
+            print(f"保存聊天记录时出错: {e}")
         # 退出程序
         self.root.destroy()
         
@@ -512,53 +596,255 @@ class ChatGUI:
         # 清空输入框
         self.user_input.delete("1.0", tk.END)
         
-        # 在新线程中获取AI响应
-        threading.Thread(target=self.get_ai_response, args=(message,), daemon=True).start()
+        # 在后台事件循环中获取AI响应（未完成的上一条回答会被停止）
+        seq = self.begin_generation()
+        session_id = self.history_manager.current_session_id
+        # 各轮对话由turn_lock依次执行，不在并发名额上排队，被停止时总能保存用户消息
+        self.active_request = self.api_manager.submit(self.get_ai_response(message, seq, session_id), bounded=False)
+        
+    def begin_generation(self):
+        """开始新的生成请求：停止仍在进行的请求，并使其之后的界面更新失效"""
+        self.stop_generation()
+        self.request_seq += 1
+        self.stop_btn.config(state=tk.NORMAL)
+        return self.request_seq
+        
+    def end_generation(self):
+        """当前请求结束后的界面状态"""
+        self.active_request = None
+        self.stop_btn.config(state=tk.DISABLED)
+        
+    def stop_generation(self, event=None):
+        """停止正在进行的生成请求（后台任务会保存已收到的部分内容）"""
+        if self.active_request is not None:
+            self.active_request.cancel()
+            self.active_request = None
+        self.stop_btn.config(state=tk.DISABLED)
+        
+    def abandon_generation(self):
+        """停止请求并丢弃其后续界面更新（切换或新建会话时使用）"""
+        self.stop_generation()
+        self.request_seq += 1
+        
+    def call_for_request(self, seq, func, *args):
+        """仅当请求仍是最新请求时才在Tk线程中执行回调，避免过期的回答覆盖新消息"""
+        self.call_in_ui(self._run_if_current, seq, func, args)
+        
+    def _run_if_current(self, seq, func, args):
+        if seq == self.request_seq:
+            func(*args)
+            
+    def append_for_request(self, seq, text):
+        """流式追加文本；同一帧内的连续追加会合并为一次插入"""
+        self.ui_dispatcher.post_append(self._append_if_current, (seq,), text)
         
-    def get_ai_response(self, user_message):
+    def _append_if_current(self, seq, text):
+        if seq == self.request_seq:
+            self.append_to_last_message(text)
+            
+    async def get_ai_response(self, user_message, seq, session_id):
         """获取AI响应"""
+        # 开启追踪时每轮对话的各阶段单独显示为一行
+        with self.tracer.track(f"对话 #{seq}"), self.tracer.span("get_ai_response", session=session_id):
+            await self._get_ai_response(user_message, seq, session_id)
+            
+    async def _get_ai_response(self, user_message, seq, session_id):
+        """获取AI响应的各个阶段：读取历史、请求API、显示和保存"""
         # 显示正在思考的提示
-        self.root.after(0, self.display_message, "AI", "正在思考...")
+        self.call_for_request(seq, self.display_message, "AI", "正在思考...")
+        user_turn = {"role": "user", "content": user_message}
         
+        # 同一时间只处理一轮对话，确保被停止的请求先保存完部分内容
+        wait_start = self.tracer.now()
+        try:
+            await self.turn_lock.acquire()
+        except asyncio.CancelledError:
+            # 排队时就被停止：仍按顺序保存用户消息
+            async with self.turn_lock:
+                await self._save_stopped_turn(seq, session_id, None, user_turn, "")
+            self.call_for_request(seq, self.end_generation)
+            raise
+        self.tracer.add("wait_turn", wait_start)
+        history = None
+        parts = []
+        completed = False
         try:
             # 获取对话历史
-            history = self.history_manager.get_current_history()
-            
+            with self.tracer.span("load_session", cat="io"):
+                history = await asyncio.to_thread(self.history_manager.load_session, session_id)
+                
             # 添加用户消息到历史
-            history.append({"role": "user", "content": user_message})
-            
-            # 调用API获取响应
-            response = self.api_manager.get_response(history)
+            history.append(user_turn)
             
-            # 更新显示（移除"正在思考..."并显示真实响应）
-            self.root.after(0, self.update_last_message, "AI", response)
+            # 启用滚动摘要时只发送"摘要+最近消息"
+            with self.tracer.span("build_context", messages=len(history)):
+                request_messages = self.summarizer.build_context(session_id, history)
+                
+            # 以流式方式调用API，首段文本替换"正在思考..."，后续文本追加显示
+            async for delta in self.api_manager.astream_response(request_messages):
+                if not parts:
+                    delta = delta.lstrip()
+                    if not delta:
+                        continue
+                    self.tracer.instant("first_delta_queued", cat="ui")
+                    self.call_for_request(seq, self.update_last_message, "AI", delta)
+                else:
+                    self.append_for_request(seq, delta)
+                parts.append(delta)
+                
+            response = "".join(parts).rstrip()
+            if not parts:
+                self.call_for_request(seq, self.update_last_message, "AI", response)
             
-            # 添加AI响应到历史
+            # 添加AI响应到历史（写入磁盘由后台线程完成，见HistoryWriter行的history_flush）
             history.append({"role": "assistant", "content": response})
-            self.history_manager.save_current_history(history)
+            completed = True
+            with self.tracer.span("save_session", cat="io", messages=len(history)):
+                await asyncio.to_thread(self.history_manager.save_session, session_id, history)
+            
+            # 未摘要的旧消息过多时在后台刷新摘要
+            self.summarizer.maybe_refresh(session_id, history)
             
+        except asyncio.CancelledError:
+            partial = "".join(parts).rstrip()
+            if completed:
+                self.call_for_request(seq, self.update_last_message, "AI", f"{partial}（已停止）")
+            else:
+                await self._save_stopped_turn(seq, session_id, history, user_turn, partial)
+            raise
         except Exception as e:
             error_msg = f"错误: {str(e)}"
-            self.root.after(0, self.update_last_message, "AI", error_msg)
+            self.call_for_request(seq, self.update_last_message, "AI", error_msg)
+        finally:
+            self.turn_lock.release()
+            self.call_for_request(seq, self.end_generation)
+            
+    async def _save_stopped_turn(self, seq, session_id, history, user_turn, partial):
+        """被停止时总是保存用户消息（即使还没收到任何回答），再附上已收到的部分内容（调用方需持有turn_lock）"""
+        if history is None:
+            history = await asyncio.to_thread(self.history_manager.load_session, session_id)
+        if not history or history[-1] is not user_turn:
+            history.append(user_turn)
+        if partial:
+            history.append({"role": "assistant", "content": partial})
+        await asyncio.to_thread(self.history_manager.save_session, session_id, history)
+        self.call_for_request(seq, self.update_last_message, "AI", f"{partial}（已停止）" if partial else "（已停止）")
+        
+    @staticmethod
+    def format_message(sender, message):
+        """格式化一条显示的消息"""
+        timestamp = datetime.now().strftime("%H:%M:%S")
+        return f"[{timestamp}] {sender}: {message}\n\n"
+        
+    @property
+    def scrollback_limit(self):
+        """聊天区域最多保留的消息数"""
+        try:
+            limit = int(self.config_manager.get("chat_scrollback") or self.DEFAULT_SCROLLBACK)
+        except (TypeError, ValueError):
+            limit = self.DEFAULT_SCROLLBACK
+        return max(10, limit)
+        
+    def clear_chat_display(self):
+        """清空聊天区域"""
+        self.display_entries = []
+        self.display_start = 0
+        self.chat_display.config(state=tk.NORMAL)
+        self.chat_display.delete(1.0, tk.END)
+        if "last_message" in self.chat_display.mark_names():
+            self.chat_display.mark_unset("last_message")
+        self.chat_display.config(state=tk.DISABLED)
+        
+    def render_messages(self, messages):
+        """一次性显示整个会话：只插入最近的消息，更早的消息在向上滚动到顶部时加载"""
+        self.clear_chat_display()
+        self.display_entries = [
+            self.format_message("你" if message["role"] == "user" else "AI", message["content"])
+            for message in messages
+        ]
+        if not self.display_entries:
+            return
+        self.display_start = max(0, len(self.display_entries) - min(self.DISPLAY_WINDOW, self.scrollback_limit))
+        visible = self.display_entries[self.display_start:]
+        self.chat_display.config(state=tk.NORMAL)
+        self.chat_display.insert(tk.END, "".join(visible[:-1]))
+        self.chat_display.mark_set("last_message", "end-1c")
+        self.chat_display.mark_gravity("last_message", tk.LEFT)
+        self.chat_display.insert(tk.END, visible[-1])
+        self.chat_display.config(state=tk.DISABLED)
+        self.chat_display.see(tk.END)
+        
+    def trim_chat_display(self):
+        """聊天区域的消息超过上限时删除最早的消息（调用方需先把文本框设为可编辑）"""
+        excess = len(self.display_entries) - self.display_start - self.scrollback_limit
+        if excess <= 0:
+            return
+        lines = sum(text.count("\n") for text in self.display_entries[self.display_start:self.display_start + excess])
+        self.chat_display.delete("1.0", f"{lines + 1}.0")
+        self.display_start += excess
+        
+    def on_chat_scroll(self, first, last):
+        """聊天区域滚动时更新滚动条，滚动到顶部时安排加载更早的消息"""
+        self.chat_display.vbar.set(first, last)
+        if float(first) <= 0.0 and self.display_start > 0 and not self.loading_older:
+            self.loading_older = True
+            self.root.after_idle(self.load_older_messages)
             
+    def load_older_messages(self):
+        """在聊天区域顶部插入一页更早的消息，并保持当前阅读位置"""
+        self.loading_older = False
+        shown = len(self.display_entries) - self.display_start
+        count = min(self.DISPLAY_PAGE, self.display_start, self.scrollback_limit - shown)
+        if count <= 0:
+            return
+        start = self.display_start - count
+        text = "".join(self.display_entries[start:self.display_start])
+        self.chat_display.config(state=tk.NORMAL)
+        self.chat_display.insert("1.0", text)
+        self.chat_display.config(state=tk.DISABLED)
+        self.display_start = start
+        # 让原来位于顶部的消息仍然显示在顶部
+        self.chat_display.yview(f"{text.count(chr(10)) + 1}.0")
+        
     def display_message(self, sender, message):
         """显示消息"""
+        text = self.format_message(sender, message)
+        self.display_entries.append(text)
         self.chat_display.config(state=tk.NORMAL)
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        self.chat_display.insert(tk.END, f"[{timestamp}] {sender}: {message}\n\n")
+        # 记录最后一条消息的起始位置，供更新和追加使用
+        self.chat_display.mark_set("last_message", "end-1c")
+        self.chat_display.mark_gravity("last_message", tk.LEFT)
+        self.chat_display.insert(tk.END, text)
+        self.trim_chat_display()
         self.chat_display.config(state=tk.DISABLED)
         self.chat_display.see(tk.END)
         
     def update_last_message(self, sender, message):
         """更新最后一条消息"""
-        self.chat_display.config(state=tk.NORMAL)
-        # 删除最后两行（消息和空行）
-        self.chat_display.delete("end-2l", "end-1l")
-        # 插入新消息
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        self.chat_display.insert(tk.END, f"[{timestamp}] {sender}: {message}\n\n")
-        self.chat_display.config(state=tk.DISABLED)
-        self.chat_display.see(tk.END)
+        with self.tracer.span("update_last_message", cat="ui", chars=len(message)):
+            if "last_message" not in self.chat_display.mark_names() or not self.display_entries:
+                self.display_message(sender, message)
+                return
+            text = self.format_message(sender, message)
+            self.display_entries[-1] = text
+            self.chat_display.config(state=tk.NORMAL)
+            # 删除最后一条消息（包括多行内容和结尾空行）
+            self.chat_display.delete("last_message", "end-1c")
+            # 插入新消息
+            self.chat_display.insert(tk.END, text)
+            self.chat_display.config(state=tk.DISABLED)
+            self.chat_display.see(tk.END)
+            
+    def append_to_last_message(self, text):
+        """向最后一条消息追加文本（用于流式输出）"""
+        with self.tracer.span("append_to_last_message", cat="ui", chars=len(text)):
+            if self.display_entries:
+                self.display_entries[-1] = self.display_entries[-1][:-2] + text + "\n\n"
+            self.chat_display.config(state=tk.NORMAL)
+            # 插入到消息结尾的两个换行符之前
+            self.chat_display.insert("end-3c", text)
+            self.chat_display.config(state=tk.DISABLED)
+            self.chat_display.see(tk.END)
         
     def open_ai_selector(self):
         """打开AI选择窗口"""
@@ -628,10 +914,152 @@ class ChatGUI:
         manage_btn = tk.Button(ai_selector_window, text="管理AI", command=self.open_ai_manager)
         manage_btn.pack(side=tk.LEFT, padx=10, pady=10)
         
+        # 对比模式按钮（先关闭选择窗口，释放其输入焦点独占）
+        def open_compare():
+            ai_selector_window.destroy()
+            self.open_compare_window()
+            
+        compare_btn = tk.Button(ai_selector_window, text="对比模式", command=open_compare)
+        compare_btn.pack(side=tk.LEFT, padx=10, pady=10)
+        
         # 关闭按钮
         close_btn = tk.Button(ai_selector_window, text="关闭", command=ai_selector_window.destroy)
         close_btn.pack(side=tk.RIGHT, padx=10, pady=10)
         
+    def open_compare_window(self):
+        """打开对比模式窗口：同一问题并发发送给多个AI"""
+        compare_window = tk.Toplevel(self.root)
+        compare_window.title("对比模式")
+        compare_window.geometry("900x550")
+        compare_window.transient(self.root)
+        
+        # 设置窗口图标
+        self.set_window_icon(compare_window)
+        
+        # AI选择区域
+        select_frame = tk.Frame(compare_window)
+        select_frame.pack(fill=tk.X, padx=10, pady=(10, 0))
+        tk.Label(select_frame, text="选择要对比的AI:").pack(side=tk.LEFT)
+        
+        ai_vars = {}
+        for ai_id, ai_config in self.config_manager.get_ais().items():
+            var = tk.BooleanVar(value=ai_id == self.api_manager.current_ai_id)
+            tk.Checkbutton(select_frame, text=f"{ai_config['name']} ({ai_config['model']})",
+                           variable=var).pack(side=tk.LEFT, padx=5)
+            ai_vars[ai_id] = var
+            
+        # 输入区域
+        input_frame = tk.Frame(compare_window)
+        input_frame.pack(fill=tk.X, padx=10, pady=10)
+        prompt_input = tk.Text(input_frame, height=3, font=("Arial", 10))
+        prompt_input.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        
+        # 状态提示
+        status_label = tk.Label(compare_window, text="", anchor=tk.W)
+        status_label.pack(fill=tk.X, padx=10)
+        
+        # 各AI的回答区域
+        panes_frame = tk.Frame(compare_window)
+        panes_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+        # 本轮对比的各个请求；窗口关闭后后台任务不再更新界面
+        futures = []
+        closed = threading.Event()
+        
+        def cancel_requests():
+            for future in futures:
+                future.cancel()
+            futures.clear()
+            
+        def on_close():
+            closed.set()
+            cancel_requests()
+            compare_window.destroy()
+            
+        compare_window.protocol("WM_DELETE_WINDOW", on_close)
+        
+        def send_compare():
+            prompt = prompt_input.get("1.0", tk.END).strip()
+            selected = [ai_id for ai_id, var in ai_vars.items() if var.get()]
+            if not prompt:
+                return
+            if not selected:
+                messagebox.showwarning("警告", "请至少选择一个AI", parent=compare_window)
+                return
+                
+            # 停止上一轮仍在生成的请求并清空结果
+            cancel_requests()
+            for widget in panes_frame.winfo_children():
+                widget.destroy()
+            status_label.config(text=f"正在并发请求 {len(selected)} 个AI...")
+            
+            latencies = {}
+            messages = [{"role": "user", "content": prompt}]
+            for column, ai_id in enumerate(selected):
+                ai_config = self.config_manager.get_ai(ai_id)
+                pane = tk.Frame(panes_frame)
+                pane.grid(row=0, column=column, sticky="nsew", padx=3)
+                panes_frame.grid_columnconfigure(column, weight=1, uniform="pane")
+                header = tk.Label(pane, text=f"{ai_config['name']} - 等待中...", anchor=tk.W)
+                header.pack(fill=tk.X)
+                output = scrolledtext.ScrolledText(pane, wrap=tk.WORD, state=tk.DISABLED,
+                                                   bg="#ecf0f1", font=("Arial", 10))
+                output.pack(fill=tk.BOTH, expand=True)
+                
+                # 所有AI的请求同时提交到后台事件循环，不占用全局并发名额，总耗时取决于最慢的AI
+                futures.append(self.api_manager.submit(self.compare_stream(
+                    ai_id, ai_config["name"], messages, header, output, latencies, len(selected), status_label, closed
+                ), bounded=False))
+            panes_frame.grid_rowconfigure(0, weight=1)
+            
+        send_btn = tk.Button(input_frame, text="发送", bg="#2ecc71", fg="white",
+                             font=("Arial", 10), command=send_compare)
+        send_btn.pack(side=tk.RIGHT, padx=(5, 0), ipadx=10, ipady=5)
+        
+    async def compare_stream(self, ai_id, ai_name, messages, header, output, latencies, total, status_label, closed):
+        """对比模式中向单个AI发送请求，把回答流式写入对应区域并记录延迟；closed被设置后停止"""
+        start = time.monotonic()
+        first_token = None
+        try:
+            async for delta in self.api_manager.astream_response(messages, ai_id=ai_id, use_backups=False):
+                if closed.is_set():
+                    break
+                if first_token is None:
+                    first_token = time.monotonic() - start
+                    self.call_in_ui(self._set_widget_text, header, f"{ai_name} - 首字 {first_token:.2f}s，生成中...")
+                self.ui_dispatcher.post_append(self._append_to_pane, (output,), delta)
+            elapsed = time.monotonic() - start
+            summary = f"{ai_name} - 首字 {(first_token or elapsed):.2f}s / 总计 {elapsed:.2f}s"
+        except Exception as e:
+            elapsed = time.monotonic() - start
+            if not closed.is_set():
+                self.call_in_ui(self._append_to_pane, output, f"错误: {str(e)}")
+            summary = f"{ai_name} - 失败 ({elapsed:.2f}s)"
+        if closed.is_set():
+            return
+        self.call_in_ui(self._set_widget_text, header, summary)
+        
+        # 记录各AI的延迟，全部完成后显示总耗时
+        latencies[ai_id] = elapsed
+        if len(latencies) == total:
+            slowest = max(latencies.values())
+            self.call_in_ui(self._set_widget_text, status_label,
+                            f"全部完成，总耗时 {slowest:.2f}s（串行需要 {sum(latencies.values()):.2f}s）")
+            
+    def _set_widget_text(self, widget, text):
+        """设置标签文本（窗口可能已被关闭）"""
+        if widget.winfo_exists():
+            widget.config(text=text)
+            
+    def _append_to_pane(self, widget, text):
+        """向对比区域追加文本（窗口可能已被关闭）"""
+        if not widget.winfo_exists():
+            return
+        widget.config(state=tk.NORMAL)
+        widget.insert(tk.END, text)
+        widget.config(state=tk.DISABLED)
+        widget.see(tk.END)
+        
     def open_ai_manager(self):
         """打开AI管理窗口"""
         ai_manager_window = tk.Toplevel(self.root)
@@ -739,7 +1167,7 @@ class ChatGUI:
         """打开AI编辑器"""
         editor_window = tk.Toplevel(parent_window)
         editor_window.title("编辑AI" if ai_id else "添加AI")
-        editor_window.geometry("400x300")
+        editor_window.geometry("400x360")
         editor_window.transient(parent_window)
         editor_window.grab_set()
         
@@ -775,6 +1203,12 @@ class ChatGUI:
         model_entry = tk.Entry(editor_window, textvariable=model_var, width=50)
         model_entry.pack(padx=10, pady=5, fill=tk.X)
         
+        # 上下文预算设置
+        tk.Label(editor_window, text="上下文预算(tokens，0为不限制):").pack(anchor=tk.W, padx=10, pady=(10, 0))
+        context_var = tk.StringVar(value=str(ai_config.get("max_context_tokens", 0)))
+        context_entry = tk.Entry(editor_window, textvariable=context_var, width=50)
+        context_entry.pack(padx=10, pady=5, fill=tk.X)
+        
         # 保存按钮
         def save_ai():
             name = name_var.get().strip()
@@ -798,13 +1232,23 @@ class ChatGUI:
                 messagebox.showerror("错误", "请输入模型名称")
                 return
                 
+            try:
+                max_context_tokens = int(context_var.get().strip() or 0)
+                if max_context_tokens < 0:
+                    raise ValueError
+            except ValueError:
+                messagebox.showerror("错误", "上下文预算必须是非负整数")
+                return
+                
             try:
                 if ai_id:
                     # 更新现有AI
-                    self.config_manager.update_ai(ai_id, name, api_key, base_url, model)
+                    self.config_manager.update_ai(ai_id, name, api_key, base_url, model,
+                                                  max_context_tokens=max_context_tokens)
                 else:
                     # 添加新AI
-                    self.config_manager.add_ai(name, api_key, base_url, model)
+                    self.config_manager.add_ai(name, api_key, base_url, model,
+                                               max_context_tokens=max_context_tokens)
                     
                 # 更新API管理器
                 self.api_manager.update_config(self.config_manager)
@@ -821,7 +1265,7 @@ class ChatGUI:
         """打开设置窗口"""
         settings_window = tk.Toplevel(self.root)
         settings_window.title("设置")
-        settings_window.geometry("400x350")
+        settings_window.geometry("400x420")
         settings_window.transient(self.root)
         settings_window.grab_set()
         
@@ -833,9 +1277,67 @@ class ChatGUI:
         autostart_check = tk.Checkbutton(settings_window, text="开机自启动", variable=autostart_var)
         autostart_check.pack(anchor=tk.W, padx=10, pady=10)
         
+        # 长对话滚动摘要设置
+        summarization = dict(self.config_manager.get("summarization") or {})
+        summary_var = tk.BooleanVar(value=summarization.get("enabled", False))
+        summary_check = tk.Checkbutton(settings_window, text="长对话自动摘要（只发送摘要和最近消息）", variable=summary_var)
+        summary_check.pack(anchor=tk.W, padx=10, pady=(0, 10))
+        
+        # 聊天区域最多保留的消息数
+        scrollback_frame = tk.Frame(settings_window)
+        scrollback_frame.pack(anchor=tk.W, padx=10, pady=(0, 10))
+        tk.Label(scrollback_frame, text="聊天窗口最多显示的消息数:").pack(side=tk.LEFT)
+        scrollback_var = tk.StringVar(value=str(self.scrollback_limit))
+        tk.Spinbox(scrollback_frame, from_=10, to=100000, increment=50, width=8,
+                   textvariable=scrollback_var).pack(side=tk.LEFT, padx=5)
+        
+        # 界面刷新统计，用于判断界面线程是否跟不上
+        ui_stats = self.ui_dispatcher.stats()
+        tk.Label(settings_window, fg="gray", justify=tk.LEFT,
+                 text=f"界面刷新：队列 {ui_stats['queue_depth']}（最大 {ui_stats['max_queue_depth']}），"
+                      f"帧耗时 平均 {ui_stats['frame_ms_avg']}ms / p95 {ui_stats['frame_ms_p95']}ms / "
+                      f"最大 {ui_stats['frame_ms_max']}ms\n"
+                      f"超时帧 {ui_stats['late_frames']}/{ui_stats['frames']}，"
+                      f"合并追加 {ui_stats['merged']}/{ui_stats['posted']}").pack(anchor=tk.W, padx=10)
+        
+        # 各AI的请求耗时、首token时间、token数和错误统计
+        tk.Button(settings_window, text="请求统计...", command=self.open_metrics).pack(anchor=tk.W, padx=10, pady=(5, 0))
+        
+        # 性能追踪：记录每轮对话各阶段的耗时，导出后可在chrome://tracing或Perfetto中查看
+        tracing = dict(self.config_manager.get("tracing") or {})
+        tracing_frame = tk.Frame(settings_window)
+        tracing_frame.pack(anchor=tk.W, padx=10, pady=(5, 0))
+        tracing_var = tk.BooleanVar(value=self.tracer.enabled)
+        tk.Checkbutton(tracing_frame, text="记录性能追踪", variable=tracing_var).pack(side=tk.LEFT)
+        
+        def export_trace():
+            path = filedialog.asksaveasfilename(
+                parent=settings_window, defaultextension=".json", initialfile="chatbox-trace.json",
+                filetypes=[("Chrome trace", "*.json"), ("所有文件", "*.*")]
+            )
+            if not path:
+                return
+            try:
+                count = self.tracer.dump(path)
+                messagebox.showinfo("导出追踪", f"已导出 {count} 个事件，可在 chrome://tracing 或 ui.perfetto.dev 中打开",
+                                    parent=settings_window)
+            except OSError as e:
+                messagebox.showerror("错误", f"导出失败: {str(e)}", parent=settings_window)
+                
+        tk.Button(tracing_frame, text="导出追踪...", command=export_trace).pack(side=tk.LEFT, padx=5)
+        
         # 保存按钮
         def save_settings():
             self.config_manager.set("autostart", autostart_var.get())
+            try:
+                self.config_manager.set("chat_scrollback", max(10, int(scrollback_var.get())))
+            except ValueError:
+                pass
+            summarization["enabled"] = summary_var.get()
+            self.config_manager.set("summarization", summarization)
+            tracing["enabled"] = tracing_var.get()
+            self.config_manager.set("tracing", tracing)
+            self.tracer.configure(tracing)
             
             # 更新开机自启动设置
             autostart_manager = AutoStartManager()
@@ -849,59 +1351,291 @@ class ChatGUI:
         save_btn = tk.Button(settings_window, text="保存", command=save_settings)
         save_btn.pack(pady=20)
         
+    def open_metrics(self):
+        """打开请求统计窗口（每2秒刷新）"""
+        metrics_window = tk.Toplevel(self.root)
+        metrics_window.title("请求统计")
+        metrics_window.geometry("840x300")
+        metrics_window.transient(self.root)
+        metrics_window.grab_set()
+        self.set_window_icon(metrics_window)
+        
+        columns = (("ai", "AI", 110), ("model", "模型", 120), ("requests", "请求", 50), ("errors", "失败", 50),
+                   ("retries", "重试", 50), ("throttled", "限流等待", 70), ("latency", "耗时 p50/p95", 110), ("ttft", "首token p50/p95", 110),
+                   ("tokens", "token 输入/输出", 110))
+        tree = ttk.Treeview(metrics_window, columns=[c[0] for c in columns], show="headings", height=8)
+        for key, title, width in columns:
+            tree.heading(key, text=title)
+            tree.column(key, width=width, anchor=tk.W if key in ("ai", "model") else tk.E)
+        tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=(10, 0))
+        errors_label = tk.Label(metrics_window, fg="gray", justify=tk.LEFT, anchor=tk.W)
+        errors_label.pack(fill=tk.X, padx=10)
+        
+        def seconds(value):
+            return f"{value:.2f}s" if value is not None else "-"
+            
+        def refresh():
+            if not metrics_window.winfo_exists():
+                return
+            snapshot = self.api_manager.metrics.snapshot()
+            tree.delete(*tree.get_children())
+            error_lines = []
+            for s in snapshot["series"]:
+                latency, ttft = s["latency"], s["ttft"]
+                tree.insert("", tk.END, values=(
+                    s["ai"] or s["ai_id"], s["model"], s["requests"], sum(s["errors"].values()), s["retries"],
+                    seconds(s["throttled_seconds"]),
+                    f"{seconds(latency['p50'])} / {seconds(latency['p95'])}",
+                    f"{seconds(ttft['p50'])} / {seconds(ttft['p95'])}",
+                    f"{s['prompt_tokens']} / {s['completion_tokens']}"
+                ))
+                if s["errors"]:
+                    details = "，".join(f"{name} ×{count}" for name, count in s["errors"].items())
+                    error_lines.append(f"{s['ai'] or s['ai_id']}: {details}")
+            errors_label.config(text="\n".join(error_lines))
+            metrics_window.after(2000, refresh)
+            
+        def export():
+            path = filedialog.asksaveasfilename(
+                parent=metrics_window, defaultextension=".json",
+                filetypes=[("JSON", "*.json"), ("Prometheus", "*.prom"), ("所有文件", "*.*")]
+            )
+            if not path:
+                return
+            try:
+                fmt = "prometheus" if path.endswith(".prom") else "json"
+                self.api_manager.metrics_exporter.write_file(path, fmt)
+            except OSError as e:
+                messagebox.showerror("错误", f"导出失败: {str(e)}", parent=metrics_window)
+                
+        def reset():
+            self.api_manager.metrics.reset()
+            
+        button_frame = tk.Frame(metrics_window)
+        button_frame.pack(fill=tk.X, padx=10, pady=10)
+        tk.Button(button_frame, text="导出...", command=export).pack(side=tk.LEFT)
+        tk.Button(button_frame, text="清零", command=reset).pack(side=tk.LEFT, padx=5)
+        tk.Button(button_frame, text="关闭", command=metrics_window.destroy).pack(side=tk.RIGHT)
+        refresh()
+        
     def new_chat(self):
         """新建聊天会话"""
+        # 停止未完成的回答，避免它写入新会话的显示
+        self.abandon_generation()
+        
         # 清空当前显示
-        self.chat_display.config(state=tk.NORMAL)
-        self.chat_display.delete(1.0, tk.END)
-        self.chat_display.config(state=tk.DISABLED)
+        self.clear_chat_display()
         
         # 只有在需要时才创建新会话（当用户发送第一条消息时）
         # 这里不立即创建新会话，避免创建空记录
         self.history_manager.current_session_id = None
         
+    def remember_preview(self, key, messages):
+        """把预览过的会话放入LRU缓存，来回切换时无需重新读取"""
+        self.preview_cache[key] = messages
+        self.preview_cache.move_to_end(key)
+        while len(self.preview_cache) > self.PREVIEW_CACHE_SIZE:
+            self.preview_cache.popitem(last=False)
+            
     def open_history(self):
         """打开历史记录窗口"""
         history_window = tk.Toplevel(self.root)
         history_window.title("历史记录")
-        history_window.geometry("500x400")
+        history_window.geometry("800x450")
         history_window.transient(self.root)
         history_window.grab_set()
         
         # 设置窗口图标
         self.set_window_icon(history_window)
         
-        # 创建列表框显示历史会话
-        history_listbox = tk.Listbox(history_window, font=("Arial", 10))
-        history_listbox.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        # 搜索框：输入关键词后回车，在所有聊天记录中全文搜索
+        search_frame = tk.Frame(history_window)
+        search_frame.pack(fill=tk.X, padx=10, pady=(10, 0))
+        search_var = tk.StringVar()
+        search_entry = tk.Entry(search_frame, textvariable=search_var, font=("Arial", 10))
+        search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        search_status = tk.Label(search_frame, text="", fg="gray")
+        search_status.pack(side=tk.RIGHT, padx=(5, 0))
+        
+        # 左侧为会话列表，右侧为选中会话的预览
+        panes = tk.PanedWindow(history_window, orient=tk.HORIZONTAL, sashrelief=tk.RAISED)
+        panes.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        history_listbox = tk.Listbox(panes, font=("Arial", 10), exportselection=False)
+        preview = scrolledtext.ScrolledText(panes, wrap=tk.WORD, font=("Arial", 10), state=tk.DISABLED)
+        preview.tag_config("sender", foreground="#2980b9", font=("Arial", 10, "bold"))
+        preview.tag_config("match", background="#fff3b0")
+        panes.add(history_listbox, width=360)
+        panes.add(preview)
+        
+        # 所有会话在后台线程读取（按时间倒序），窗口立即显示
+        all_sessions = []
+        # 列表框当前显示的条目（会话列表或搜索结果），每项都包含session_id
+        sessions = []
+        # 每次重新填充列表时加一，使上一次未完成的分批插入停止
+        render_token = [0]
+        
+        def show_sessions(items, text_of):
+            history_listbox.delete(0, tk.END)
+            sessions[:] = items
+            render_token[0] += 1
+            token = render_token[0]
+            
+            # 分批插入，每批之后让出Tk线程
+            def insert_batch(start):
+                if token != render_token[0] or not history_window.winfo_exists():
+                    return
+                end = min(start + self.HISTORY_BATCH_SIZE, len(items))
+                history_listbox.insert(tk.END, *[text_of(item) for item in items[start:end]])
+                if end < len(items):
+                    history_window.after(1, insert_batch, end)
+                    
+            insert_batch(0)
+            
+        def show_all_sessions():
+            # 添加会话到列表框
+            show_sessions(list(all_sessions), lambda session: f"{session['timestamp'][:19]} - {session['title']}")
+            search_status.config(text=f"{len(all_sessions)} 个会话")
+            
+        def load_all_sessions():
+            try:
+                result = self.history_manager.get_all_sessions()
+            except Exception as e:
+                print(f"读取历史记录时出错: {e}")
+                result = []
+            self.call_in_ui(on_sessions_loaded, result)
+            
+        def on_sessions_loaded(result):
+            if not history_window.winfo_exists():
+                return
+            all_sessions[:] = result
+            # 正在显示搜索结果时不覆盖
+            if not search_var.get().strip():
+                show_all_sessions()
+                
+        # 选中条目时在后台加载预览，快速切换时只加载最后选中的会话
+        preview_job = [None]
+        
+        def set_preview_text(text):
+            preview.config(state=tk.NORMAL)
+            preview.delete(1.0, tk.END)
+            preview.insert(tk.END, text)
+            preview.config(state=tk.DISABLED)
+            
+        def render_preview(item, messages):
+            preview.config(state=tk.NORMAL)
+            preview.delete(1.0, tk.END)
+            target = None
+            for index, message in enumerate(messages):
+                start = preview.index("end-1c")
+                sender = "你" if message["role"] == "user" else "AI"
+                preview.insert(tk.END, f"{sender}:\n", "sender")
+                preview.insert(tk.END, f"{message['content']}\n\n")
+                # 搜索结果定位到命中的消息
+                if index == item.get("message_index"):
+                    target = start
+                    preview.tag_add("match", start, "end-2c")
+            preview.config(state=tk.DISABLED)
+            preview.see(target or "1.0")
+            
+        def on_preview_loaded(item, key, messages):
+            self.remember_preview(key, messages)
+            if not history_window.winfo_exists():
+                return
+            selection = history_listbox.curselection()
+            if selection and selection[0] < len(sessions) and sessions[selection[0]] is item:
+                render_preview(item, messages)
+                
+        def load_preview(item):
+            preview_job[0] = None
+            key = (item["session_id"], item.get("timestamp"))
+            messages = self.preview_cache.get(key)
+            if messages is not None:
+                self.preview_cache.move_to_end(key)
+                render_preview(item, messages)
+                return
+            set_preview_text("加载中…")
+            
+            def load():
+                try:
+                    result = self.history_manager.load_session(item["session_id"])
+                except Exception as e:
+                    print(f"加载会话预览时出错: {e}")
+                    result = []
+                self.call_in_ui(on_preview_loaded, item, key, result)
+                
+            threading.Thread(target=load, daemon=True).start()
+            
+        def on_select(event=None):
+            selection = history_listbox.curselection()
+            if not selection or selection[0] >= len(sessions):
+                return
+            if preview_job[0] is not None:
+                history_window.after_cancel(preview_job[0])
+            preview_job[0] = history_window.after(80, load_preview, sessions[selection[0]])
+            
+        history_listbox.bind("<<ListboxSelect>>", on_select)
         
-        # 获取所有会话
-        sessions = self.history_manager.get_all_sessions()
+        search_token = [0]
         
-        # 添加会话到列表框
-        for session in sessions:
-            display_text = f"{session['timestamp'][:19]} - {session['title']}"
-            history_listbox.insert(tk.END, display_text)
+        def search_history(event=None):
+            query = search_var.get().strip()
+            if not query:
+                search_token[0] += 1
+                show_all_sessions()
+                return
+            if self.search_index is None:
+                search_status.config(text="全文搜索不可用")
+                return
+            search_status.config(text="搜索中…")
+            search_token[0] += 1
+            token = search_token[0]
+            
+            # 搜索结果的摘要需要读取聊天记录，在后台线程中进行
+            def run():
+                start = time.perf_counter()
+                try:
+                    results = self.search_index.search(query)
+                except Exception as e:
+                    print(f"搜索聊天记录时出错: {e}")
+                    results = []
+                self.call_in_ui(on_search_done, token, results, (time.perf_counter() - start) * 1000)
+                
+            threading.Thread(target=run, name="HistorySearch", daemon=True).start()
             
+        def on_search_done(token, results, elapsed):
+            # 窗口已关闭或已有更新的搜索时丢弃结果
+            if token != search_token[0] or not history_window.winfo_exists():
+                return
+            show_sessions(results, lambda result: f"{result['timestamp'][:19]} - "
+                                                  f"{'你' if result['role'] == 'user' else 'AI'}: {result['snippet']}")
+            status = f"{len(results)} 条结果，{elapsed:.0f} 毫秒"
+            if not self.search_index.ready:
+                status += "（索引同步中）"
+            search_status.config(text=status)
+            
+        search_entry.bind("<Return>", search_history)
+        tk.Button(search_frame, text="搜索", command=search_history).pack(side=tk.RIGHT, padx=(5, 0))
+        search_entry.focus_set()
+        search_status.config(text="正在加载…")
+        threading.Thread(target=load_all_sessions, name="HistoryLoader", daemon=True).start()
+        
         # 双击加载会话
         def load_session(event):
             selection = history_listbox.curselection()
             if selection:
                 index = selection[0]
-                session_id = sessions[index]["session_id"]
+                item = sessions[index]
+                session_id = item["session_id"]
                 
-                # 加载会话历史
-                messages = self.history_manager.load_session(session_id)
+                # 停止未完成的回答，避免它覆盖加载的会话
+                self.abandon_generation()
                 
-                # 清空当前显示
-                self.chat_display.config(state=tk.NORMAL)
-                self.chat_display.delete(1.0, tk.END)
-                self.chat_display.config(state=tk.DISABLED)
+                # 加载会话历史（预览过的会话直接使用缓存）
+                cached = self.preview_cache.get((session_id, item.get("timestamp")))
+                messages = list(cached) if cached is not None else self.history_manager.load_session(session_id)
                 
-                # 显示历史消息
-                for message in messages:
-                    sender = "你" if message["role"] == "user" else "AI"
-                    self.display_message(sender, message["content"])
+                # 一次性显示历史消息（只放入最近的一部分，更早的向上滚动时加载）
+                self.render_messages(messages)
                     
                 # 设置当前会话ID
                 self.history_manager.current_session_id = session_id
@@ -920,8 +1654,10 @@ class ChatGUI:
                 # 确认删除
                 if messagebox.askyesno("确认删除", "确定要删除这个会话吗？"):
                     self.history_manager.delete_session(session_id)
-                    history_listbox.delete(index)
-                    sessions.pop(index)
+                    all_sessions[:] = [s for s in all_sessions if s["session_id"] != session_id]
+                    set_preview_text("")
+                    # 重新显示会话列表或搜索结果
+                    search_history()
                     
         delete_btn = tk.Button(history_window, text="删除", command=delete_session)
         delete_btn.pack(side=tk.LEFT, padx=10, pady=10)
@@ -932,7 +1668,10 @@ class ChatGUI:
             if messagebox.askyesno("确认清除", "确定要删除所有历史记录吗？此操作不可恢复。"):
                 self.history_manager.clear_all_history()
                 history_listbox.delete(0, tk.END)
+                all_sessions.clear()
                 sessions.clear()
+                self.preview_cache.clear()
+                set_preview_text("")
                 messagebox.showinfo("完成", "所有历史记录已清除")
                     
         clear_all_btn = tk.Button(history_window, text="清除所有历史记录", command=clear_all_history)
@@ -0,0 +1,326 @@
+import asyncio
+import bisect
+import json
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from atomic_io import atomic_write
+
+# 请求统计默认参数，可通过配置文件中的"metrics"项覆盖
+DEFAULT_METRICS_SETTINGS = {
+    "window": 500,           # 每个AI/模型保留最近多少次请求用于计算百分位数
+    "export": "off",         # 导出方式：off、file（定期写文件）或 http（本地端点）
+    "format": "prometheus",  # 写文件时的格式：prometheus 或 json
+    "file": "",              # 导出文件路径（默认为数据目录下的metrics.prom或metrics.json）
+    "port": 9464,            # http导出时监听的本地端口（/metrics 和 /metrics.json）
+    "interval": 15           # 写文件的间隔（秒）
+}
+
+# 直方图的桶上限（秒），与Prometheus的累计桶对应
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+class Histogram:
+    """固定桶的累计直方图（用于导出），另保留最近的样本计算百分位数"""
+    
+    def __init__(self, window: int = 500, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+        
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+        
+    def percentile(self, pct: float) -> Optional[float]:
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+        
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """返回[(桶上限, 累计次数)]，最后一项为+Inf"""
+        result = []
+        total = 0
+        for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            total += count
+            result.append((str(bound), total))
+        return result
+        
+    def snapshot(self) -> Dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "buckets": dict(self.cumulative())
+        }
+
+class _Series:
+    """一个AI/模型组合的全部统计"""
+    
+    def __init__(self, ai_id: str, ai_name: str, model: str, window: int):
+        self.ai_id = ai_id
+        self.ai_name = ai_name
+        self.model = model
+        self.requests = 0
+        self.cancelled = 0
+        self.cache_hits = 0
+        self.retries = 0
+        self.throttled_seconds = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.errors: Dict[str, int] = {}
+        self.latency = Histogram(window)
+        self.ttft = Histogram(window)
+
+class RequestRecord:
+    """单次请求的计时：由APIManager在请求过程中更新，结束时调用finish/fail/cancel之一"""
+    
+    def __init__(self, metrics: "RequestMetrics", ai_id: str, ai_name: str, model: str, kind: str):
+        self.metrics = metrics
+        self.key = (ai_id, ai_name, model)
+        self.kind = kind
+        self.start = time.monotonic()
+        self.ttft = None
+        self.retries = 0
+        self.throttled = 0.0  # 在限流器中等待的秒数
+        self.done = False
+        
+    def first_token(self):
+        if self.ttft is None:
+            self.ttft = time.monotonic() - self.start
+            
+    def finish(self, prompt_tokens: int = 0, completion_tokens: int = 0):
+        self._close(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        
+    def fail(self, error: BaseException):
+        if isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+            self.cancel()
+        else:
+            self._close(error=error_class(error))
+            
+    def cancel(self):
+        self._close(cancelled=True)
+        
+    def _close(self, **outcome):
+        if not self.done:
+            self.done = True
+            self.metrics._record(self, time.monotonic() - self.start, **outcome)
+
+def error_class(error: BaseException) -> str:
+    """错误分类：openai异常按类型（如RateLimitError、APITimeoutError），带状态码的附加状态码"""
+    name = type(error).__name__
+    status = getattr(error, "status_code", None)
+    return f"{name}({status})" if status else name
+
+class RequestMetrics:
+    """按AI和模型汇总请求的耗时、首token时间、token数、重试次数、限流等待和错误类型（线程安全）"""
+    
+    def __init__(self, settings: Dict = None):
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, str], _Series] = {}
+        self.started_at = time.time()
+        self.configure(settings)
+        
+    def configure(self, settings: Dict = None):
+        self.settings = dict(DEFAULT_METRICS_SETTINGS)
+        self.settings.update(settings or {})
+        
+    def start(self, ai_id: str, ai_config: Dict, kind: str) -> RequestRecord:
+        """开始记录一次请求，kind为complete或stream"""
+        return RequestRecord(self, ai_id, ai_config.get("name", ""), ai_config.get("model", ""), kind)
+        
+    def _get_series(self, ai_id: str, ai_name: str, model: str) -> _Series:
+        """获取或创建统计项（调用方需持有锁）"""
+        series = self._series.get((ai_id, model))
+        if series is None:
+            series = _Series(ai_id, ai_name, model, self.settings["window"])
+            self._series[(ai_id, model)] = series
+        series.ai_name = ai_name
+        return series
+        
+    def record_cache_hit(self, ai_id: str, ai_config: Dict):
+        with self._lock:
+            self._get_series(ai_id, ai_config.get("name", ""), ai_config.get("model", "")).cache_hits += 1
+            
+    def _record(self, record: RequestRecord, elapsed: float, prompt_tokens: int = 0, completion_tokens: int = 0,
+                error: str = None, cancelled: bool = False):
+        with self._lock:
+            series = self._get_series(*record.key)
+            series.requests += 1
+            series.retries += record.retries
+            series.throttled_seconds += record.throttled
+            if cancelled:
+                # 被用户停止或对冲落败的请求不计入延迟统计
+                series.cancelled += 1
+                return
+            if error:
+                series.errors[error] = series.errors.get(error, 0) + 1
+                return
+            series.prompt_tokens += prompt_tokens
+            series.completion_tokens += completion_tokens
+            series.latency.observe(elapsed)
+            if record.ttft is not None:
+                series.ttft.observe(record.ttft)
+                
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+            self.started_at = time.time()
+            
+    def snapshot(self) -> Dict:
+        """所有统计项的JSON快照（耗时单位为秒）"""
+        with self._lock:
+            series = [{
+                "ai_id": s.ai_id,
+                "ai": s.ai_name,
+                "model": s.model,
+                "requests": s.requests,
+                "errors": dict(s.errors),
+                "cancelled": s.cancelled,
+                "cache_hits": s.cache_hits,
+                "retries": s.retries,
+                "throttled_seconds": round(s.throttled_seconds, 3),
+                "prompt_tokens": s.prompt_tokens,
+                "completion_tokens": s.completion_tokens,
+                "latency": s.latency.snapshot(),
+                "ttft": s.ttft.snapshot()
+            } for s in self._series.values()]
+        return {"started_at": self.started_at, "generated_at": time.time(), "series": series}
+        
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+        
+    def to_prometheus(self) -> str:
+        """Prometheus文本格式"""
+        snapshot = self.snapshot()
+        lines = []
+        
+        def escape(value) -> str:
+            return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            
+        def label_str(s: Dict, **extra) -> str:
+            labels = {"ai_id": s["ai_id"], "ai": s["ai"], "model": s["model"], **extra}
+            return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels.items()) + "}"
+            
+        counters = (
+            ("chatbox_requests_total", "请求次数（含失败和取消）", "requests"),
+            ("chatbox_requests_cancelled_total", "被停止或对冲落败的请求数", "cancelled"),
+            ("chatbox_cache_hits_total", "响应缓存命中次数", "cache_hits"),
+            ("chatbox_retries_total", "重试次数", "retries"),
+            ("chatbox_throttled_seconds_total", "在限流器中等待的时间（秒）", "throttled_seconds"),
+            ("chatbox_prompt_tokens_total", "输入token数", "prompt_tokens"),
+            ("chatbox_completion_tokens_total", "输出token数", "completion_tokens")
+        )
+        for name, help_text, field in counters:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            lines += [f"{name}{label_str(s)} {s[field]}" for s in snapshot["series"]]
+            
+        lines += ["# HELP chatbox_request_errors_total 按错误类型统计的失败请求数",
+                  "# TYPE chatbox_request_errors_total counter"]
+        for s in snapshot["series"]:
+            lines += [f"chatbox_request_errors_total{label_str(s, error=error)} {count}"
+                      for error, count in s["errors"].items()]
+            
+        histograms = (
+            ("chatbox_request_duration_seconds", "请求总耗时", "latency"),
+            ("chatbox_time_to_first_token_seconds", "首个token的等待时间", "ttft")
+        )
+        for name, help_text, field in histograms:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for s in snapshot["series"]:
+                histogram = s[field]
+                lines += [f"{name}_bucket{label_str(s, le=bound)} {count}"
+                          for bound, count in histogram["buckets"].items()]
+                lines.append(f"{name}_sum{label_str(s)} {histogram['sum']}")
+                lines.append(f"{name}_count{label_str(s)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+        
+    def do_GET(self):
+        metrics = self.server.metrics
+        path = self.path.split("?")[0].rstrip("/")
+        if path == "/metrics":
+            body, content_type = metrics.to_prometheus(), "text/plain; version=0.0.4; charset=utf-8"
+        elif path == "/metrics.json":
+            body, content_type = metrics.to_json(), "application/json; charset=utf-8"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+class MetricsExporter:
+    """按配置把统计定期写入文件，或在本地端口提供 /metrics（Prometheus）和 /metrics.json"""
+    
+    def __init__(self, metrics: RequestMetrics, default_dir: str):
+        self.metrics = metrics
+        self.default_dir = default_dir
+        self._server = None
+        self._writer = None
+        self._stop = threading.Event()
+        self._mode = None
+        
+    def configure(self, settings: Dict):
+        """按设置启动或停止导出（设置未变化时保持运行）"""
+        mode = (settings["export"], settings["format"], settings["file"], settings["port"], settings["interval"])
+        if mode == self._mode:
+            return
+        self.stop()
+        self._mode = mode
+        if settings["export"] == "http":
+            try:
+                self._server = ThreadingHTTPServer(("127.0.0.1", int(settings["port"])), _MetricsHandler)
+            except OSError as e:
+                print(f"启动请求统计端点时出错: {e}")
+                return
+            self._server.daemon_threads = True
+            self._server.metrics = self.metrics
+            threading.Thread(target=self._server.serve_forever, name="MetricsServer", daemon=True).start()
+        elif settings["export"] == "file":
+            self._stop = threading.Event()
+            self._writer = threading.Thread(target=self._writer_loop, args=(settings, self._stop),
+                                            name="MetricsWriter", daemon=True)
+            self._writer.start()
+            
+    def default_file(self, fmt: str) -> str:
+        return os.path.join(self.default_dir, "metrics.json" if fmt == "json" else "metrics.prom")
+        
+    def write_file(self, path: str, fmt: str = "prometheus"):
+        """把当前统计原子地写入文件"""
+        content = self.metrics.to_json() if fmt == "json" else self.metrics.to_prometheus()
+        atomic_write(path, content, fsync=False)
+        
+    def _writer_loop(self, settings: Dict, stop: threading.Event):
+        path = settings["file"] or self.default_file(settings["format"])
+        interval = max(1, float(settings["interval"]))
+        while not stop.wait(interval):
+            try:
+                self.write_file(path, settings["format"])
+            except OSError as e:
+                print(f"写入请求统计时出错: {e}")
+                
+    def stop(self):
+        self._mode = None
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._writer is not None:
+            self._stop.set()
+            self._writer = None
\ No newline at end of file
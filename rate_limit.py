@@ -0,0 +1,146 @@
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Optional
+import httpx
+import openai
+
+# 重试默认参数，可通过配置文件中的"retry"项覆盖
+DEFAULT_RETRY_SETTINGS = {
+    "max_retries": 3,       # 最多重试次数
+    "base_delay": 0.5,      # 首次重试的基础等待时间（秒）
+    "max_delay": 20         # 单次等待上限（秒），服务端要求的Retry-After超过该值时不再重试
+}
+
+class TokenBucket:
+    """令牌桶：按每分钟的额度匀速补充，额度不足时等待而不是失败"""
+    
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.fill_rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+        self.updated = now
+        
+    async def acquire(self, amount: float = 1) -> float:
+        """取走指定数量的令牌，返回等待的秒数（包括排队时间）"""
+        amount = min(float(amount), self.capacity)
+        start = time.monotonic()
+        # 持有锁等待，保证先到先得
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    break
+                await asyncio.sleep((amount - self.tokens) / self.fill_rate)
+        waited = time.monotonic() - start
+        # 忽略调度带来的微小耗时
+        return waited if waited > 0.001 else 0.0
+
+class ProviderRateLimiter:
+    """按AI分别限制每分钟请求数(rpm)和token数(tpm)，配置写在各AI条目中"""
+    
+    def __init__(self):
+        self._buckets: Dict[str, tuple] = {}  # ai_id -> (rpm, tpm, 请求令牌桶, token令牌桶)
+        
+    def _get_buckets(self, ai_id: str, ai_config: Dict):
+        rpm = int(ai_config.get("rpm") or 0)
+        tpm = int(ai_config.get("tpm") or 0)
+        entry = self._buckets.get(ai_id)
+        if entry is None or entry[:2] != (rpm, tpm):
+            # 配置变化时重建令牌桶
+            entry = (rpm, tpm, TokenBucket(rpm) if rpm else None, TokenBucket(tpm) if tpm else None)
+            self._buckets[ai_id] = entry
+        return entry[2], entry[3]
+        
+    async def acquire(self, ai_id: str, ai_config: Dict, tokens: int) -> float:
+        """等待请求额度和token额度，返回被限流等待的秒数"""
+        request_bucket, token_bucket = self._get_buckets(ai_id, ai_config)
+        waited = 0.0
+        if request_bucket:
+            waited += await request_bucket.acquire(1)
+        if token_bucket:
+            waited += await token_bucket.acquire(tokens)
+        return waited
+
+class RetryPolicy:
+    """对限流(429)、服务端错误(5xx)和网络错误按带抖动的指数退避重试，并遵守Retry-After"""
+    
+    def __init__(self, settings: Dict = None):
+        self.configure(settings)
+        
+    def configure(self, settings: Dict = None):
+        self.settings = dict(DEFAULT_RETRY_SETTINGS)
+        self.settings.update(settings or {})
+        
+    @staticmethod
+    def is_retryable(error: Exception) -> bool:
+        if isinstance(error, openai.APIConnectionError):
+            return True
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code in (408, 409, 429) or error.status_code >= 500
+        return False
+        
+    @classmethod
+    def is_transient(cls, error: BaseException) -> bool:
+        """判断错误是否来自网络、超时、限流或服务端（沿异常链查找被包装的原始错误）"""
+        seen = set()
+        while error is not None and id(error) not in seen:
+            seen.add(id(error))
+            if isinstance(error, (httpx.TransportError, asyncio.TimeoutError, TimeoutError)) or cls.is_retryable(error):
+                return True
+            error = error.__cause__ or error.__context__
+        return False
+        
+    @staticmethod
+    def retry_after(error: Exception) -> Optional[float]:
+        """从响应头中读取服务端要求的等待时间（秒）"""
+        response = getattr(error, "response", None)
+        if response is None:
+            return None
+        headers = response.headers
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000
+            value = headers.get("retry-after")
+            if not value:
+                return None
+            try:
+                return float(value)
+            except ValueError:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+            
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """计算第attempt次重试前的等待时间（full jitter）；服务端给出Retry-After时按其要求等待"""
+        if retry_after is not None:
+            return retry_after
+        ceiling = min(self.settings["max_delay"], self.settings["base_delay"] * (2 ** attempt))
+        return random.uniform(0, ceiling)
+        
+    async def call(self, ai_id: str, func: Callable[[], Awaitable], record=None):
+        """执行请求，遇到可重试的错误时退避后重试；record为本次请求的统计记录（可选）"""
+        attempt = 0
+        while True:
+            try:
+                return await func()
+            except Exception as e:
+                if attempt >= self.settings["max_retries"] or not self.is_retryable(e):
+                    raise
+                retry_after = self.retry_after(e)
+                # 服务端要求等待的时间超过单次等待上限时不再重试，直接报告错误（提前重试只会再次被限流）
+                if retry_after is not None and retry_after > self.settings["max_delay"]:
+                    raise
+                delay = self.backoff(attempt, retry_after)
+                if record is not None:
+                    record.retries += 1
+                attempt += 1
+                await asyncio.sleep(delay)
\ No newline at end of file
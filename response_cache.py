@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Optional
+
+# 响应缓存默认参数，可通过配置文件中的"response_cache"项覆盖
+DEFAULT_CACHE_SETTINGS = {
+    "enabled": False,       # 是否启用缓存
+    "ttl": 86400,           # 缓存有效期（秒）
+    "max_entries": 256,     # 内存中最多保留的条目数
+    "max_disk_mb": 20       # 磁盘缓存总大小上限（MB）
+}
+
+class ResponseCache:
+    """AI响应缓存：内存LRU加磁盘持久化，按模型、地址、消息和采样参数索引"""
+    
+    def __init__(self, cache_dir: str, settings: Dict = None):
+        self.cache_dir = cache_dir
+        self.settings = dict(DEFAULT_CACHE_SETTINGS)
+        self.settings.update(settings or {})
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (创建时间, 响应文本)
+        self._disk_index = None       # key -> (文件大小, 创建时间)，首次访问磁盘时加载
+        self.hits = 0
+        self.misses = 0
+        
+    @property
+    def enabled(self) -> bool:
+        return bool(self.settings.get("enabled"))
+        
+    def configure(self, settings: Dict = None):
+        """更新缓存参数"""
+        with self._lock:
+            self.settings = dict(DEFAULT_CACHE_SETTINGS)
+            self.settings.update(settings or {})
+            self._trim_memory()
+            
+    @staticmethod
+    def make_key(model: str, base_url: str, messages: List[Dict[str, str]], **params) -> str:
+        """根据模型、接口地址、规范化后的消息列表和采样参数生成缓存键"""
+        normalized = [
+            [m.get("role", ""), " ".join(str(m.get("content", "")).split())]
+            for m in messages
+        ]
+        payload = json.dumps(
+            {"model": model, "base_url": base_url.rstrip("/"), "messages": normalized, "params": params},
+            ensure_ascii=False, sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+        
+    def _expired(self, created: float) -> bool:
+        return time.time() - created > self.settings["ttl"]
+        
+    def get(self, key: str) -> Optional[str]:
+        """查询缓存，未命中或已过期返回None"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[0]):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._memory[key]
+                
+            entry = self._read_disk(key)
+            if entry is not None:
+                self._memory[key] = entry
+                self._trim_memory()
+                self.hits += 1
+                return entry[1]
+                
+            self.misses += 1
+            return None
+            
+    def put(self, key: str, response: str):
+        """写入缓存"""
+        created = time.time()
+        with self._lock:
+            self._memory[key] = (created, response)
+            self._memory.move_to_end(key)
+            self._trim_memory()
+            self._write_disk(key, created, response)
+            
+    def _trim_memory(self):
+        """按LRU淘汰超出数量上限的内存条目（调用方需持有锁）"""
+        while len(self._memory) > self.settings["max_entries"]:
+            self._memory.popitem(last=False)
+            
+    def _load_disk_index(self):
+        """扫描缓存目录建立磁盘索引（调用方需持有锁）"""
+        if self._disk_index is not None:
+            return
+        self._disk_index = {}
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith(".json"):
+                stat = os.stat(os.path.join(self.cache_dir, filename))
+                self._disk_index[filename[:-5]] = (stat.st_size, stat.st_mtime)
+                
+    def _read_disk(self, key: str):
+        """从磁盘读取缓存条目（调用方需持有锁）"""
+        self._load_disk_index()
+        if key not in self._disk_index:
+            return None
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            entry = (data["created"], data["response"])
+        except (OSError, ValueError, KeyError):
+            self._remove_disk(key)
+            return None
+        if self._expired(entry[0]):
+            self._remove_disk(key)
+            return None
+        return entry
+        
+    def _write_disk(self, key: str, created: float, response: str):
+        """写入磁盘并按总大小淘汰最旧的条目（调用方需持有锁）"""
+        self._load_disk_index()
+        data = json.dumps({"created": created, "response": response}, ensure_ascii=False)
+        try:
+            with open(self._path(key), 'w', encoding='utf-8') as f:
+                f.write(data)
+        except OSError as e:
+            print(f"写入响应缓存时出错: {e}")
+            return
+        self._disk_index[key] = (len(data.encode("utf-8")), created)
+        
+        max_bytes = self.settings["max_disk_mb"] * 1024 * 1024
+        total = sum(size for size, _ in self._disk_index.values())
+        if total <= max_bytes:
+            return
+        for old_key, (size, _) in sorted(self._disk_index.items(), key=lambda item: item[1][1]):
+            if total <= max_bytes or old_key == key:
+                break
+            self._remove_disk(old_key)
+            total -= size
+            
+    def _remove_disk(self, key: str):
+        """删除磁盘缓存条目（调用方需持有锁）"""
+        self._disk_index.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+            
+    def clear(self):
+        """清空所有缓存"""
+        with self._lock:
+            self._memory.clear()
+            self._load_disk_index()
+            for key in list(self._disk_index):
+                self._remove_disk(key)
+                
+    def stats(self) -> Dict:
+        """返回命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": len(self._disk_index or {})
+            }
\ No newline at end of file
@@ -0,0 +1,243 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+from config import DATA_DIR # 导入绝对路径
+
+# 中日韩文字（不含标点）按单字和相邻双字切分，其余按字母数字组成的词切分
+_CJK_CHARS = r"\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+_TOKEN_RE = re.compile(rf"[{_CJK_CHARS}]+|[0-9a-z_]+")
+_CJK_RUN_RE = re.compile(rf"[{_CJK_CHARS}]")
+
+# 分词规则变化时加一，已有索引会在下次启动时重建
+INDEX_VERSION = 1
+
+# 索引只保存每条消息的位置和内容摘要值，不保存消息内容；
+# search_fts是无内容(contentless)的FTS5表，写入的是tokenize()切分好的词，由ascii分词器按空格拆开
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS search_sessions (
+    session_id TEXT PRIMARY KEY,
+    timestamp TEXT NOT NULL DEFAULT '',
+    title TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS search_docs (
+    doc_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    digest INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_search_docs_session ON search_docs (session_id, position);
+CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(terms, content='', tokenize="ascii tokenchars '_'");
+"""
+
+def tokenize(text: str) -> List[str]:
+    """把文本切分为索引词：英文数字按词（小写），中日韩文字输出单字和双字"""
+    tokens = []
+    for run in _TOKEN_RE.findall(text.lower()):
+        if _CJK_RUN_RE.match(run):
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+def query_terms(query: str) -> List[str]:
+    """把查询切分为检索词：中日韩文字超过一个字时只用双字，使结果接近短语匹配"""
+    terms = []
+    for run in _TOKEN_RE.findall(query.lower()):
+        if _CJK_RUN_RE.match(run) and len(run) > 1:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            terms.append(run)
+    # 去重并保持顺序
+    return list(dict.fromkeys(terms))
+
+def _digest(content: str) -> int:
+    """消息内容的64位摘要值，用于判断已索引的消息是否被修改"""
+    return int.from_bytes(hashlib.blake2b(content.encode('utf-8'), digest_size=8).digest(), "big", signed=True)
+
+class SearchIndex:
+    """聊天记录的持久化全文索引（SQLite FTS5，按BM25排序）：每条消息是一个文档，保存时增量更新，
+    启动时只重新索引有变化的会话；搜索结果的摘要按需从聊天记录中读取"""
+    
+    SNIPPET_CHARS = 60
+    # 失效文档（被修改或删除的消息仍留在FTS表中）超过该数量且多于有效文档时，启动同步时重建索引
+    COMPACT_MIN_STALE = 1000
+    
+    def __init__(self, db_path: str, history_manager):
+        self.db_path = db_path
+        self.history_manager = history_manager
+        self._lock = threading.Lock()
+        self.ready = False
+        if not os.path.exists(os.path.dirname(self.db_path)):
+            os.makedirs(os.path.dirname(self.db_path))
+        # 连接在保存会话的线程、同步线程和界面线程之间共享，由_lock保证串行访问
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        if self._get_meta("version") != INDEX_VERSION:
+            self.clear()
+            
+    def _get_meta(self, key: str) -> Optional[int]:
+        row = self._conn.execute("SELECT value FROM search_meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+        
+    def _set_meta(self, key: str, value: int):
+        self._conn.execute("INSERT OR REPLACE INTO search_meta (key, value) VALUES (?, ?)", (key, value))
+        
+    def _drop_docs(self, session_id: str):
+        """删除会话的文档记录（调用方需持有锁并在事务中）；无内容的FTS表无法单独删除，对应的词条留作失效文档"""
+        removed = self._conn.execute("DELETE FROM search_docs WHERE session_id = ?", (session_id,)).rowcount
+        if removed:
+            self._set_meta("stale", (self._get_meta("stale") or 0) + removed)
+            
+    def update_session(self, session_id: str, messages: List[Dict[str, str]], timestamp: str = None):
+        """会话保存后调用：只索引新增的消息，已有消息变化时重建该会话的索引"""
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT digest FROM search_docs WHERE session_id = ? ORDER BY position", (session_id,)
+            ).fetchall()
+            start = 0
+            if rows:
+                indexed = [row[0] for row in rows]
+                if indexed == [_digest(message.get("content") or "") for message in messages[:len(indexed)]]:
+                    start = len(indexed)
+                else:
+                    self._drop_docs(session_id)
+            for position in range(start, len(messages)):
+                message = messages[position]
+                content = message.get("content") or ""
+                doc_id = self._conn.execute(
+                    "INSERT INTO search_docs (session_id, position, role, digest) VALUES (?, ?, ?, ?)",
+                    (session_id, position, message.get("role", ""), _digest(content))
+                ).lastrowid
+                self._conn.execute("INSERT INTO search_fts (rowid, terms) VALUES (?, ?)",
+                                   (doc_id, " ".join(tokenize(content))))
+            title = messages[0].get("content", "")[:30] + "..." if messages else ""
+            self._conn.execute(
+                "INSERT OR REPLACE INTO search_sessions (session_id, timestamp, title) VALUES (?, ?, ?)",
+                (session_id, timestamp or "", title)
+            )
+            
+    def remove_session(self, session_id: str):
+        with self._lock, self._conn:
+            self._drop_docs(session_id)
+            self._conn.execute("DELETE FROM search_sessions WHERE session_id = ?", (session_id,))
+            
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT INTO search_fts (search_fts) VALUES ('delete-all')")
+            self._conn.execute("DELETE FROM search_docs")
+            self._conn.execute("DELETE FROM search_sessions")
+            self._conn.execute("DELETE FROM search_meta")
+            self._set_meta("version", INDEX_VERSION)
+            
+    def _needs_compaction(self) -> bool:
+        with self._lock:
+            stale = self._get_meta("stale") or 0
+            live = self._conn.execute("SELECT COUNT(*) FROM search_docs").fetchone()[0]
+        return stale >= self.COMPACT_MIN_STALE and stale > live
+        
+    def sync(self):
+        """启动时在后台线程中运行：只重新索引新增或更新时间变化的会话，删除已不存在的会话"""
+        start = time.perf_counter()
+        if self._needs_compaction():
+            self.clear()
+        with self._lock:
+            indexed = dict(self._conn.execute("SELECT session_id, timestamp FROM search_sessions").fetchall())
+        sessions = self.history_manager.get_all_sessions()
+        for session_id in set(indexed) - {info["session_id"] for info in sessions}:
+            self.remove_session(session_id)
+            
+        count = 0
+        for info in sessions:
+            session_id, timestamp = info["session_id"], info["timestamp"] or ""
+            if indexed.get(session_id) == timestamp:
+                continue
+            messages = self.history_manager.peek_session(session_id)
+            if messages is None:
+                continue
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT timestamp FROM search_sessions WHERE session_id = ?", (session_id,)
+                ).fetchone()
+            # 同步期间保存过的会话已是最新，不要用读到的旧内容覆盖
+            if row and row[0] >= timestamp:
+                continue
+            self.update_session(session_id, messages, timestamp)
+            count += 1
+        self.ready = True
+        print(f"搜索索引已同步：更新 {count} 个会话，用时 {time.perf_counter() - start:.2f} 秒")
+        
+    def _snippet(self, content: str, terms: List[str]) -> str:
+        """截取第一个命中词附近的文本作为摘要"""
+        lowered = content.lower()
+        positions = [p for p in (lowered.find(term) for term in terms) if p >= 0]
+        center = min(positions) if positions else 0
+        start = max(0, center - self.SNIPPET_CHARS // 3)
+        end = start + self.SNIPPET_CHARS
+        snippet = " ".join(content[start:end].split())
+        return ("…" if start > 0 else "") + snippet + ("…" if end < len(content) else "")
+        
+    def search(self, query: str, limit: int = 50) -> List[Dict]:
+        """搜索包含全部检索词的消息，按BM25得分排序，返回会话、消息序号和摘要（可能读取磁盘，不要在界面线程调用）"""
+        terms = query_terms(query)
+        if not terms:
+            return []
+        match = " AND ".join(f'"{term}"' for term in terms)
+        with self._lock:
+            # 失效文档在search_docs中已没有对应记录，连接时被排除
+            rows = self._conn.execute(
+                "SELECT d.session_id, d.position, d.role, -bm25(search_fts), s.title, s.timestamp "
+                "FROM search_fts JOIN search_docs d ON d.doc_id = search_fts.rowid "
+                "LEFT JOIN search_sessions s ON s.session_id = d.session_id "
+                "WHERE search_fts MATCH ? ORDER BY bm25(search_fts) LIMIT ?",
+                (match, limit)
+            ).fetchall()
+            
+        # 摘要在锁外按会话读取消息生成
+        messages_of = {}
+        results = []
+        for session_id, position, role, score, title, timestamp in rows:
+            if session_id not in messages_of:
+                messages_of[session_id] = self.history_manager.peek_session(session_id) or []
+            messages = messages_of[session_id]
+            content = (messages[position].get("content") or "") if position < len(messages) else ""
+            results.append({
+                "session_id": session_id,
+                "message_index": position,
+                "role": role,
+                "score": score,
+                "title": title or "",
+                "timestamp": timestamp or "",
+                "snippet": self._snippet(content, terms)
+            })
+        return results
+        
+    def stats(self) -> Dict:
+        with self._lock:
+            sessions = self._conn.execute("SELECT COUNT(*) FROM search_sessions").fetchone()[0]
+            messages = self._conn.execute("SELECT COUNT(*) FROM search_docs").fetchone()[0]
+            stale = self._get_meta("stale") or 0
+        return {"sessions": sessions, "messages": messages, "stale": stale, "ready": self.ready}
+        
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+def create_search_index(history_manager) -> SearchIndex:
+    """为聊天记录存储创建搜索索引：SQLite存储与聊天记录共用数据库文件，JSON存储使用单独的索引文件"""
+    db_path = getattr(history_manager, "db_path", None) or os.path.join(DATA_DIR, "search_index.db")
+    search_index = SearchIndex(db_path, history_manager)
+    history_manager.search_index = search_index
+    return search_index
\ No newline at end of file
@@ -0,0 +1,165 @@
+import gzip
+import json
+import lzma
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from atomic_io import atomic_write_json, load_json
+
+# 归档与保留策略默认参数，可通过配置文件中的"archive"项覆盖
+DEFAULT_ARCHIVE_SETTINGS = {
+    "enabled": False,           # 是否启用后台归档和清理
+    "archive_after_days": 30,   # 超过多少天未更新的会话压缩归档（0表示不归档）
+    "codec": "gzip",            # 压缩方式：gzip 或 lzma
+    "max_sessions": 0,          # 最多保留的会话数（0表示不限制）
+    "max_age_days": 0,          # 超过多少天的会话直接删除（0表示不限制）
+    "max_total_mb": 0,          # 聊天记录（含归档）占用的空间上限（0表示不限制）
+    "sweep_interval": 3600      # 后台检查间隔（秒）
+}
+
+# 压缩方式 -> (文件扩展名, 压缩函数, 解压函数)
+CODECS = {
+    "gzip": (".gz", gzip.compress, gzip.decompress),
+    "lzma": (".xz", lzma.compress, lzma.decompress)
+}
+
+INDEX_VERSION = 1
+
+class SessionArchive:
+    """冷会话归档：每个会话单独压缩后追加到归档文件中，索引记录偏移和长度，读取时只解压一个会话"""
+    
+    def __init__(self, archive_dir: str):
+        self.archive_dir = archive_dir
+        self.index_file = os.path.join(archive_dir, "index.json")
+        self._index = None
+        self._lock = threading.RLock()
+        
+    def _load_index(self) -> Dict[str, Dict]:
+        """读取归档索引（调用方需持有锁）"""
+        if self._index is None:
+            index = load_json(self.index_file) if os.path.exists(self.index_file) else None
+            if not isinstance(index, dict) or index.get("version") != INDEX_VERSION:
+                index = {"version": INDEX_VERSION, "sessions": {}}
+            self._index = index
+        return self._index["sessions"]
+        
+    def _save_index(self):
+        """原子地写入归档索引（调用方需持有锁）"""
+        atomic_write_json(self.index_file, self._index)
+        
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._load_index()
+            
+    def entries(self) -> Dict[str, Dict]:
+        """返回所有归档会话的索引项：{"file", "offset", "length", "codec", "title", "timestamp", "messages"}"""
+        with self._lock:
+            return {session_id: dict(entry) for session_id, entry in self._load_index().items()}
+            
+    def get(self, session_id: str) -> Optional[Dict]:
+        """解压并返回一个归档会话的数据，不存在时返回None"""
+        with self._lock:
+            entry = self._load_index().get(session_id)
+            if entry is None:
+                return None
+            # 持锁读取，避免与整理归档文件同时进行
+            with open(os.path.join(self.archive_dir, entry["file"]), 'rb') as f:
+                f.seek(entry["offset"])
+                blob = f.read(entry["length"])
+        return json.loads(CODECS[entry["codec"]][2](blob).decode('utf-8'))
+        
+    def add(self, sessions: Iterable[Tuple[str, Dict, Dict]], codec: str = "gzip") -> List[str]:
+        """把会话追加到本月的归档文件，sessions为(session_id, 会话数据, 列表信息)，返回已归档的会话"""
+        if codec not in CODECS:
+            codec = "gzip"
+        extension, compress, _ = CODECS[codec]
+        filename = f"sessions-{datetime.now().strftime('%Y%m')}{extension}"
+        path = os.path.join(self.archive_dir, filename)
+        archived = []
+        with self._lock:
+            index = self._load_index()
+            os.makedirs(self.archive_dir, exist_ok=True)
+            with open(path, 'ab') as f:
+                for session_id, data, info in sessions:
+                    blob = compress(json.dumps(data, ensure_ascii=False).encode('utf-8'))
+                    offset = f.tell()
+                    f.write(blob)
+                    index[session_id] = {
+                        "file": filename,
+                        "offset": offset,
+                        "length": len(blob),
+                        "codec": codec,
+                        "title": info.get("title", ""),
+                        "timestamp": info.get("timestamp"),
+                        "messages": len(data.get("messages", []))
+                    }
+                    archived.append(session_id)
+                # 归档数据落盘后再写索引，崩溃时最多留下无人引用的数据
+                f.flush()
+                os.fsync(f.fileno())
+            if archived:
+                self._save_index()
+        return archived
+        
+    def remove(self, session_ids: Iterable[str]):
+        """从归档中删除会话（数据在整理归档文件时回收）"""
+        with self._lock:
+            index = self._load_index()
+            removed = [session_id for session_id in session_ids if index.pop(session_id, None) is not None]
+            if removed:
+                self._save_index()
+                
+    def compact(self, min_live_ratio: float = 0.5):
+        """整理归档文件：删除不再被引用的文件，有效数据比例过低的文件重写"""
+        with self._lock:
+            index = self._load_index()
+            if not os.path.isdir(self.archive_dir):
+                return
+            by_file: Dict[str, List[str]] = {}
+            for session_id, entry in index.items():
+                by_file.setdefault(entry["file"], []).append(session_id)
+                
+            obsolete = []
+            for filename in os.listdir(self.archive_dir):
+                if filename.startswith(os.path.basename(self.index_file)) or filename.startswith("."):
+                    continue
+                path = os.path.join(self.archive_dir, filename)
+                session_ids = by_file.get(filename, [])
+                if not session_ids:
+                    os.remove(path)
+                    continue
+                live = sum(index[session_id]["length"] for session_id in session_ids)
+                if live >= os.path.getsize(path) * min_live_ratio:
+                    continue
+                    
+                # 只把仍被引用的数据复制到新文件，索引写入后再删除原文件
+                base, extension = os.path.splitext(filename)
+                new_filename = f"{base.split('.')[0]}.{datetime.now().strftime('%Y%m%d%H%M%S%f')}{extension}"
+                with open(path, 'rb') as src, open(os.path.join(self.archive_dir, new_filename), 'wb') as dst:
+                    for session_id in sorted(session_ids, key=lambda i: index[i]["offset"]):
+                        entry = index[session_id]
+                        src.seek(entry["offset"])
+                        blob = src.read(entry["length"])
+                        entry.update(file=new_filename, offset=dst.tell())
+                        dst.write(blob)
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                obsolete.append(path)
+                
+            if obsolete:
+                self._save_index()
+                for path in obsolete:
+                    os.remove(path)
+                    
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(entry["length"] for entry in self._load_index().values())
+            
+    def clear(self):
+        """删除全部归档"""
+        with self._lock:
+            self._index = {"version": INDEX_VERSION, "sessions": {}}
+            if os.path.isdir(self.archive_dir):
+                for filename in os.listdir(self.archive_dir):
+                    os.remove(os.path.join(self.archive_dir, filename))
\ No newline at end of file
@@ -0,0 +1,69 @@
+import asyncio
+from typing import List, Dict
+
+# 滚动摘要默认参数，可通过配置文件中的"summarization"项覆盖
+DEFAULT_SUMMARY_SETTINGS = {
+    "enabled": False,       # 是否启用滚动摘要
+    "threshold": 20,        # 未摘要的旧消息达到该数量时刷新摘要
+    "keep_recent": 8,       # 始终原样发送的最近消息数
+    "max_summary_tokens": 600
+}
+
+SUMMARY_PROMPT = "请把下面的对话内容合并进已有摘要，输出一份简洁的新摘要。保留关键事实、结论、用户偏好和未解决的问题，不要添加评论。"
+
+class SessionSummarizer:
+    """为长对话维护滚动摘要：发送"摘要+最近消息"，并在后台增量刷新摘要"""
+    
+    def __init__(self, api_manager, history_manager, config_manager):
+        self.api_manager = api_manager
+        self.history_manager = history_manager
+        self.config_manager = config_manager
+        self._running = set()  # 正在刷新摘要的会话
+        
+    @property
+    def settings(self) -> Dict:
+        settings = dict(DEFAULT_SUMMARY_SETTINGS)
+        settings.update(self.config_manager.get("summarization") or {})
+        return settings
+        
+    def build_context(self, session_id: str, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """构造要发送的消息：已有摘要作为系统消息，后面接未被摘要的消息"""
+        if not self.settings["enabled"]:
+            return messages
+        summary = self.history_manager.get_summary(session_id)
+        if not summary or not summary.get("text"):
+            return messages
+        covered = min(summary.get("covered", 0), len(messages))
+        return [{"role": "system", "content": f"以下是之前对话的摘要：\n{summary['text']}"}] + messages[covered:]
+        
+    def maybe_refresh(self, session_id: str, messages: List[Dict[str, str]]):
+        """未摘要部分超过阈值时在后台刷新摘要（每个会话同一时间只运行一个任务）"""
+        settings = self.settings
+        if not settings["enabled"] or not session_id or session_id in self._running:
+            return
+        summary = self.history_manager.get_summary(session_id) or {}
+        covered = summary.get("covered", 0)
+        target = len(messages) - settings["keep_recent"]
+        if target - covered < settings["threshold"]:
+            return
+        self._running.add(session_id)
+        self.api_manager.submit(self._refresh(session_id, summary.get("text", ""), list(messages[covered:target]),
+                                              target, settings["max_summary_tokens"]))
+        
+    async def _refresh(self, session_id: str, previous: str, new_messages: List[Dict[str, str]],
+                       covered: int, max_tokens: int):
+        """把新消息合并进已有摘要并保存"""
+        try:
+            transcript = "\n".join(
+                f"{'用户' if m['role'] == 'user' else 'AI'}: {m['content']}" for m in new_messages
+            )
+            request = [
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": f"已有摘要：\n{previous or '（无）'}\n\n新增对话：\n{transcript}"}
+            ]
+            text = await self.api_manager.aget_response(request, max_tokens=max_tokens)
+            await asyncio.to_thread(self.history_manager.save_summary, session_id, text, covered)
+        except Exception as e:
+            print(f"生成对话摘要时出错: {e}")
+        finally:
+            self._running.discard(session_id)
\ No newline at end of file
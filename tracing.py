@@ -0,0 +1,136 @@
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List
+from atomic_io import atomic_write_json
+
+# 性能追踪默认参数，可通过配置文件中的"tracing"项覆盖
+DEFAULT_TRACING_SETTINGS = {
+    "enabled": False,       # 是否记录追踪（关闭时几乎没有开销）
+    "buffer_size": 20000    # 环形缓冲区最多保留的事件数，超出后丢弃最早的事件
+}
+
+# 每轮对话使用单独的一行（虚拟线程ID），与真实线程ID区分
+TRACK_BASE = 1 << 30
+
+# 当前任务所属的追踪行，asyncio任务和to_thread创建的线程会继承
+_current_track = contextvars.ContextVar("trace_track", default=None)
+
+class Tracer:
+    """把各阶段的耗时记录为Chrome trace事件（可在chrome://tracing或Perfetto中打开）"""
+    
+    def __init__(self, settings: Dict = None):
+        self._lock = threading.Lock()
+        self._events = deque(maxlen=DEFAULT_TRACING_SETTINGS["buffer_size"])
+        self._track_names: Dict[int, str] = {}
+        self._next_track = 0
+        self._pid = os.getpid()
+        self.configure(settings)
+        
+    def configure(self, settings: Dict = None):
+        self.settings = dict(DEFAULT_TRACING_SETTINGS)
+        self.settings.update(settings or {})
+        self.enabled = bool(self.settings["enabled"])
+        size = max(100, int(self.settings["buffer_size"]))
+        if size != self._events.maxlen:
+            with self._lock:
+                self._events = deque(self._events, maxlen=size)
+                
+    @staticmethod
+    def now() -> float:
+        return time.perf_counter()
+        
+    def _tid(self) -> int:
+        """当前事件所属的行：优先使用所在的对话行，否则使用真实线程"""
+        track = _current_track.get()
+        if track is not None:
+            return track
+        tid = threading.get_native_id()
+        if tid not in self._track_names:
+            with self._lock:
+                self._track_names[tid] = threading.current_thread().name
+        return tid
+        
+    def add(self, name: str, start: float, end: float = None, cat: str = "app", **args):
+        """记录一个已结束的阶段，start/end为Tracer.now()的返回值（end默认为现在）"""
+        if not self.enabled:
+            return
+        if end is None:
+            end = time.perf_counter()
+        event = {"name": name, "cat": cat, "ph": "X", "ts": round(start * 1e6, 1),
+                 "dur": round((end - start) * 1e6, 1), "pid": self._pid, "tid": self._tid()}
+        if args:
+            event["args"] = args
+        with self._lock:
+            self._events.append(event)
+            
+    def instant(self, name: str, cat: str = "app", **args):
+        """记录一个时间点事件"""
+        if not self.enabled:
+            return
+        event = {"name": name, "cat": cat, "ph": "i", "s": "t", "ts": round(time.perf_counter() * 1e6, 1),
+                 "pid": self._pid, "tid": self._tid()}
+        if args:
+            event["args"] = args
+        with self._lock:
+            self._events.append(event)
+            
+    @contextmanager
+    def span(self, name: str, cat: str = "app", **args):
+        """记录with块的耗时，块内抛出异常时在参数中记录异常类型"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            args["error"] = type(e).__name__
+            raise
+        finally:
+            self.add(name, start, cat=cat, **args)
+            
+    @contextmanager
+    def track(self, name: str):
+        """把with块内（包括其中创建的任务和线程）记录的事件放到名为name的单独一行"""
+        if not self.enabled:
+            yield
+            return
+        with self._lock:
+            self._next_track += 1
+            tid = TRACK_BASE + self._next_track
+            self._track_names[tid] = name
+        token = _current_track.set(tid)
+        try:
+            yield
+        finally:
+            _current_track.reset(token)
+            
+    def events(self) -> List[Dict]:
+        with self._lock:
+            return list(self._events)
+            
+    def dump(self, path: str) -> int:
+        """把缓冲区中的事件写成Chrome trace JSON文件，返回事件数"""
+        with self._lock:
+            events = list(self._events)
+            used = {event["tid"] for event in events}
+            names = {tid: name for tid, name in self._track_names.items() if tid in used}
+            # 只保留仍被引用的行名，避免长时间运行后无限增长
+            self._track_names = {tid: name for tid, name in self._track_names.items()
+                                 if tid in used or tid < TRACK_BASE}
+        metadata = [{"name": "process_name", "ph": "M", "pid": self._pid, "args": {"name": "chatbox"}}]
+        for tid, name in names.items():
+            metadata.append({"name": "thread_name", "ph": "M", "pid": self._pid, "tid": tid, "args": {"name": name}})
+            # 对话行排在真实线程之后
+            metadata.append({"name": "thread_sort_index", "ph": "M", "pid": self._pid, "tid": tid,
+                             "args": {"sort_index": tid - TRACK_BASE if tid >= TRACK_BASE else -1}})
+        atomic_write_json(path, {"traceEvents": metadata + events, "displayTimeUnit": "ms"}, fsync=False)
+        return len(events)
+        
+    def clear(self):
+        with self._lock:
+            self._events.clear()
\ No newline at end of file
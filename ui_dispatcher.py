@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict
+
+class UIDispatcher:
+    """线程安全的界面更新队列：在Tk线程中按固定帧间隔批量执行回调，并合并连续的文本追加"""
+    
+    def __init__(self, root, interval_ms: int = 16):
+        self.root = root
+        self.interval_ms = max(1, int(interval_ms))
+        # 每帧执行回调的时间预算，超出后剩余的回调留到下一帧，避免界面卡顿
+        self.frame_budget = self.interval_ms * 0.75 / 1000
+        # 队列项：[回调, 参数, 追加的文本或None]
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._running = False
+        
+        # 统计信息
+        self._frame_times = deque(maxlen=300)
+        self.frames = 0
+        self.late_frames = 0
+        self.posted = 0
+        self.merged = 0
+        self.executed = 0
+        self.max_depth = 0
+        
+    def start(self):
+        if not self._running:
+            self._running = True
+            self.root.after(self.interval_ms, self._frame)
+            
+    def stop(self):
+        self._running = False
+        
+    def _enqueue(self, item):
+        """加入队列（调用方需持有锁）"""
+        self._queue.append(item)
+        self.posted += 1
+        self.max_depth = max(self.max_depth, len(self._queue))
+        
+    def post(self, func: Callable, *args):
+        """从任意线程安排在Tk线程中执行的回调"""
+        with self._lock:
+            self._enqueue([func, args, None])
+            
+    def post_append(self, func: Callable, key_args: tuple, text: str):
+        """安排执行func(*key_args, text)；与队尾相同回调和参数的追加合并为一次调用"""
+        with self._lock:
+            if self._queue:
+                last = self._queue[-1]
+                if last[2] is not None and last[0] == func and last[1] == key_args:
+                    last[2] += text
+                    self.posted += 1
+                    self.merged += 1
+                    return
+            self._enqueue([func, key_args, text])
+            
+    def _frame(self):
+        """执行一帧：按顺序执行排队的回调，超出时间预算时把剩余的留到下一帧"""
+        start = time.perf_counter()
+        with self._lock:
+            items = list(self._queue)
+            self._queue.clear()
+            
+        for index, (func, args, text) in enumerate(items):
+            try:
+                if text is None:
+                    func(*args)
+                else:
+                    func(*args, text)
+            except Exception as e:
+                print(f"执行界面回调时出错: {e}")
+            self.executed += 1
+            if time.perf_counter() - start > self.frame_budget and index + 1 < len(items):
+                with self._lock:
+                    self._queue.extendleft(reversed(items[index + 1:]))
+                break
+                
+        elapsed = time.perf_counter() - start
+        self._frame_times.append(elapsed)
+        self.frames += 1
+        if elapsed * 1000 > self.interval_ms:
+            self.late_frames += 1
+        if self._running:
+            self.root.after(self.interval_ms, self._frame)
+            
+    def stats(self) -> Dict:
+        """队列深度和帧耗时统计（毫秒）"""
+        with self._lock:
+            depth = len(self._queue)
+        times = sorted(self._frame_times)
+        if times:
+            avg = sum(times) / len(times) * 1000
+            p95 = times[min(len(times) - 1, int(len(times) * 0.95))] * 1000
+            worst = times[-1] * 1000
+        else:
+            avg = p95 = worst = 0.0
+        return {
+            "queue_depth": depth,
+            "max_queue_depth": self.max_depth,
+            "frames": self.frames,
+            "late_frames": self.late_frames,
+            "frame_ms_avg": round(avg, 2),
+            "frame_ms_p95": round(p95, 2),
+            "frame_ms_max": round(worst, 2),
+            "posted": self.posted,
+            "merged": self.merged,
+            "executed": self.executed
+        }
\ No newline at end of file